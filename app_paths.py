@@ -0,0 +1,15 @@
+import os
+import sys
+
+APP_NAME = 'UniversalConverter'
+
+
+def config_dir():
+    """Returns (and creates) the per-user directory for saved settings."""
+    if sys.platform == 'win32':
+        base = os.environ.get('APPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    path = os.path.join(base, APP_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
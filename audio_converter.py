@@ -1,35 +1,76 @@
-import os
-from pydub import AudioSegment
+from ffmpeg_runner import run_ffmpeg, FFmpegError
+from audio_profiles import encoder_args
+from conversion_result import ConversionResult
+from output_writer import reserve
 
-def convert_audio(input_path, output_dir, to_format, settings=None):
+def convert_audio(input_path, output_dir, to_format, settings=None, cache=None,
+                  progress_callback=None, cancel_event=None):
+    """
+    Converts an audio file by piping it through FFmpeg.
+
+    FFmpeg decodes and encodes in small blocks, so memory use stays constant
+    however long the track is; nothing is held as raw PCM in this process
+    and no intermediate WAV is written.
+
+    :param settings: A dictionary of conversion settings: 'bitrate', 'bitrate_mode',
+        'sample_rate', 'channels', 'bit_depth' and 'compression_level' (see audio_profiles),
+        plus 'normalize' / 'target_loudness' (LUFS) and 'trim_silence' / 'silence_threshold'
+        (dBFS) for the processing stage in audio_processing, and 'if_exists' (see output_writer).
+    :param cache: Optional ConversionCache; a hit skips FFmpeg entirely.
+    :param progress_callback: Called while encoding with a progress dict
+        (see ffmpeg_runner.build_progress).
+    :param cancel_event: A threading.Event; setting it stops FFmpeg and removes the partial output.
+    :return: A ConversionResult; truthy on success, with the encoder and its FFmpeg arguments.
+    """
     if settings is None:
         settings = {}
     to_format_lower = to_format.lower()
+    result = ConversionResult(input_path)
 
     try:
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        base_name = os.path.splitext(os.path.basename(input_path))[0]
-        output_path = os.path.join(output_dir, f"{base_name}.{to_format_lower}")
+        with reserve(input_path, output_dir, to_format_lower, settings.get('if_exists')) as output:
+            result.output_path = output.path
+            if output.existing:
+                result.skipped = True
+                return result.succeed()
+            # FFmpeg writes under a temporary name, renamed into place once it succeeds.
+            output_path = output.temp_path
 
-        i = 1
-        while os.path.exists(output_path):
-            output_path = os.path.join(output_dir, f"{base_name}-{i}.{to_format_lower}")
-            i += 1
+            with result.stage('cache'):
+                cache_key = cache.key(input_path, to_format_lower, settings) if cache else None
+                result.cached = bool(cache_key and cache.fetch(cache_key, to_format_lower, output_path))
+            if result.cached:
+                output.commit()
+                return result.succeed()
 
-        audio = AudioSegment.from_file(input_path)
+            args = encoder_args(to_format_lower, settings)
+            result.codec = args[args.index('-c:a') + 1]
+            result.params = {'args': args}
+            if settings.get('normalize') or settings.get('trim_silence'):
+                # Imported here so plain conversions do not load NumPy.
+                from audio_processing import process_and_encode
+                completed = process_and_encode(input_path, output_path, args, settings,
+                                               progress_callback, cancel_event, result)
+            else:
+                # Audio only: cover art and other video streams are dropped.
+                command = ['-i', input_path, '-vn', '-sn', '-dn'] + args + [output_path]
+                with result.stage('encode'):
+                    completed = run_ffmpeg(command, progress_callback=progress_callback, cancel_event=cancel_event)
 
-        export_params = {
-            'format': to_format_lower
-        }
-        bitrate = settings.get('bitrate')
-        if bitrate and to_format_lower == 'mp3':
-            export_params['bitrate'] = f"{bitrate}k"
+            if not completed:
+                print(f"Conversion of {input_path} cancelled.")
+                return result.fail(cancelled=True)
+            output.commit()
 
-        audio.export(output_path, **export_params)
+        if cache_key:
+            with result.stage('cache'):
+                cache.store(cache_key, to_format_lower, output.path)
 
-        return True
+        return result.succeed()
+    except FFmpegError as e:
+        print(f"Error converting {input_path} to {to_format}:")
+        print(f"FFmpeg stderr: {e.stderr}")
+        return result.fail(e)
     except Exception as e:
         print(f"Error converting {input_path} to {to_format}: {e}")
-        return False
+        return result.fail(e)
@@ -0,0 +1,259 @@
+"""
+Loudness normalization and silence trimming for convert_audio.
+
+Each file is decoded once, by FFmpeg, into a float32 spool file next to the
+output. That spool is scanned in fixed-size chunks with NumPy to measure:
+
+  * integrated loudness as in ITU-R BS.1770 / EBU R128: K-weighting (applied
+    as an FFT convolution with the filter's impulse response), mean square
+    per 100 ms, 400 ms blocks with 75% overlap, absolute (-70 LUFS) and
+    relative (-10 LU) gating;
+  * the sample peak, so the gain never pushes the signal above PEAK_CEILING;
+  * the first and last sample louder than the silence threshold.
+
+The spool is then encoded with an atrim/volume filter, so both the gain and
+the trim are applied in the same FFmpeg pass that writes the output. Memory
+use is bounded by the chunk size, whatever the length of the file.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from ffmpeg_runner import run_ffmpeg, probe, scaled_progress
+from conversion_result import ConversionResult
+
+EBU_R128_TARGET = -23.0
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+PEAK_CEILING = -1.0            # dBFS
+SILENCE_THRESHOLD = -50.0      # dBFS
+SILENCE_WINDOW = 0.01          # seconds
+SILENCE_PADDING = 0.05         # seconds of silence kept before and after the sound
+CHUNK_SUBBLOCKS = 100          # 100 ms sub-blocks per analysis chunk (10 s)
+
+# Channel weights of BS.1770 for the surround channels of a 5.1 layout
+# (FL FR FC LFE BL BR in FFmpeg's order); the LFE channel is ignored.
+SURROUND_WEIGHTS = {6: [1.0, 1.0, 1.0, 0.0, 1.41, 1.41]}
+
+
+def _biquad_response(b, a, frequencies, sample_rate):
+    z = np.exp(-2j * np.pi * frequencies / sample_rate)
+    return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+
+def k_weighting_response(frequencies, sample_rate):
+    """
+    Frequency response of the BS.1770 K-weighting filter: a +4 dB high shelf
+    around 1.5 kHz followed by a 38 Hz high-pass. Both stages are designed
+    for the actual sample rate rather than using the 48 kHz coefficients.
+    """
+    # Stage 1: high shelf (RBJ cookbook), G = +4 dB, Q = 1/sqrt(2), 1500 Hz.
+    gain = 10 ** (4.0 / 40)
+    w0 = 2 * np.pi * 1500.0 / sample_rate
+    alpha = np.sin(w0) / (2 * (1 / np.sqrt(2)))
+    cos_w0 = np.cos(w0)
+    shelf = _biquad_response(
+        [gain * ((gain + 1) + (gain - 1) * cos_w0 + 2 * np.sqrt(gain) * alpha),
+         -2 * gain * ((gain - 1) + (gain + 1) * cos_w0),
+         gain * ((gain + 1) + (gain - 1) * cos_w0 - 2 * np.sqrt(gain) * alpha)],
+        [(gain + 1) - (gain - 1) * cos_w0 + 2 * np.sqrt(gain) * alpha,
+         2 * ((gain - 1) - (gain + 1) * cos_w0),
+         (gain + 1) - (gain - 1) * cos_w0 - 2 * np.sqrt(gain) * alpha],
+        frequencies, sample_rate)
+
+    # Stage 2: high-pass, Q = 0.5, 38 Hz.
+    w0 = 2 * np.pi * 38.0 / sample_rate
+    alpha = np.sin(w0) / (2 * 0.5)
+    cos_w0 = np.cos(w0)
+    highpass = _biquad_response(
+        [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2],
+        [1 + alpha, -2 * cos_w0, 1 - alpha],
+        frequencies, sample_rate)
+    return shelf * highpass
+
+
+def k_weighting_fir(sample_rate):
+    """
+    Impulse response of the K-weighting filter, truncated to ~200 ms (the
+    38 Hz high-pass has decayed by far more than 100 dB by then).
+    """
+    grid = 1 << 16
+    response = k_weighting_response(np.fft.rfftfreq(grid, 1 / sample_rate), sample_rate)
+    length = 1 << int(np.ceil(np.log2(0.2 * sample_rate)))
+    return np.fft.irfft(response, grid)[:length]
+
+
+class LoudnessMeter:
+    """
+    Streaming BS.1770 integrated-loudness meter, sample peak and silence
+    detector. Feed it (frames, channels) float arrays with add(), in order.
+    """
+
+    def __init__(self, sample_rate, channels, silence_threshold=SILENCE_THRESHOLD):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.fir = k_weighting_fir(sample_rate)
+        self.history = np.zeros((len(self.fir) - 1, channels))
+        self.subblock = int(round(0.1 * sample_rate))
+        self.window = max(1, int(round(SILENCE_WINDOW * sample_rate)))
+        self.silence_level = 10 ** (silence_threshold / 20)
+        self.weights = np.array(SURROUND_WEIGHTS.get(channels, [1.0] * channels))
+
+        self.energies = []  # Per-channel mean square of each 100 ms sub-block.
+        self.leftover = np.zeros((0, channels))
+        self.peak = 0.0
+        self.frames = 0
+        self.first_sound = None
+        self.last_sound = None
+
+    def add(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        if not len(samples):
+            return
+        self.peak = max(self.peak, float(np.abs(samples).max()))
+        self._find_sound(samples)
+
+        # K-weight by overlap-save FFT convolution, carrying the filter history.
+        signal = np.concatenate([self.history, samples])
+        size = 1 << int(np.ceil(np.log2(len(signal) + len(self.fir) - 1)))
+        spectrum = np.fft.rfft(signal, size, axis=0) * np.fft.rfft(self.fir, size)[:, None]
+        weighted = np.fft.irfft(spectrum, size, axis=0)[len(self.fir) - 1:len(signal)]
+        self.history = signal[len(signal) - len(self.fir) + 1:]
+
+        squares = np.concatenate([self.leftover, weighted * weighted])
+        whole = len(squares) // self.subblock * self.subblock
+        if whole:
+            self.energies.append(squares[:whole].reshape(-1, self.subblock, self.channels).mean(axis=1))
+        self.leftover = squares[whole:]
+        self.frames += len(samples)
+
+    def _find_sound(self, samples):
+        # Loudest sample of every SILENCE_WINDOW, across channels.
+        count = -(-len(samples) // self.window)
+        padded = np.zeros((count * self.window, self.channels))
+        padded[:len(samples)] = np.abs(samples)
+        loud = np.flatnonzero(padded.reshape(count, -1).max(axis=1) > self.silence_level)
+        if len(loud):
+            if self.first_sound is None:
+                self.first_sound = self.frames + loud[0] * self.window
+            self.last_sound = self.frames + min((loud[-1] + 1) * self.window, len(samples))
+
+    def integrated_loudness(self):
+        """Gated integrated loudness in LUFS, or None if the audio is (nearly) silent."""
+        if not self.energies:
+            return None
+        energies = np.concatenate(self.energies)
+        if len(energies) < 4:
+            return None
+        # 400 ms blocks, one every 100 ms: the mean of 4 consecutive sub-blocks.
+        cumulative = np.concatenate([np.zeros((1, self.channels)), np.cumsum(energies, axis=0)])
+        blocks = (cumulative[4:] - cumulative[:-4]) / 4
+        power = blocks @ self.weights
+        with np.errstate(divide='ignore'):
+            loudness = -0.691 + 10 * np.log10(power)
+
+        gated = power[loudness > ABSOLUTE_GATE]
+        if not len(gated):
+            return None
+        relative_gate = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+        gated = power[(loudness > ABSOLUTE_GATE) & (loudness > relative_gate)]
+        return float(-0.691 + 10 * np.log10(gated.mean()))
+
+    def peak_db(self):
+        return 20 * np.log10(self.peak) if self.peak > 0 else None
+
+
+def analyze(spool_path, sample_rate, channels, silence_threshold=SILENCE_THRESHOLD, cancel_event=None):
+    """
+    Runs a LoudnessMeter over a raw float32 spool file, CHUNK_SUBBLOCKS
+    sub-blocks at a time. Returns the meter, or None if cancelled.
+    """
+    meter = LoudnessMeter(sample_rate, channels, silence_threshold)
+    chunk_frames = meter.subblock * CHUNK_SUBBLOCKS
+    with open(spool_path, 'rb') as f:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            data = np.fromfile(f, dtype='<f4', count=chunk_frames * channels)
+            if not len(data):
+                break
+            meter.add(data.reshape(-1, channels))
+    return meter
+
+
+def processing_filters(meter, settings):
+    """The atrim/volume filter chain for the requested processing, from a finished meter."""
+    filters = []
+    if settings.get('trim_silence') and meter.first_sound is not None:
+        padding = int(SILENCE_PADDING * meter.sample_rate)
+        start = max(0, meter.first_sound - padding)
+        end = min(meter.frames, meter.last_sound + padding)
+        if start > 0 or end < meter.frames:
+            filters.append(f"atrim=start_sample={start}:end_sample={end}")
+
+    if settings.get('normalize'):
+        loudness = meter.integrated_loudness()
+        if loudness is not None:
+            target = float(settings.get('target_loudness') or EBU_R128_TARGET)
+            gain = target - loudness
+            peak = meter.peak_db()
+            if peak is not None:
+                gain = min(gain, PEAK_CEILING - peak)
+            filters.append(f"volume={gain:.2f}dB")
+    return filters
+
+
+def process_and_encode(input_path, output_path, encode_args, settings,
+                       progress_callback=None, cancel_event=None, result=None):
+    """
+    Decodes `input_path` once, measures it, and encodes it to `output_path`
+    with the trim and loudness gain applied.
+
+    :param encode_args: Encoder and muxer arguments (audio_profiles.encoder_args).
+    :param result: Optional ConversionResult; gets the 'probe', 'decode', 'analyze'
+        and 'encode' stage times and the filters used.
+    :return: True on success, False if cancelled.
+    :raises FFmpegError: If decoding or encoding fails.
+    :raises ValueError: If the input has no audio stream.
+    """
+    if result is None:
+        result = ConversionResult(input_path)
+    with result.stage('probe'):
+        stream = next((s for s in probe(input_path)['streams'] if s.get('codec_type') == 'audio'), None)
+    if stream is None:
+        raise ValueError(f"{os.path.basename(input_path)} has no audio stream")
+    sample_rate = int(settings.get('sample_rate') or stream['sample_rate'])
+    channels = int(settings.get('channels') or stream['channels'])
+
+    fd, spool_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or '.', prefix='.audio-', suffix='.f32')
+    os.close(fd)
+    try:
+        # 1. Decode (and resample/downmix, if asked) once, to raw float32.
+        decode = ['-y', '-i', input_path, '-vn', '-sn', '-dn', '-ar', str(sample_rate), '-ac', str(channels),
+                  '-c:a', 'pcm_f32le', '-f', 'f32le', spool_path]
+        with result.stage('decode'):
+            if not run_ffmpeg(decode, progress_callback=scaled_progress(progress_callback, 0, 40),
+                              cancel_event=cancel_event):
+                return False
+
+        # 2. Measure loudness, peak and silence.
+        with result.stage('analyze'):
+            meter = analyze(spool_path, sample_rate, channels,
+                            float(settings.get('silence_threshold') or SILENCE_THRESHOLD), cancel_event)
+        if meter is None:
+            return False
+
+        # 3. Encode from the spool with the gain and trim applied; tags come from the original.
+        encode = ['-f', 'f32le', '-ar', str(sample_rate), '-ac', str(channels), '-i', spool_path,
+                  '-i', input_path, '-map', '0:a', '-map_metadata', '1']
+        filters = processing_filters(meter, settings)
+        result.params['filters'] = filters
+        if filters:
+            encode += ['-af', ','.join(filters)]
+        with result.stage('encode'):
+            return run_ffmpeg(encode + encode_args + [output_path], duration=meter.frames / sample_rate,
+                              progress_callback=scaled_progress(progress_callback, 40, 60),
+                              cancel_event=cancel_event)
+    finally:
+        os.remove(spool_path)
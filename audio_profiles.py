@@ -0,0 +1,122 @@
+"""
+Audio encoder selection and its translation into FFmpeg arguments.
+
+Settings understood by convert_audio:
+
+    bitrate            target bitrate in kbps ('192' or '192k')
+    bitrate_mode       'cbr', 'abr' or 'vbr' for lossy targets
+    sample_rate        output sample rate in Hz; resampled before encoding
+    channels           output channel count, e.g. 1 to downmix to mono
+    bit_depth          16, 24 or 32 bits per sample (WAV and FLAC only)
+    compression_level  FLAC compression level, 0 (fastest) to 12 (smallest)
+"""
+
+# Target format -> (FFmpeg encoder, FFmpeg muxer).
+AUDIO_TARGETS = {
+    'mp3': ('libmp3lame', 'mp3'),
+    'wav': ('pcm_s16le', 'wav'),
+    'flac': ('flac', 'flac'),
+    'ogg': ('libvorbis', 'ogg'),
+    'opus': ('libopus', 'opus'),
+    'm4a': ('aac', 'ipod'),
+    'aac': ('aac', 'adts'),
+}
+LOSSLESS_TARGETS = {'wav', 'flac'}
+
+BITRATE_MODES = ['cbr', 'abr', 'vbr']
+SAMPLE_RATES = [8000, 16000, 22050, 24000, 32000, 44100, 48000, 96000]
+BIT_DEPTHS = [16, 24, 32]
+# libopus only runs at these rates; other requests are rounded up.
+OPUS_SAMPLE_RATES = [8000, 12000, 16000, 24000, 48000]
+FLAC_COMPRESSION_LEVELS = range(0, 13)
+
+# PCM encoders for each WAV bit depth; 32-bit WAV is stored as float.
+WAV_CODECS = {16: 'pcm_s16le', 24: 'pcm_s24le', 32: 'pcm_f32le'}
+# FLAC stores 24-bit audio in 32-bit samples, marked with bits_per_raw_sample.
+FLAC_SAMPLE_FORMATS = {16: ['-sample_fmt', 's16'], 24: ['-sample_fmt', 's32', '-bits_per_raw_sample', '24']}
+
+# Nominal bitrate (kbps) of each LAME -V level and Vorbis -q level, used to
+# turn a bitrate into a VBR quality setting.
+LAME_VBR_LEVELS = [(245, 0), (225, 1), (190, 2), (175, 3), (165, 4), (130, 5), (115, 6), (100, 7), (85, 8), (65, 9)]
+VORBIS_VBR_LEVELS = [(500, 10), (320, 9), (256, 8), (224, 7), (192, 6), (160, 5), (128, 4), (112, 3), (96, 2),
+                     (80, 1), (64, 0)]
+
+
+def parse_bitrate(value):
+    """Returns a bitrate setting ('192', '192k', 192) as an int in kbps, or None."""
+    if value in (None, ''):
+        return None
+    return int(str(value).strip().rstrip('kK'))
+
+
+def _nearest_level(levels, kbps):
+    return min(levels, key=lambda level: abs(level[0] - kbps))[1]
+
+
+def encoder_args(to_format, settings):
+    """
+    FFmpeg output arguments (encoder, rate control, sample format, resampling
+    and muxer) for converting to `to_format`.
+
+    :raises ValueError: For an unknown target or an option the target cannot use.
+    """
+    to_format = to_format.lower()
+    if to_format not in AUDIO_TARGETS:
+        raise ValueError(f"Unsupported audio format: {to_format}")
+    codec, muxer = AUDIO_TARGETS[to_format]
+    args = []
+
+    bit_depth = settings.get('bit_depth')
+    if bit_depth not in (None, ''):
+        bit_depth = int(bit_depth)
+        if to_format == 'wav' and bit_depth in WAV_CODECS:
+            codec = WAV_CODECS[bit_depth]
+        elif to_format == 'flac' and bit_depth in FLAC_SAMPLE_FORMATS:
+            args += FLAC_SAMPLE_FORMATS[bit_depth]
+        else:
+            raise ValueError(f"{bit_depth}-bit samples cannot be stored in a {to_format} file")
+    args = ['-c:a', codec] + args
+
+    level = settings.get('compression_level')
+    if level not in (None, '') and to_format == 'flac':
+        if int(level) not in FLAC_COMPRESSION_LEVELS:
+            raise ValueError(f"FLAC compression level must be 0-12, not {level}")
+        args += ['-compression_level', str(int(level))]
+
+    if to_format not in LOSSLESS_TARGETS:
+        args += rate_control_args(codec, parse_bitrate(settings.get('bitrate')), settings.get('bitrate_mode') or 'cbr')
+
+    if settings.get('sample_rate') not in (None, ''):
+        sample_rate = int(settings['sample_rate'])
+        if codec == 'libopus':
+            sample_rate = next((rate for rate in OPUS_SAMPLE_RATES if rate >= sample_rate), OPUS_SAMPLE_RATES[-1])
+        args += ['-ar', str(sample_rate)]
+    if settings.get('channels') not in (None, ''):
+        args += ['-ac', str(int(settings['channels']))]
+    return args + ['-f', muxer]
+
+
+def rate_control_args(codec, kbps, mode):
+    """Bitrate arguments for a lossy encoder in 'cbr', 'abr' or 'vbr' mode."""
+    if mode not in BITRATE_MODES:
+        raise ValueError(f"Unknown bitrate mode: {mode}")
+    if kbps is None:
+        return []
+
+    if codec == 'libmp3lame':
+        if mode == 'vbr':
+            return ['-q:a', str(_nearest_level(LAME_VBR_LEVELS, kbps))]
+        if mode == 'abr':
+            return ['-b:a', f"{kbps}k", '-abr', '1']
+        return ['-b:a', f"{kbps}k"]
+    if codec == 'libopus':
+        # Opus: 'abr' maps onto its constrained VBR.
+        return ['-b:a', f"{kbps}k", '-vbr', {'cbr': 'off', 'abr': 'constrained', 'vbr': 'on'}[mode]]
+    if codec == 'libvorbis':
+        if mode == 'vbr':
+            return ['-q:a', str(_nearest_level(VORBIS_VBR_LEVELS, kbps))]
+        if mode == 'cbr':
+            return ['-b:a', f"{kbps}k", '-minrate', f"{kbps}k", '-maxrate', f"{kbps}k"]
+        return ['-b:a', f"{kbps}k"]
+    # FFmpeg's native AAC encoder only does average-bitrate encoding well.
+    return ['-b:a', f"{kbps}k"]
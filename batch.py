@@ -0,0 +1,310 @@
+import os
+import importlib
+import itertools
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from conversion_result import ConversionResult, profile_call
+from scheduler import ResourceBudget, estimate_cost, assign_threads
+
+IMAGE_FORMATS = ["WEBP", "GIF", "PNG", "JPG", "JPEG", "BMP"]
+AUDIO_FORMATS = ["MP3", "WAV", "FLAC", "OGG", "OPUS", "M4A", "AAC"]
+VIDEO_FORMATS = ["MP4", "WEBM", "MKV", "MOV"]
+
+# Converter backends are looked up by module name and imported on first use,
+# so a batch only pays for Pillow when it actually contains image jobs.
+CONVERTERS = {
+    'image': ('converter', 'convert_image'),
+    'audio': ('audio_converter', 'convert_audio'),
+    'video': ('video_converter', 'convert_video'),
+}
+
+# Converters whose work happens in an FFmpeg child process; they accept
+# progress_callback / cancel_event and are run on threads rather than processes.
+STREAMING_MEDIA_TYPES = {'audio', 'video'}
+
+Job = namedtuple('Job', ['media_type', 'input_path', 'output_dir', 'to_format', 'settings'])
+
+
+def default_workers():
+    """Number of worker processes used when the caller does not choose one."""
+    return os.cpu_count() or 1
+
+
+def media_type_for_format(fmt):
+    """Returns 'image', 'audio' or 'video' for a format name, or None if unknown."""
+    fmt = fmt.upper().lstrip('.')
+    if fmt in IMAGE_FORMATS:
+        return 'image'
+    if fmt in AUDIO_FORMATS:
+        return 'audio'
+    if fmt in VIDEO_FORMATS:
+        return 'video'
+    return None
+
+
+def get_converter(media_type):
+    module_name, func_name = CONVERTERS[media_type]
+    module = importlib.import_module(module_name)
+    return getattr(module, func_name)
+
+
+def make_jobs(media_type, files, output_dir, to_format, settings=None):
+    """Builds one Job per input file, all sharing the same target and settings."""
+    return [Job(media_type, path, output_dir, to_format, settings or {}) for path in files]
+
+
+def run_job(job, cache=None, progress_callback=None, cancel_event=None, profiler=None):
+    """
+    Converts a single job. Runs inside a worker process (or thread, for audio/video).
+
+    :param profiler: 'cprofile' or 'tracemalloc' to attach a profile of the
+        conversion to its result (see conversion_result.profile_call).
+    :return: The converter's ConversionResult.
+    """
+    convert = get_converter(job.media_type)
+    kwargs = {'cache': cache}
+    if job.media_type in STREAMING_MEDIA_TYPES:
+        kwargs.update(progress_callback=progress_callback, cancel_event=cancel_event)
+    if profiler:
+        return profile_call(profiler, convert, job.input_path, job.output_dir, job.to_format, job.settings, **kwargs)
+    return convert(job.input_path, job.output_dir, job.to_format, job.settings, **kwargs)
+
+
+class _ProgressTracker:
+    """
+    Combines per-file fractions into one overall percentage.
+
+    While files may still be added (`growing`), each addition lowers the
+    share of the files done; the percentage is held where it was rather
+    than going back, and kept below 100 until close().
+    """
+
+    def __init__(self, total, callback, growing=False):
+        self.callback = callback
+        self.fractions = [0.0] * total
+        self.growing = growing
+        self.lock = threading.Lock()
+        self.last = -1
+
+    def add(self):
+        """Counts one more file, for batches whose jobs arrive while they run."""
+        with self.lock:
+            self.fractions.append(0.0)
+
+    def close(self):
+        """No more files will be added."""
+        with self.lock:
+            if self.growing:
+                self.growing = False
+                self._emit()
+
+    def update(self, index, fraction):
+        with self.lock:
+            self.fractions[index] = min(max(fraction, 0.0), 1.0)
+            self._emit()
+
+    def _emit(self):
+        percent = max(int(100 * sum(self.fractions) / len(self.fractions)), self.last)
+        if self.growing:
+            percent = min(percent, 99)
+        # Only emit when the integer percentage moves, to avoid flooding the GUI.
+        if self.callback and percent != self.last:
+            self.last = percent
+            self.callback(percent)
+
+    def file_callback(self, index, job, file_progress_callback):
+        def callback(progress):
+            if progress.get('percent') is not None:
+                self.update(index, progress['percent'] / 100)
+            if file_progress_callback:
+                file_progress_callback(job, progress)
+        return callback
+
+
+def run_batch(jobs, max_workers=None, progress_callback=None, cache=None,
+              cancel_event=None, file_progress_callback=None, result_callback=None, profiler=None,
+              budget=None):
+    """
+    Converts a list of jobs, fanning them out across a process pool.
+
+    Image conversion is CPU-bound Python/C code that holds the GIL, so
+    separate processes are needed to use more than one core. Audio and video
+    jobs spend their time inside FFmpeg child processes, so a batch without
+    images runs on threads instead; that lets FFmpeg's progress and
+    cancellation reach the caller while a file is still encoding.
+
+    Jobs start in order as long as the ResourceBudget has room for their
+    estimated threads and memory (see scheduler), so a batch neither
+    oversubscribes the cores with FFmpeg threads nor decodes several huge
+    animations at once.
+
+    `jobs` may also be an iterator, e.g. fed by discovery.discover() while
+    it walks a folder; jobs are then taken from it as workers free up, the
+    first job decides between processes and threads, and the overall
+    percentage, of the jobs seen so far, never goes back and only reaches
+    100 once the iterator is exhausted.
+
+    :param jobs: A list (or iterator) of Job tuples.
+    :param max_workers: Size of the process pool. Defaults to the number of CPUs.
+    :param progress_callback: Called with the overall percentage (0-100) as files progress.
+    :param cache: Optional ConversionCache shared by all jobs. It is trimmed to
+        its size cap once the batch is done.
+    :param cancel_event: A threading.Event; once set, jobs that have not started are
+        skipped and running FFmpeg encodes are stopped.
+    :param file_progress_callback: Called as (job, progress_dict) while an audio or video file encodes.
+    :param result_callback: Called as (job, ConversionResult) as each file finishes, from the
+        calling thread (or a batch thread, for audio/video).
+    :param profiler: 'cprofile' or 'tracemalloc' to profile every job (see run_job).
+    :param budget: A scheduler.ResourceBudget. Defaults to the larger of the CPU count and
+        `max_workers` threads and half of physical memory.
+    :return: A list of ConversionResult, one per job, in the same order as `jobs`.
+        They are truthy for converted files; jobs skipped after a cancel are
+        marked cancelled (jobs an iterator had not produced yet are left out).
+        conversion_result.summarize() aggregates them.
+    """
+    if max_workers is None:
+        max_workers = default_workers()
+    growing = not isinstance(jobs, (list, tuple))
+    if not growing:
+        source = iter(())
+        jobs = list(jobs)
+        streaming = all(job.media_type in STREAMING_MEDIA_TYPES for job in jobs)
+        max_workers = min(max_workers, len(jobs))
+    else:
+        source = iter(jobs)
+        jobs = list(itertools.islice(source, 1))
+        streaming = bool(jobs) and jobs[0].media_type in STREAMING_MEDIA_TYPES
+    results = [_skipped(job) for job in jobs]
+    if not jobs:
+        return results
+
+    max_workers = max(1, max_workers)
+    tracker = _ProgressTracker(len(jobs), progress_callback, growing)
+    feed = _JobFeed(source, jobs, results, tracker)
+
+    # A pool is pure overhead for a single worker; convert in-process instead.
+    if max_workers == 1:
+        index = 0
+        while index < len(jobs) or feed.pull() is not None:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            job = jobs[index]
+            callback = tracker.file_callback(index, job, file_progress_callback)
+            results[index] = _run_job_safely(job, cache, callback, cancel_event, profiler)
+            _finished(index, job, results, tracker, result_callback)
+            index += 1
+    else:
+        if budget is None:
+            budget = ResourceBudget(threads=max(default_workers(), max_workers))
+        if streaming:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                def start(index, job):
+                    callback = tracker.file_callback(index, job, file_progress_callback)
+                    return executor.submit(_run_job_safely, job, cache, callback, cancel_event, profiler)
+                _run_scheduled(feed, max_workers, budget, start, cancel_event, result_callback)
+        else:
+            # Imported here: it pulls in multiprocessing, which the GUI does not need to start up.
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                def start(index, job):
+                    return executor.submit(run_job, job, cache, None, None, profiler)
+                _run_scheduled(feed, max_workers, budget, start, cancel_event, result_callback)
+
+    if cache:
+        cache.evict()
+    return results
+
+
+def _skipped(job):
+    result = ConversionResult.failure(job.input_path, "not started")
+    result.cancelled = True
+    return result
+
+
+def _finished(index, job, results, tracker, result_callback):
+    tracker.update(index, 1.0)
+    if result_callback:
+        result_callback(job, results[index])
+
+
+class _JobFeed:
+    """The jobs of a batch: those known so far, plus an iterator that may produce more."""
+
+    def __init__(self, source, jobs, results, tracker):
+        self.source = source
+        self.jobs = jobs
+        self.results = results
+        self.tracker = tracker
+
+    def pull(self):
+        """Takes the next job from the iterator; returns its index, or None when it is exhausted."""
+        job = next(self.source, None)
+        if job is None:
+            self.tracker.close()
+            return None
+        self.jobs.append(job)
+        self.results.append(_skipped(job))
+        self.tracker.add()
+        return len(self.jobs) - 1
+
+
+def _run_scheduled(feed, max_workers, budget, start, cancel_event, result_callback):
+    """
+    Starts jobs through `start(index, job) -> Future` while fewer than
+    `max_workers` run and `budget` has room, backfilling with later jobs
+    that fit when the next one does not. Up to 2 * max_workers jobs are
+    looked ahead at, whether they came as a list or from the feed, so
+    estimates (which open images and run ffprobe) are made as jobs near
+    the front rather than for the whole batch up front.
+    """
+    jobs, results, tracker = feed.jobs, feed.results, feed.tracker
+    cores = budget.threads
+    lookahead = 2 * max_workers
+    waiting = list(range(len(jobs)))
+    exhausted = False
+    costs = {}
+    running = {}
+    while waiting or running or not exhausted:
+        if cancel_event is not None and cancel_event.is_set():
+            waiting = []  # Left as skipped; running jobs are stopped through cancel_event.
+            exhausted = True
+        while True:
+            for index in waiting[:lookahead]:
+                if len(running) >= max_workers:
+                    break
+                if index not in costs:
+                    costs[index] = estimate_cost(jobs[index], cores)
+                if budget.fits(costs[index]):
+                    budget.claim(costs[index])
+                    waiting.remove(index)
+                    running[start(index, assign_threads(jobs[index], costs[index]))] = index
+            # Pull one job at a time, so each starts as soon as it arrives.
+            if exhausted or len(running) >= max_workers or len(waiting) >= lookahead:
+                break
+            index = feed.pull()
+            if index is None:
+                exhausted = True
+            else:
+                waiting.append(index)
+        if not running:
+            continue
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = running.pop(future)
+            budget.release(costs[index])
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                print(f"Error converting {jobs[index].input_path}: {e}")
+                results[index] = ConversionResult.failure(jobs[index].input_path, e)
+            _finished(index, jobs[index], results, tracker, result_callback)
+
+
+def _run_job_safely(job, cache=None, progress_callback=None, cancel_event=None, profiler=None):
+    try:
+        return run_job(job, cache, progress_callback, cancel_event, profiler)
+    except Exception as e:
+        print(f"Error converting {job.input_path}: {e}")
+        return ConversionResult.failure(job.input_path, e)
@@ -0,0 +1,516 @@
+"""
+Conversion benchmarks.
+
+    python -m benchmark suite --output bench.json
+    python -m benchmark suite --quick --baseline bench.json
+    python -m benchmark compare new.json bench.json
+    python -m benchmark audio-streaming --minutes 60 --to mp3
+    python -m benchmark startup --baseline startup.json
+
+`suite` generates synthetic fixtures (Pillow images of several sizes and
+modes, an animated GIF, sine-wave audio and an FFmpeg testsrc video) and
+times convert_image, convert_audio and convert_video on each case in
+SUITE_CASES. Every case runs in a fresh process, so its peak memory is its
+own; the largest child process's peak (FFmpeg) is reported too, and on
+fork() platforms it includes memory shared with the parent. Results are
+printed or written as JSON; given a baseline, cases that got slower or
+bigger by more than the tolerance are listed as regressions and the exit
+status is 1.
+
+`audio-streaming` compares the streaming FFmpeg audio path used by
+convert_audio with decoding the whole track through pydub
+(AudioSegment.from_file + export), on a generated sine-wave FLAC.
+
+`startup` measures the cold start of the GUI and the CLI: the import time
+of each STARTUP_MODULES entry (python -X importtime, in a fresh process,
+best of --repeat) with its slowest imports, and the time until the main
+window has been shown. A module in FORBIDDEN_AT_STARTUP being imported
+counts as a failure, since those belong to the first conversion or update
+check. The report compares against a baseline like the suite's.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import importlib
+import statistics
+import queue as queue_module
+import tempfile
+import subprocess
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # Windows: peak memory is not reported.
+    resource = None
+
+from ffmpeg_runner import FFMPEG, POPEN_FLAGS
+
+
+DEFAULT_TOLERANCE = 0.15
+# Differences below these are noise, whatever the relative change.
+NOISE_FLOOR = {'seconds': 0.05, 'peak_rss_mb': 5.0, 'child_peak_rss_mb': 5.0}
+# Modules whose import time `startup` measures, and dependencies none of them may import.
+STARTUP_MODULES = ['main_pyside', 'cli']
+FORBIDDEN_AT_STARTUP = ['PIL', 'numpy', 'pydub', 'requests', 'packaging']
+STARTUP_TOP_IMPORTS = 10
+# Run in a fresh process by `startup`: prints the seconds from launch until the window is shown.
+FIRST_WINDOW_SCRIPT = """
+import time
+start = time.perf_counter()
+from PySide6.QtWidgets import QApplication
+import main_pyside
+app = QApplication([])
+window = main_pyside.MainWindow()
+window.show()
+app.processEvents()
+print(time.perf_counter() - start)
+window.close()
+"""
+# Fixture sizes are divided by this (and durations shortened) with --quick.
+QUICK_SCALE = 4
+
+CONVERTERS = {
+    'image': ('converter', 'convert_image'),
+    'audio': ('audio_converter', 'convert_audio'),
+    'video': ('video_converter', 'convert_video'),
+}
+
+# Fixture name -> how to generate it. Image sizes are in pixels, durations in seconds.
+SUITE_FIXTURES = {
+    'photo-12mp.jpg': {'kind': 'image', 'size': (4000, 3000), 'mode': 'RGB'},
+    'photo-2mp.jpg': {'kind': 'image', 'size': (1920, 1080), 'mode': 'RGB'},
+    'alpha-2mp.png': {'kind': 'image', 'size': (1920, 1080), 'mode': 'RGBA'},
+    'gray-2mp.png': {'kind': 'image', 'size': (1920, 1080), 'mode': 'L'},
+    'palette-1mp.png': {'kind': 'image', 'size': (1024, 1024), 'mode': 'P'},
+    'anim-60.gif': {'kind': 'animation', 'size': (480, 270), 'frames': 60},
+    'sine-120s.flac': {'kind': 'audio', 'duration': 120},
+    'testsrc-20s.mp4': {'kind': 'video', 'size': (1280, 720), 'duration': 20},
+}
+
+# (name, fixture, target format, settings)
+SUITE_CASES = [
+    ('image/jpg-12mp->webp', 'photo-12mp.jpg', 'webp', {}),
+    ('image/jpg-12mp->png', 'photo-12mp.jpg', 'png', {}),
+    ('image/jpg-12mp->jpg-thumb', 'photo-12mp.jpg', 'jpg', {'width': '400'}),
+    ('image/jpg-2mp->jpg', 'photo-2mp.jpg', 'jpg', {'quality': 85}),
+    ('image/jpg-2mp->webp-ops', 'photo-2mp.jpg', 'webp', {'width': '1280', 'ops': 'crop=100,100,1600,900;sharpen'}),
+    ('image/png-rgba->webp', 'alpha-2mp.png', 'webp', {}),
+    ('image/png-rgba->jpg', 'alpha-2mp.png', 'jpg', {}),
+    ('image/png-gray->jpg', 'gray-2mp.png', 'jpg', {}),
+    ('image/png-palette->gif', 'palette-1mp.png', 'gif', {}),
+    ('image/gif-anim->gif', 'anim-60.gif', 'gif', {'width': '320'}),
+    ('image/gif-anim->gif-global', 'anim-60.gif', 'gif', {'width': '320', 'palette': 'global'}),
+    ('image/gif-anim->webp', 'anim-60.gif', 'webp', {}),
+    ('audio/flac->mp3', 'sine-120s.flac', 'mp3', {'bitrate': '192'}),
+    ('audio/flac->opus', 'sine-120s.flac', 'opus', {'bitrate': '96'}),
+    ('audio/flac->aac', 'sine-120s.flac', 'aac', {'bitrate': '160'}),
+    ('audio/flac->flac', 'sine-120s.flac', 'flac', {'compression_level': 5}),
+    ('audio/flac->mp3-normalize', 'sine-120s.flac', 'mp3', {'bitrate': '192', 'normalize': True}),
+    ('video/mp4->mp4', 'testsrc-20s.mp4', 'mp4', {'video_codec': 'libx264', 'preset': 'veryfast'}),
+    ('video/mp4->webm', 'testsrc-20s.mp4', 'webm', {'preset': 'veryfast'}),
+    ('video/mp4->mkv-copy', 'testsrc-20s.mp4', 'mkv', {}),
+]
+
+
+def make_sine_audio(path, seconds, sample_rate=44100, channels=2):
+    """Writes a sine-wave test file with FFmpeg's lavfi source."""
+    command = [FFMPEG, '-v', 'error', '-y', '-f', 'lavfi',
+               '-i', f"sine=frequency=440:sample_rate={sample_rate}:duration={seconds}",
+               '-ac', str(channels), path]
+    subprocess.run(command, check=True, creationflags=POPEN_FLAGS)
+
+
+def make_test_video(path, seconds, size=(1280, 720), rate=30):
+    """Writes an H.264/AAC test clip with FFmpeg's testsrc and sine sources."""
+    command = [FFMPEG, '-v', 'error', '-y',
+               '-f', 'lavfi', '-i', f"testsrc=size={size[0]}x{size[1]}:rate={rate}:duration={seconds}",
+               '-f', 'lavfi', '-i', f"sine=frequency=440:duration={seconds}",
+               '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', path]
+    subprocess.run(command, check=True, creationflags=POPEN_FLAGS)
+
+
+def _photo_like(size, seed=0):
+    """
+    Gradients plus seeded noise: compresses roughly like a photograph (unlike
+    a flat fill) and is the same on every run, so file sizes are comparable.
+    """
+    from PIL import Image
+    noise = Image.frombytes('L', size, random.Random(seed).randbytes(size[0] * size[1]))
+    return Image.merge('RGB', (Image.linear_gradient('L').resize(size),
+                               Image.radial_gradient('L').resize(size),
+                               noise))
+
+
+def make_test_image(path, size, mode):
+    """Writes a synthetic `mode` image of `size`; the format follows the extension."""
+    from PIL import Image
+    img = _photo_like(size)
+    if mode == 'RGBA':
+        img.putalpha(Image.linear_gradient('L').rotate(90).resize(size))
+    elif mode != 'RGB':
+        img = img.convert(mode)
+    img.save(path)
+
+
+def make_test_animation(path, size, frames):
+    """Writes an animated GIF whose content moves a little every frame."""
+    base = _photo_like((size[0] * 2, size[1]))
+    step = size[0] // frames or 1
+    images = [base.crop((i * step, 0, i * step + size[0], size[1])) for i in range(frames)]
+    images[0].save(path, save_all=True, append_images=images[1:], duration=40, loop=0)
+
+
+def make_fixture(path, spec, quick=False):
+    """Generates the SUITE_FIXTURES entry `spec` at `path`; returns its duration in seconds, if any."""
+    scale = QUICK_SCALE if quick else 1
+    if 'size' in spec and spec['kind'] != 'video':
+        size = (spec['size'][0] // scale, spec['size'][1] // scale)
+    if spec['kind'] == 'image':
+        make_test_image(path, size, spec['mode'])
+    elif spec['kind'] == 'animation':
+        make_test_animation(path, size, spec['frames'])
+    elif spec['kind'] == 'audio':
+        make_sine_audio(path, spec['duration'] // scale)
+        return spec['duration'] // scale
+    elif spec['kind'] == 'video':
+        make_test_video(path, spec['duration'] // scale, spec['size'])
+        return spec['duration'] // scale
+    return None
+
+
+def _peak_mb(who):
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return round(peak / (1024 ** 2 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _streaming_path(input_path, output_dir, to_format):
+    from audio_converter import convert_audio
+    return convert_audio(input_path, output_dir, to_format)
+
+
+def _pydub_path(input_path, output_dir, to_format):
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(input_path)
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    audio.export(os.path.join(output_dir, f"{base_name}.{to_format}"), format=to_format)
+    return True
+
+
+AUDIO_PATHS = {'streaming': _streaming_path, 'pydub': _pydub_path}
+
+
+def _time_audio_path(path_name, input_path, output_dir, to_format):
+    started = time.perf_counter()
+    ok = AUDIO_PATHS[path_name](input_path, output_dir, to_format)
+    return {'path': path_name, 'ok': bool(ok), 'seconds': round(time.perf_counter() - started, 3)}
+
+
+def _time_case(media, input_path, output_dir, to_format, settings, repeat):
+    module_name, function_name = CONVERTERS[media]
+    convert = getattr(importlib.import_module(module_name), function_name)
+    timings = []
+    ok = True
+    for run in range(repeat):
+        run_dir = os.path.join(output_dir, str(run))
+        started = time.perf_counter()
+        result = convert(input_path, run_dir, to_format, dict(settings))
+        timings.append(time.perf_counter() - started)
+        ok = bool(result) and ok
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return {
+        'ok': ok,
+        'seconds': round(statistics.median(timings), 3),
+        'min_seconds': round(min(timings), 3),
+        'output_mb': round(result.output_bytes / 1024 ** 2, 3),
+        'codec': result.codec,
+        # Stage times of the last run.
+        'stages': {name: round(seconds, 3) for name, seconds in result.stages.items()},
+    }
+
+
+def _measure_child(target, args, queue):
+    result = target(*args)
+    result['peak_rss_mb'] = _peak_mb(resource.RUSAGE_SELF) if resource else None
+    result['child_peak_rss_mb'] = _peak_mb(resource.RUSAGE_CHILDREN) if resource else None
+    queue.put(result)
+
+
+def measure(target, *args):
+    """
+    Runs target(*args), a function of this module returning a dict, in a
+    fresh process, and returns that dict with the process's peak memory added.
+    """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure_child, args=(target, args, queue))
+    process.start()
+    process.join()
+    try:
+        return queue.get(timeout=1)
+    except queue_module.Empty:
+        # The child died before reporting, e.g. killed for running out of memory.
+        return {'ok': False, 'exitcode': process.exitcode}
+
+
+def bench_audio_streaming(minutes, to_format):
+    work_dir = tempfile.mkdtemp(prefix='uc-bench-')
+    try:
+        source = os.path.join(work_dir, 'sine.flac')
+        make_sine_audio(source, int(minutes * 60))
+        results = []
+        for path_name in AUDIO_PATHS:
+            output_dir = os.path.join(work_dir, path_name)
+            os.makedirs(output_dir)
+            result = {'path': path_name, **measure(_time_audio_path, path_name, source, output_dir, to_format)}
+            if result.get('seconds'):
+                result['realtime_factor'] = round(minutes * 60 / result['seconds'], 1)
+            results.append(result)
+        return {'benchmark': 'audio-streaming', 'minutes': minutes, 'to_format': to_format, 'results': results}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _isolated_env(work_dir):
+    """Environment for a child app process whose settings, queue and cache live in `work_dir`."""
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    for name in ('APPDATA', 'LOCALAPPDATA', 'XDG_CONFIG_HOME', 'XDG_CACHE_HOME'):
+        env[name] = work_dir
+    return env
+
+
+def _import_profile(module, env):
+    """
+    Imports `module` in a fresh interpreter under -X importtime.
+
+    :return: (seconds for the whole import, {module name: own import seconds}).
+    """
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                               capture_output=True, text=True, env=env,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    own, total = {}, None
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        own[name.strip()] = int(self_us) / 1e6
+        if name.strip() == module:
+            total = int(cumulative_us) / 1e6
+    return total, own
+
+
+def bench_startup(repeat=5):
+    """
+    Measures the import time of each STARTUP_MODULES entry and the time to
+    the first main window, keeping the best of `repeat` runs of each.
+    """
+    work_dir = tempfile.mkdtemp(prefix='uc-bench-')
+    try:
+        env = _isolated_env(work_dir)
+        results = []
+        for module in STARTUP_MODULES:
+            try:
+                runs = [_import_profile(module, env) for _ in range(repeat)]
+            except RuntimeError as e:
+                results.append({'name': f"import/{module}", 'ok': False, 'error': str(e)})
+                continue
+            seconds, own = min(runs, key=lambda run: run[0])
+            top_level = {name.lstrip().split('.')[0] for name in own}
+            forbidden = [name for name in FORBIDDEN_AT_STARTUP if name in top_level]
+            slowest = sorted(own.items(), key=lambda item: item[1], reverse=True)[:STARTUP_TOP_IMPORTS]
+            results.append({
+                'name': f"import/{module}",
+                'ok': not forbidden,
+                'seconds': round(seconds, 4),
+                'modules': len(own),
+                'forbidden': forbidden,
+                'slowest': [{'module': name, 'seconds': round(t, 4)} for name, t in slowest],
+            })
+
+        times = []
+        for _ in range(repeat):
+            completed = subprocess.run([sys.executable, '-c', FIRST_WINDOW_SCRIPT], capture_output=True,
+                                       text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+            if not completed.stdout.strip():
+                break  # Failed before showing the window; an error on exit does not count.
+            times.append(float(completed.stdout.split()[0]))
+        if len(times) == repeat:
+            results.append({'name': 'gui/first-window', 'ok': True, 'seconds': round(min(times), 4),
+                            'median_seconds': round(statistics.median(times), 4)})
+        else:
+            results.append({'name': 'gui/first-window', 'ok': False})
+        return {
+            'benchmark': 'startup',
+            'version': _app_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'results': results,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _app_version():
+    try:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'VERSION.txt')) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def bench_suite(media_types=None, quick=False, repeat=3, log=None):
+    """
+    Runs every SUITE_CASES entry for `media_types` (default: all) and
+    returns the report: one result per case with its median and best time,
+    throughput, realtime factor (audio and video) and peak memory.
+
+    :param log: Optional callable taking a progress line per case.
+    """
+    cases = [case for case in SUITE_CASES if media_types is None or case[0].split('/')[0] in media_types]
+    work_dir = tempfile.mkdtemp(prefix='uc-bench-')
+    try:
+        durations = {}
+        for fixture in sorted({case[1] for case in cases}):
+            durations[fixture] = make_fixture(os.path.join(work_dir, fixture), SUITE_FIXTURES[fixture], quick)
+
+        results = []
+        for name, fixture, to_format, settings in cases:
+            media = name.split('/')[0]
+            source = os.path.join(work_dir, fixture)
+            input_mb = os.path.getsize(source) / 1024 ** 2
+            result = {'name': name, 'fixture': fixture, 'to_format': to_format, 'input_mb': round(input_mb, 3),
+                      **measure(_time_case, media, source, os.path.join(work_dir, 'out'), to_format, settings, repeat)}
+            if result.get('seconds'):
+                result['mb_per_s'] = round(input_mb / result['seconds'], 2)
+                result['files_per_s'] = round(1 / result['seconds'], 2)
+                if durations[fixture]:
+                    result['realtime_factor'] = round(durations[fixture] / result['seconds'], 1)
+            results.append(result)
+            if log:
+                log(f"{name}: {result.get('seconds')} s, peak {result.get('peak_rss_mb')} MB"
+                    + ("" if result['ok'] else " (FAILED)"))
+        return {
+            'benchmark': 'suite',
+            'version': _app_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'quick': quick,
+            'repeat': repeat,
+            'results': results,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Lists the cases of `report` that regressed against `baseline`: cases that
+    stopped working, and times or peak memory that grew by more than
+    `tolerance` (a fraction) and by more than NOISE_FLOOR.
+    """
+    previous = {result['name']: result for result in baseline.get('results', [])}
+    regressions = []
+    for result in report.get('results', []):
+        before = previous.get(result['name'])
+        if before is None:
+            continue
+        if before.get('ok') and not result.get('ok'):
+            regressions.append({'name': result['name'], 'metric': 'ok', 'baseline': True, 'current': False})
+            continue
+        for metric, floor in NOISE_FLOOR.items():
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > floor:
+                regressions.append({'name': result['name'], 'metric': metric, 'baseline': old, 'current': new,
+                                    'change_pct': round(100 * (new / old - 1), 1)})
+    return regressions
+
+
+def _load_report(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Conversion benchmarks.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    suite = commands.add_parser('suite', help="Time the image, audio and video converters on synthetic fixtures.")
+    suite.add_argument('--media', nargs='+', choices=sorted(CONVERTERS), help="Only these media types.")
+    suite.add_argument('--quick', action='store_true', help="Smaller images and shorter clips.")
+    suite.add_argument('--repeat', type=int, default=3, help="Runs per case; the median is reported "
+                                                              "(default: %(default)s).")
+    suite.add_argument('--output', help="Write the JSON report here instead of printing it.")
+    suite.add_argument('--baseline', help="A previous report to check for regressions.")
+    suite.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                       help="Allowed slowdown/growth as a fraction (default: %(default)s).")
+
+    check = commands.add_parser('compare', help="Check a saved report against a baseline report.")
+    check.add_argument('report')
+    check.add_argument('baseline')
+    check.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                       help="Allowed slowdown/growth as a fraction (default: %(default)s).")
+
+    audio = commands.add_parser('audio-streaming', help="Streaming FFmpeg audio path vs. pydub decode.")
+    audio.add_argument('--minutes', type=float, default=30, help="Length of the generated track (default: %(default)s).")
+    audio.add_argument('--to', dest='to_format', default='mp3', help="Target format (default: %(default)s).")
+
+    startup = commands.add_parser('startup', help="Import time of the GUI and CLI, and time to the first window.")
+    startup.add_argument('--repeat', type=int, default=5, help="Runs per measurement; the best is reported "
+                                                                "(default: %(default)s).")
+    startup.add_argument('--output', help="Write the JSON report here instead of printing it.")
+    startup.add_argument('--baseline', help="A previous startup report to check for regressions.")
+    startup.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                         help="Allowed slowdown as a fraction (default: %(default)s).")
+    args = parser.parse_args(argv)
+
+    if args.command == 'audio-streaming':
+        print(json.dumps(bench_audio_streaming(args.minutes, args.to_format), indent=2))
+        return 0
+
+    if args.command in ('suite', 'startup'):
+        if args.repeat < 1:
+            parser.error("--repeat must be at least 1")
+        if args.command == 'suite':
+            report = bench_suite(args.media, args.quick, args.repeat, log=lambda line: print(line, file=sys.stderr))
+        else:
+            report = bench_startup(args.repeat)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+        baseline = _load_report(args.baseline) if args.baseline else None
+    else:
+        report, baseline = _load_report(args.report), _load_report(args.baseline)
+
+    if baseline is None:
+        return 0
+    if baseline.get('quick') != report.get('quick'):
+        print("Warning: comparing a --quick report with a full one.", file=sys.stderr)
+    regressions = compare(report, baseline, args.tolerance)
+    for regression in regressions:
+        if regression['metric'] == 'ok':
+            print(f"REGRESSION {regression['name']}: no longer passes", file=sys.stderr)
+        else:
+            print(f"REGRESSION {regression['name']}: {regression['metric']} {regression['baseline']} -> "
+                  f"{regression['current']} (+{regression['change_pct']}%)", file=sys.stderr)
+    if not regressions:
+        print("No regressions.", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
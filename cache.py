@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+HASH_CHUNK_SIZE = 1024 * 1024
+# Settings that decide where an output goes, not what it contains.
+OUTPUT_ONLY_SETTINGS = {'if_exists'}
+
+
+def default_cache_dir():
+    """Returns the per-user directory used for cached conversion results."""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        return os.path.join(base, 'UniversalConverter', 'cache')
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'UniversalConverter')
+
+
+def file_digest(path):
+    """SHA-256 of a file's content, read in chunks to keep memory flat."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_settings(settings):
+    """
+    Returns a canonical JSON string for a settings dict.
+
+    Empty values are dropped and numeric strings become ints, so that
+    {'width': '800', 'height': ''} and {'width': 800} produce the same key.
+    OUTPUT_ONLY_SETTINGS are left out.
+    """
+    normalized = {}
+    for name, value in (settings or {}).items():
+        if value is None or value == '' or name in OUTPUT_ONLY_SETTINGS:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+            if value.isdigit():
+                value = int(value)
+        normalized[name] = value
+    return json.dumps(normalized, sort_keys=True, default=str)
+
+
+class ConversionCache:
+    """
+    On-disk cache of converted files, keyed by input content, target format
+    and settings.
+
+    Entries are plain files under `cache_dir`. A hit hardlinks (or copies,
+    across filesystems) the cached result to the requested output path and
+    refreshes the entry's mtime, which `evict` uses as the LRU clock.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def key(self, input_path, to_format, settings=None):
+        digest = hashlib.sha256()
+        digest.update(file_digest(input_path).encode())
+        digest.update(b'\0' + to_format.lower().encode())
+        digest.update(b'\0' + normalize_settings(settings).encode())
+        return digest.hexdigest()
+
+    def _entry_path(self, key, to_format):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{to_format.lower()}")
+
+    def fetch(self, key, to_format, output_path):
+        """Places the cached result for `key` at `output_path`. Returns False on a miss."""
+        entry = self._entry_path(key, to_format)
+        try:
+            _link_or_copy(entry, output_path)
+            os.utime(entry)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"Cache read failed for {output_path}: {e}")
+            return False
+        return True
+
+    def store(self, key, to_format, output_path):
+        """Adds a freshly converted file to the cache. Failures are not fatal."""
+        entry = self._entry_path(key, to_format)
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            # Link/copy under a temporary name first so concurrent workers
+            # never observe a partially written entry.
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix='.tmp')
+            os.close(fd)
+            os.remove(temp_path)
+            _link_or_copy(output_path, temp_path)
+            os.replace(temp_path, entry)
+        except OSError as e:
+            print(f"Cache write failed for {output_path}: {e}")
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        # Different filesystem or no hardlink support (e.g. FAT, some shares).
+        shutil.copyfile(src, dst)
@@ -0,0 +1,284 @@
+"""
+Headless command-line entry point for batch conversions.
+
+Usage examples:
+    python -m cli photos/*.png -t jpg -o out --quality 85 --jobs 8
+    python -m cli ~/inbox -r -t mp3 -o out --bitrate 192
+    python -m cli masters/ --mirror --delete -t webp -o web/
+    python -m cli scans/ -t jpg -o out --width 1600 --op auto_orient --op watermark=logo.png
+
+Only the batch engine is imported here; the converter backends (Pillow,
+FFmpeg) are loaded by the worker processes that actually need them,
+and PySide6 is never imported.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+
+from cache import ConversionCache, DEFAULT_MAX_BYTES
+from conversion_result import PROFILERS, summarize, format_summary
+from scheduler import ResourceBudget, MB
+from batch import Job, run_batch, default_workers, media_type_for_format
+from discovery import ACCEPTED_SOURCES, DiscoveryIndex, Found, detect, discover
+from output_writer import POLICIES, DEFAULT_POLICY
+
+
+def collect_inputs(patterns, media_type, recursive=False):
+    """
+    Expands glob patterns and directories into input files, lazily, as a
+    discovery.Found for each.
+
+    Files named explicitly (or matched by a glob) are always included;
+    files found by walking a directory are sniffed by content, so that only
+    files the `media_type` converter can read are picked up, whatever their
+    extension.
+    """
+    seen = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True) or [pattern]
+        for match in matches:
+            if os.path.isdir(match):
+                found_items = discover([match], recursive, ACCEPTED_SOURCES[media_type])
+            elif os.path.isfile(match):
+                found_items = [detect(match) or Found(match, media_type, os.path.splitext(match)[1].lower().lstrip('.'), False)]
+            else:
+                print(f"Warning: no such file or directory: {match}", file=sys.stderr)
+                continue
+            for found in found_items:
+                # Keep the first occurrence when a file is matched more than once.
+                if found.path not in seen:
+                    seen.add(found.path)
+                    yield found
+
+
+def build_settings(args):
+    """Maps command-line options onto the settings dict used by the converters."""
+    settings = {}
+    # convert_image expects width/height as strings, as typed into the GUI.
+    if args.width is not None:
+        settings['width'] = str(args.width)
+    if args.height is not None:
+        settings['height'] = str(args.height)
+    settings['keep_aspect_ratio'] = args.keep_aspect_ratio
+    if args.quality is not None:
+        settings['quality'] = args.quality
+    if args.lossless:
+        settings['lossless'] = True
+    if args.resample is not None:
+        settings['resample'] = args.resample
+    if args.palette is not None:
+        settings['palette'] = args.palette
+    if args.op:
+        # Parsed (and validated) by convert_image, so Pillow is not imported here.
+        settings['ops'] = ';'.join(args.op)
+    if args.bitrate is not None:
+        settings['bitrate'] = args.bitrate
+    if args.resolution is not None:
+        settings['resolution'] = args.resolution
+    for key in ('bitrate_mode', 'sample_rate', 'channels', 'bit_depth', 'compression_level'):
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+    if args.normalize is not None:
+        settings['normalize'] = True
+        settings['target_loudness'] = args.normalize
+    if args.trim_silence:
+        settings['trim_silence'] = True
+        if args.silence_threshold is not None:
+            settings['silence_threshold'] = args.silence_threshold
+    for key in ('profile', 'video_codec', 'audio_codec', 'preset', 'tune', 'threads', 'video_bitrate'):
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+    if args.two_pass:
+        settings['two_pass'] = True
+    if args.segments is not None:
+        settings['segments'] = args.segments if args.segments == 'auto' else int(args.segments)
+    if args.stream_copy != 'auto':
+        settings['stream_copy'] = args.stream_copy == 'always'
+    if args.if_exists != DEFAULT_POLICY:
+        settings['if_exists'] = args.if_exists
+    return settings
+
+
+def build_budget(args):
+    """The ResourceBudget for --jobs and --memory-budget."""
+    memory = args.memory_budget * MB if args.memory_budget else None
+    return ResourceBudget(threads=max(default_workers(), args.jobs), memory=memory)
+
+
+def run_mirror(args, cache, progress_callback):
+    # Imported here so plain batch runs do not load the mirror module.
+    from mirror import sync_folder
+
+    summary = sync_folder(
+        args.inputs[0], args.output_dir, args.to_format, build_settings(args),
+        delete=args.delete, max_workers=args.jobs, progress_callback=progress_callback, cache=cache,
+        budget=build_budget(args)
+    )
+    if progress_callback:
+        print(file=sys.stderr)
+    print(f"{summary['converted']} converted, {summary['skipped']} unchanged, "
+          f"{summary['deleted']} deleted, {summary['failed']} failed.")
+    return 1 if summary['failed'] else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m cli",
+        description="Convert images, audio and video files without the GUI."
+    )
+    parser.add_argument('inputs', nargs='+', help="Input files, glob patterns or directories.")
+    parser.add_argument('-t', '--to', dest='to_format', required=True, help="Target format, e.g. jpg, mp3, mp4.")
+    parser.add_argument('-o', '--output-dir', required=True, help="Directory to write converted files to.")
+    parser.add_argument('-r', '--recursive', action='store_true', help="Descend into subdirectories of input directories.")
+    parser.add_argument('-j', '--jobs', type=int, default=default_workers(),
+                        help="Number of parallel conversions (default: number of CPUs).")
+    parser.add_argument('--memory-budget', type=int, metavar='MB',
+                        help="Memory the running conversions may use together, by estimate "
+                             "(default: half of physical memory).")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Do not print progress.")
+    parser.add_argument('--if-exists', choices=POLICIES, default=DEFAULT_POLICY,
+                        help="When an output file already exists: write name-1.ext (suffix, the default), "
+                             "replace it (overwrite) or leave it and skip the input (skip).")
+    parser.add_argument('--mirror', action='store_true',
+                        help="Mirror a source directory into the output directory, converting only new or changed files.")
+    parser.add_argument('--delete', action='store_true',
+                        help="With --mirror, remove outputs whose source file was deleted.")
+
+    caching = parser.add_argument_group("output cache")
+    caching.add_argument('--cache', action='store_true',
+                         help="Reuse earlier results for unchanged inputs and identical settings.")
+    caching.add_argument('--cache-dir', help="Cache location (implies --cache).")
+    caching.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // 1024 ** 2,
+                         help="Cache size cap in MB; least recently used entries are evicted (default: %(default)s).")
+
+    stats = parser.add_argument_group("instrumentation")
+    stats.add_argument('--stats', action='store_true',
+                       help="Print the time spent per stage (decode, resize, encode, ...) and the throughput.")
+    stats.add_argument('--stats-json', metavar='FILE',
+                       help="Write the batch summary and every file's result (timings, sizes, codec) as JSON.")
+    stats.add_argument('--profiler', choices=PROFILERS,
+                       help="Profile each conversion with cProfile or tracemalloc.")
+    stats.add_argument('--profiler-output', metavar='FILE',
+                       help="Write the profiles here instead of to stderr.")
+
+    options = parser.add_argument_group("conversion settings")
+    options.add_argument('--width', type=int)
+    options.add_argument('--height', type=int)
+    options.add_argument('--no-keep-aspect-ratio', dest='keep_aspect_ratio', action='store_false')
+    options.add_argument('--quality', type=int, help="Image quality (1-100) or video quality.")
+    options.add_argument('--lossless', action='store_true', help="Lossless WEBP output.")
+    options.add_argument('--resample', help="Image resampling filter: lanczos (default), bicubic, bilinear, "
+                                            "hamming, box or nearest.")
+    options.add_argument('--palette', choices=['adaptive', 'global'],
+                         help="Animated GIF palette: per frame with dithering (adaptive, default) "
+                              "or one palette shared by all frames (global, faster).")
+    options.add_argument('--op', action='append', metavar='NAME[=ARGS]',
+                         help="Image operation, repeatable: auto_orient, crop=x,y,w,h, rotate=deg, "
+                              "pad=w,h[,color], sharpen[=radius,percent,threshold], colorspace=sRGB|RGB|L|CMYK, "
+                              "watermark=path[,position[,opacity[,scale]]]. Always applied in that order.")
+    options.add_argument('--bitrate', help="Audio bitrate in kbps, e.g. 192.")
+    options.add_argument('--resolution', help="Video height, e.g. 720p.")
+
+    audio = parser.add_argument_group("audio encoding")
+    audio.add_argument('--bitrate-mode', choices=['cbr', 'abr', 'vbr'],
+                       help="Constant, average or variable bitrate for lossy formats (default: cbr).")
+    audio.add_argument('--sample-rate', type=int, help="Resample to this rate in Hz, e.g. 16000.")
+    audio.add_argument('--channels', type=int, help="Number of output channels; 1 downmixes to mono.")
+    audio.add_argument('--bit-depth', type=int, choices=[16, 24, 32], help="Bits per sample for WAV/FLAC.")
+    audio.add_argument('--compression-level', type=int, choices=range(0, 13), metavar='0-12',
+                       help="FLAC compression level; higher is smaller but slower.")
+    audio.add_argument('--normalize', nargs='?', type=float, const=-23.0, metavar='LUFS',
+                       help="Normalize loudness (EBU R128) to this integrated level (default: -23).")
+    audio.add_argument('--trim-silence', action='store_true', help="Remove leading and trailing silence.")
+    audio.add_argument('--silence-threshold', type=float, metavar='DBFS',
+                       help="Level below which --trim-silence treats audio as silence (default: -50).")
+
+    video = parser.add_argument_group("video encoding")
+    video.add_argument('--profile', help="Named encoding profile (built-in or saved from the GUI).")
+    video.add_argument('--video-codec', help="libx264, libx265, libvpx-vp9, libaom-av1 or copy.")
+    video.add_argument('--audio-codec', help="aac, libopus, libvorbis, libmp3lame or copy.")
+    video.add_argument('--preset', help="Encoder speed preset, ultrafast ... veryslow.")
+    video.add_argument('--tune', help="x264/x265 tuning, e.g. film or animation.")
+    video.add_argument('--threads', type=int, help="Encoder threads per file (0 = automatic).")
+    video.add_argument('--video-bitrate', type=int, help="Target video bitrate in kbps instead of CRF.")
+    video.add_argument('--two-pass', action='store_true', help="Two-pass encoding (requires --video-bitrate).")
+    video.add_argument('--segments', metavar='N|auto',
+                       help="Split long videos at keyframes and encode N pieces in parallel.")
+    video.add_argument('--stream-copy', choices=['auto', 'always', 'never'], default='auto',
+                       help="Remux streams the target container supports instead of re-encoding them. "
+                            "'auto' copies only streams no encoding option was given for (default: %(default)s).")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    media_type = media_type_for_format(args.to_format)
+    if media_type is None:
+        parser.error(f"unsupported target format: {args.to_format}")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    def report(percent):
+        print(f"\r{percent:3d}%", end="", file=sys.stderr, flush=True)
+
+    cache = None
+    if args.cache or args.cache_dir:
+        cache = ConversionCache(args.cache_dir, max_bytes=args.cache_size * 1024 ** 2)
+
+    if args.mirror:
+        if len(args.inputs) != 1 or not os.path.isdir(args.inputs[0]):
+            parser.error("--mirror takes exactly one source directory")
+        return run_mirror(args, cache, None if args.quiet else report)
+    if args.delete:
+        parser.error("--delete requires --mirror")
+
+    # Conversions start while directories are still being walked.
+    index = DiscoveryIndex()
+    settings = build_settings(args)
+    jobs = (Job(media_type, found.path, args.output_dir, args.to_format, settings)
+            for found in index.track(collect_inputs(args.inputs, media_type, args.recursive)))
+    started = time.perf_counter()
+    results = run_batch(jobs, max_workers=args.jobs, progress_callback=None if args.quiet else report, cache=cache,
+                        profiler=args.profiler, budget=build_budget(args))
+    elapsed = time.perf_counter() - started
+    if not results:
+        print("No input files found.", file=sys.stderr)
+        return 1
+    if not args.quiet:
+        print(file=sys.stderr)
+        if index.misnamed:
+            print(f"{len(index.misnamed)} file(s) recognised by content despite their extension.", file=sys.stderr)
+
+    failed = [result for result in results if not result]
+    for result in failed:
+        print(f"Failed: {result.input_path}" + (f" ({result.error})" if result.error else ""), file=sys.stderr)
+    print(f"{len(results) - len(failed)} of {len(results)} file(s) converted.")
+    write_reports(args, results, elapsed)
+    return 1 if failed else 0
+
+
+def write_reports(args, results, elapsed):
+    """Prints or writes the --stats, --stats-json and --profiler output of a batch."""
+    summary = summarize(results, elapsed)
+    if args.stats:
+        for line in format_summary(summary):
+            print(line)
+    if args.stats_json:
+        with open(args.stats_json, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'files': [result.to_dict() for result in results]}, f, indent=2)
+    if args.profiler:
+        profiles = ''.join(f"=== {result.input_path}\n{result.profile}\n" for result in results if result.profile)
+        if args.profiler_output:
+            with open(args.profiler_output, 'w', encoding='utf-8') as f:
+                f.write(profiles)
+        else:
+            print(profiles, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""
+Structured outcome of a conversion, with per-stage timings.
+
+Every converter returns a ConversionResult. It is truthy when the
+conversion succeeded, so callers that only check `if convert(...)` keep
+working, and it is a plain picklable object, so results come back from
+worker processes unchanged.
+
+Stages are timed with the stage() context manager; entering the same stage
+again adds to its total, which is how per-frame work is accumulated:
+
+    result = ConversionResult(input_path)
+    with result.stage('decode'):
+        img.load()
+
+The stage names used by the converters are:
+
+    probe     reading stream information with ffprobe
+    decode    reading and decoding the source (audio: into the analysis spool)
+    resize    cropping, resizing and orienting
+    ops       the image operations of image_ops
+    frames    decoding, resizing and processing animation frames
+    quantize  reducing frames to a palette (GIF)
+    analyze   measuring loudness and silence
+    encode    compressing the output (FFmpeg: decoding and encoding together)
+    write     writing the output file
+    cache     looking up and storing cache entries
+
+profile_call() adds an opt-in cProfile or tracemalloc report to a result,
+and summarize() aggregates a batch of results.
+"""
+import io
+import os
+import time
+from contextlib import contextmanager
+
+PROFILERS = ['cprofile', 'tracemalloc']
+PROFILE_LINES = 25
+
+
+class ConversionResult:
+    """The outcome, timings, sizes and chosen encoder of one conversion."""
+
+    def __init__(self, input_path, output_path=None):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.ok = False
+        self.cancelled = False
+        self.cached = False
+        self.skipped = False  # The output already existed and the 'skip' policy kept it.
+        self.error = None
+        self.input_bytes = _size(input_path)
+        self.output_bytes = 0
+        self.codec = None
+        self.params = {}
+        self.stages = {}
+        self.profile = None
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        state = 'ok' if self.ok else 'cancelled' if self.cancelled else f'failed: {self.error}'
+        return f"<ConversionResult {os.path.basename(self.input_path)} {state} {self.seconds:.3f}s>"
+
+    @classmethod
+    def failure(cls, input_path, error):
+        """A result for a job that failed before (or outside) its converter."""
+        result = cls(input_path)
+        result.error = str(error)
+        return result
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block and adds it to stage `name`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def timed(self, name, iterable):
+        """Iterates `iterable`, adding the time spent producing each item to stage `name`."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def succeed(self):
+        """Marks the conversion done and records the output size and total time."""
+        self.ok = True
+        self.output_bytes = _size(self.output_path)
+        return self.finish()
+
+    def fail(self, error=None, cancelled=False):
+        self.error = str(error) if error is not None else None
+        self.cancelled = cancelled
+        return self.finish()
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+        return self
+
+    def to_dict(self):
+        return {
+            'input_path': self.input_path,
+            'output_path': self.output_path,
+            'ok': self.ok,
+            'cancelled': self.cancelled,
+            'cached': self.cached,
+            'skipped': self.skipped,
+            'error': self.error,
+            'input_bytes': self.input_bytes,
+            'output_bytes': self.output_bytes,
+            'codec': self.codec,
+            'params': self.params,
+            'seconds': round(self.seconds, 4),
+            'stages': {name: round(seconds, 4) for name, seconds in self.stages.items()},
+        }
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+
+def profile_call(profiler, function, *args, **kwargs):
+    """
+    Calls function(*args, **kwargs) under `profiler` ('cprofile' or
+    'tracemalloc') and stores the report as text on the ConversionResult it
+    returns.
+
+    cProfile only sees the calling thread, so it profiles one job at a time
+    even in a threaded batch. tracemalloc is process-wide: with several
+    jobs running in threads, their allocations are mixed in each report.
+    Neither sees work done inside FFmpeg child processes.
+    """
+    if profiler == 'cprofile':
+        import cProfile
+        import pstats
+        profile = cProfile.Profile()
+        result = profile.runcall(function, *args, **kwargs)
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        report = text.getvalue()
+    elif profiler == 'tracemalloc':
+        import tracemalloc
+        tracemalloc.start()
+        try:
+            result = function(*args, **kwargs)
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        lines = [f"Python heap: {current / 1024 ** 2:.1f} MB at the end, {peak / 1024 ** 2:.1f} MB peak"]
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:PROFILE_LINES]]
+        report = '\n'.join(lines)
+    else:
+        raise ValueError(f"Unknown profiler: {profiler}")
+    if isinstance(result, ConversionResult):
+        result.profile = report
+    return result
+
+
+def summarize(results, wall_seconds=None):
+    """
+    Aggregates a batch of ConversionResult into a report dict: counts, bytes
+    in and out, the time spent in each stage across all files, and
+    throughput. `wall_seconds` is the elapsed time of the whole batch; with
+    parallel workers it is less than the sum of the per-file times.
+    """
+    results = [result for result in results if isinstance(result, ConversionResult)]
+    converted = [result for result in results if result.ok]
+    stages = {}
+    for result in results:
+        for name, seconds in result.stages.items():
+            stages[name] = stages.get(name, 0.0) + seconds
+    busy = sum(result.seconds for result in results)
+    elapsed = wall_seconds if wall_seconds else busy
+    input_bytes = sum(result.input_bytes for result in converted)
+    return {
+        'files': len(results),
+        'converted': len(converted),
+        'cached': sum(1 for result in converted if result.cached),
+        'skipped': sum(1 for result in converted if result.skipped),
+        'cancelled': sum(1 for result in results if result.cancelled),
+        'failed': sum(1 for result in results if not result.ok and not result.cancelled),
+        'input_bytes': input_bytes,
+        'output_bytes': sum(result.output_bytes for result in converted),
+        'seconds': round(elapsed, 3),
+        'busy_seconds': round(busy, 3),
+        'stages': {name: round(seconds, 3) for name, seconds in sorted(stages.items(), key=lambda s: -s[1])},
+        'mb_per_s': round(input_bytes / 1024 ** 2 / elapsed, 2) if elapsed else None,
+        'files_per_s': round(len(converted) / elapsed, 2) if elapsed else None,
+    }
+
+
+def format_summary(summary):
+    """Human-readable lines for a summarize() report."""
+    lines = [
+        f"{summary['converted']} of {summary['files']} file(s) converted in {summary['seconds']:.2f} s "
+        f"({summary['files_per_s'] or 0:.2f} files/s, {summary['mb_per_s'] or 0:.2f} MB/s in; "
+        f"{summary['input_bytes'] / 1024 ** 2:.1f} MB -> {summary['output_bytes'] / 1024 ** 2:.1f} MB)",
+    ]
+    if summary['cached']:
+        lines.append(f"{summary['cached']} served from the cache")
+    if summary['skipped']:
+        lines.append(f"{summary['skipped']} skipped, their output already existed")
+    busy = summary['busy_seconds']
+    for name, seconds in summary['stages'].items():
+        share = f" ({100 * seconds / busy:.0f}%)" if busy else ""
+        lines.append(f"  {name:<9} {seconds:8.2f} s{share}")
+    return lines
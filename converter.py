@@ -1,86 +1,364 @@
-import os
-from PIL import Image
+import io
+from PIL import Image, ImageChops, ImageSequence, GifImagePlugin
 
-def convert_image(input_path, output_dir, to_format, settings=None):
+from conversion_result import ConversionResult
+from output_writer import reserve
+
+from image_ops import (
+    parse_ops, format_ops, asset_digests, orientation, oriented_size, crop_box, transpose, apply_ops
+)
+
+RESAMPLE_FILTERS = {
+    'nearest': Image.Resampling.NEAREST,
+    'box': Image.Resampling.BOX,
+    'bilinear': Image.Resampling.BILINEAR,
+    'hamming': Image.Resampling.HAMMING,
+    'bicubic': Image.Resampling.BICUBIC,
+    'lanczos': Image.Resampling.LANCZOS,
+}
+DEFAULT_RESAMPLE = 'lanczos'
+
+# JPEGs are decoded at the smallest 1/2, 1/4 or 1/8 scale that is still at
+# least this many times the target size, and resize() first shrinks by whole
+# factors with reduce() until within this gap. Both keep the final resample
+# visually identical to a full-size one (Pillow's thumbnail() uses 2.0 too).
+REDUCING_GAP = 2.0
+
+# Animated GIFs are quantized per frame ('adaptive', Floyd-Steinberg) or
+# against one palette built up front from a sample of the frames ('global').
+PALETTE_MODES = ('adaptive', 'global')
+PALETTE_SAMPLE_FRAMES = 16
+PALETTE_SAMPLE_SIZE = (128, 128)
+# The last palette entry is kept free for transparent pixels.
+TRANSPARENT_INDEX = 255
+
+
+def _dimension(value):
+    value = str(value).strip() if value is not None else ''
+    return int(value) if value.isdigit() else 0
+
+
+def target_size(size, settings):
+    """
+    Works out the output size from settings['width'] / ['height'] /
+    ['keep_aspect_ratio'] without decoding any pixels. Returns None when no
+    resize was asked for.
+
+    With both dimensions and keep_aspect_ratio the image is fitted inside the
+    box and never enlarged (the previous thumbnail() behaviour); with one
+    dimension the other follows the aspect ratio.
+    """
+    w = _dimension(settings.get('width'))
+    h = _dimension(settings.get('height'))
+    keep_aspect = settings.get('keep_aspect_ratio', True)
+    original_width, original_height = size
+
+    if w <= 0 and h <= 0:
+        return None
+    if not keep_aspect:
+        # If not keeping aspect ratio, both dimensions must be provided
+        return (w, h) if w > 0 and h > 0 else None
+    if w > 0 and h > 0:
+        scale = min(w / original_width, h / original_height, 1.0)
+        fitted = (max(1, round(original_width * scale)), max(1, round(original_height * scale)))
+        return fitted if fitted != size else None
+    if w > 0:
+        return (w, max(1, round(w * original_height / original_width)))
+    return (max(1, round(h * original_width / original_height)), h)
+
+
+def resample_filter(settings):
+    name = str(settings.get('resample') or DEFAULT_RESAMPLE).lower()
+    if name not in RESAMPLE_FILTERS:
+        raise ValueError(f"Unknown resampling filter: {name}")
+    return RESAMPLE_FILTERS[name]
+
+
+def draft_scaled(img, size, box=None):
+    """
+    Asks the decoder for a reduced-size image where the format allows it,
+    ahead of resampling the region `box` (default: the whole image) to
+    `size`. Returns `box` in the coordinates of the image as it will decode.
+
+    For JPEG, draft() makes libjpeg scale the DCT blocks while decoding, so a
+    40 MP photo headed for a thumbnail is never fully decoded; this cuts both
+    decode time and peak memory. Other formats are decoded in full and shrunk
+    with reduce() before the final filter.
+    """
+    box = box or (0, 0) + img.size
+    crop_width, crop_height = box[2] - box[0], box[3] - box[1]
+    if img.format == 'JPEG' and size[0] < crop_width and size[1] < crop_height:
+        full_width, full_height = img.size
+        img.draft(None, (int(size[0] * REDUCING_GAP * full_width / crop_width),
+                         int(size[1] * REDUCING_GAP * full_height / crop_height)))
+        # The crop box is in full-size pixels; scale it to the drafted size.
+        sx, sy = img.width / full_width, img.height / full_height
+        box = (box[0] * sx, box[1] * sy, box[2] * sx, box[3] * sy)
+    return box
+
+
+def load_prepared(img, settings, ops, result):
+    """
+    Decodes `img` and applies the auto_orient and crop operations and the
+    requested resize, fusing crop and resize into a single resample.
+    Timed as the 'decode' and 'resize' stages of `result`.
+    """
+    with result.stage('decode'):
+        orient = orientation(img, ops)
+        box = crop_box(ops, oriented_size(img.size, orient))
+        if box and orient != 1:
+            # The crop box is given in upright coordinates: orient the full image first.
+            img = transpose(img, orient)
+            orient = 1
+        source_size = (box[2] - box[0], box[3] - box[1]) if box else img.size
+        size = target_size(oriented_size(source_size, orient), settings)
+        if size:
+            size = oriented_size(size, orient)
+            box = draft_scaled(img, size, box)
+        img.load()
+
+    with result.stage('resize'):
+        if size:
+            img = img.resize(size, resample=resample_filter(settings), box=box, reducing_gap=REDUCING_GAP)
+        elif box:
+            img = img.crop(box)
+        return transpose(img, orient)
+
+
+def animation_frames(img, size, resample, ops=()):
+    """
+    Yields (frame, duration_ms) for every frame of an animated image, one at a
+    time, converted to RGBA, cropped and resized to `size` if given, and run
+    through the image operations. Only the current frame is held, however
+    long the animation is.
+    """
+    default_duration = img.info.get('duration', 100)
+    box = crop_box(ops, img.size)
+    for frame in ImageSequence.Iterator(img):
+        rgba = frame.convert('RGBA')
+        # Read after convert(): some formats only fill in the duration on load.
+        duration = frame.info.get('duration', default_duration)
+        if size:
+            rgba = rgba.resize(size, resample=resample, box=box, reducing_gap=REDUCING_GAP)
+        elif box:
+            rgba = rgba.crop(box)
+        yield apply_ops(rgba, ops, animated=True), duration
+
+
+def global_palette(img):
+    """
+    Builds one palette for the whole animation from up to
+    PALETTE_SAMPLE_FRAMES frames spread over it, shrunk to thumbnails.
+    Returns a 'P' image usable as quantize(palette=...).
+    """
+    count = img.n_frames
+    step = max(1, count // PALETTE_SAMPLE_FRAMES)
+    samples = []
+    for index in range(0, count, step)[:PALETTE_SAMPLE_FRAMES]:
+        img.seek(index)
+        sample = img.convert('RGB')
+        sample.thumbnail(PALETTE_SAMPLE_SIZE)
+        samples.append(sample)
+    img.seek(0)
+
+    strip = Image.new('RGB', (sum(s.width for s in samples), max(s.height for s in samples)))
+    x = 0
+    for sample in samples:
+        strip.paste(sample, (x, 0))
+        x += sample.width
+    palette = strip.quantize(colors=TRANSPARENT_INDEX, method=Image.Quantize.MEDIANCUT).getpalette()
+    # Pad with copies of entry 0, so the nearest-colour search never lands
+    # on the transparent index for an opaque pixel.
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette(palette + palette[:3] * (256 - len(palette) // 3))
+    return palette_image
+
+
+def _quantize(frame, palette_image):
+    """Quantizes an RGBA frame to a 256-entry palette, mapping transparent pixels to TRANSPARENT_INDEX."""
+    if palette_image is None:
+        quantized = frame.convert('RGB').quantize(colors=TRANSPARENT_INDEX, dither=Image.Dither.FLOYDSTEINBERG)
+        palette = quantized.getpalette()
+        quantized.putpalette(palette + [0] * (768 - len(palette)))
+    else:
+        quantized = frame.convert('RGB').quantize(palette=palette_image, dither=Image.Dither.NONE)
+    alpha = frame.getchannel('A')
+    if alpha.getextrema()[0] < 128:
+        quantized.paste(TRANSPARENT_INDEX, mask=alpha.point(lambda a: 255 if a < 128 else 0))
+    return quantized
+
+
+def save_animated_gif(img, output_path, size, resample, palette_mode, result, ops=()):
+    """
+    Writes an animated GIF one frame at a time, so memory use does not grow
+    with the length of the animation (Pillow's save_all keeps every frame
+    until the end).
+
+    Opaque frames only store the region that changed since the previous one
+    and are left on screen (disposal 1); frames with transparent pixels are
+    stored whole and cleared afterwards (disposal 2). Frames identical to the
+    previous one are merged into it by adding up their durations. Each frame
+    is written one step late so that can still happen.
+
+    Timed as the 'frames', 'quantize' and 'encode' stages of `result`.
+    """
+    if palette_mode not in PALETTE_MODES:
+        raise ValueError(f"Unknown palette mode: {palette_mode}")
+    with result.stage('quantize'):
+        palette_image = global_palette(img) if palette_mode == 'global' else None
+
+    with open(output_path, 'wb') as fp:
+        previous = None  # Last frame (RGBA), to find the changed region.
+        pending = None   # [quantized image, offset, params] not yet written.
+        for frame, duration in result.timed('frames', animation_frames(img, size, resample, ops)):
+            transparent = frame.getchannel('A').getextrema()[0] < 128
+            bbox = (0, 0) + frame.size
+            if pending is None:
+                canvas = Image.new('P', frame.size)
+                canvas.putpalette(palette_image.getpalette() if palette_image else [0] * 768)
+                fp.write(b''.join(GifImagePlugin.getheader(canvas, None, {'loop': img.info.get('loop', 0)})[0]))
+            elif transparent:
+                if pending[1] != (0, 0) or pending[0].size != frame.size:
+                    # Disposal only clears the previous frame's rectangle: store it whole.
+                    with result.stage('quantize'):
+                        pending[0], pending[1] = _quantize(previous, palette_image), (0, 0)
+                pending[2]['disposal'] = 2
+            elif pending[2]['disposal'] == 1:
+                changed = ImageChops.difference(frame, previous).getbbox(alpha_only=False)
+                if changed is None:
+                    pending[2]['duration'] += duration
+                    continue
+                bbox = changed
+
+            if pending is not None:
+                with result.stage('encode'):
+                    _write_gif_frame(fp, *pending)
+            params = {'duration': duration, 'disposal': 2 if transparent else 1,
+                      'include_color_table': palette_image is None}
+            if transparent:
+                params['transparency'] = TRANSPARENT_INDEX
+            with result.stage('quantize'):
+                pending = [_quantize(frame.crop(bbox), palette_image), bbox[:2], params]
+            previous = frame
+        with result.stage('encode'):
+            if pending is not None:
+                _write_gif_frame(fp, *pending)
+            fp.write(b';')
+
+
+def _write_gif_frame(fp, quantized, offset, params):
+    for chunk in GifImagePlugin.getdata(quantized, offset, **params):
+        fp.write(chunk)
+
+
+def save_animated_webp(img, output_path, size, resample, settings, result, ops=()):
+    """
+    Writes an animated WebP with every frame resized and its own duration.
+    Pillow's WebP encoder needs all frames up front, so only the resized
+    frames are kept, not the decoded originals.
+
+    Timed as the 'frames' and 'encode' stages of `result`.
+    """
+    frames = []
+    durations = []
+    for frame, duration in result.timed('frames', animation_frames(img, size, resample, ops)):
+        frames.append(frame)
+        durations.append(duration)
+    result.params = {'lossless': bool(settings.get('lossless', False)), 'quality': int(settings.get('quality', 80)),
+                     'method': 6, 'frames': len(frames), 'size': frames[0].size}
+    with result.stage('encode'):
+        frames[0].save(
+            output_path, 'webp', save_all=True, append_images=frames[1:], duration=durations,
+            loop=img.info.get('loop', 0), lossless=result.params['lossless'],
+            quality=result.params['quality'], method=6
+        )
+
+
+def convert_image(input_path, output_dir, to_format, settings=None, cache=None):
+    """
+    Converts an image with Pillow.
+
+    :param settings: 'width', 'height', 'keep_aspect_ratio', 'quality', 'lossless', 'resample',
+        'palette', 'ops' (see image_ops) and 'if_exists' (see output_writer).
+    :return: A ConversionResult; truthy on success, with the time spent in
+        each stage (decode, resize, ops, frames, quantize, encode, write).
+    """
     if settings is None:
         settings = {}
     to_format_lower = to_format.lower()
+    result = ConversionResult(input_path)
 
     try:
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        base_name = os.path.splitext(os.path.basename(input_path))[0]
-        output_path = os.path.join(output_dir, f"{base_name}.{to_format_lower}")
-
-        i = 1
-        while os.path.exists(output_path):
-            output_path = os.path.join(output_dir, f"{base_name}-{i}.{to_format_lower}")
-            i += 1
-
-        with Image.open(input_path) as img:
-            width_str = settings.get('width')
-            height_str = settings.get('height')
-            keep_aspect = settings.get('keep_aspect_ratio', True)
-
-            try:
-                w = int(width_str) if width_str and width_str.isdigit() else 0
-                h = int(height_str) if height_str and height_str.isdigit() else 0
-
-                # Only proceed if at least one dimension is specified
-                if w > 0 or h > 0:
-                    if keep_aspect:
-                        # If both dimensions are provided, use thumbnail to fit within the box
-                        if w > 0 and h > 0:
-                            img.thumbnail((w, h))
-                        # If only one dimension is provided, calculate the other and resize
-                        else:
-                            original_width, original_height = img.size
-                            if w > 0:  # h is 0
-                                h = round(w * original_height / original_width)
-                            else:  # w is 0
-                                w = round(h * original_width / original_height)
-                            img = img.resize((w, h))
-                    # If not keeping aspect ratio, both dimensions must be provided
-                    elif w > 0 and h > 0:
-                        img = img.resize((w, h))
-
-            except (ValueError, TypeError):
-                pass # Silently ignore errors in dimensions and don't resize
-
-            save_params = {}
-            is_animated = hasattr(img, 'n_frames') and img.n_frames > 1
-
-            if to_format_lower == 'gif' and is_animated:
-                frames = [frame.copy().convert("RGBA").quantize(colors=256, dither=Image.Dither.FLOYDSTEINBERG) for frame in Image.ImageSequence.Iterator(img)]
-                if frames:
-                    frames[0].save(
-                        output_path, 'gif', save_all=True, append_images=frames[1:],
-                        duration=img.info.get('duration', 100), loop=img.info.get('loop', 0),
-                        disposal=2, transparency=img.info.get('transparency', -1)
-                    )
-                return True
-
-            elif to_format_lower == 'webp' and is_animated:
-                save_params.update({
-                    'lossless': settings.get('lossless', False),
-                    'quality': int(settings.get('quality', 80)),
-                    'method': 6,
-                    'duration': img.info.get('duration', 100),
-                    'loop': img.info.get('loop', 0),
-                })
-                img.save(output_path, 'webp', save_all=True, **save_params)
-                return True
-
-            if to_format_lower in ['jpeg', 'jpg', 'bmp'] and img.mode == 'RGBA':
-                img = img.convert('RGB')
-
-            if to_format_lower in ['jpeg', 'jpg', 'webp']:
-                save_params['quality'] = int(settings.get('quality', 95))
-
-            img.save(output_path, format=to_format, **save_params)
-
-        return True
+        ops = parse_ops(settings.get('ops'))
+        with reserve(input_path, output_dir, to_format_lower, settings.get('if_exists')) as output:
+            result.output_path = output.path
+            if output.existing:
+                result.skipped = True
+                return result.succeed()
+            # Everything is written under a temporary name and renamed into place at the end.
+            output_path = output.temp_path
+
+            key_settings = settings
+            if ops:
+                # Key on the canonical spec and on the content of any watermark file.
+                key_settings = {**settings, 'ops': format_ops(ops), 'op_assets': asset_digests(ops)}
+            with result.stage('cache'):
+                cache_key = cache.key(input_path, to_format_lower, key_settings) if cache else None
+                result.cached = bool(cache_key and cache.fetch(cache_key, to_format_lower, output_path))
+            if result.cached:
+                output.commit()
+                return result.succeed()
+
+            with Image.open(input_path) as img:
+                # Animated GIF/WebP output is resized frame by frame while saving.
+                is_animated = getattr(img, 'n_frames', 1) > 1 and to_format_lower in ['gif', 'webp']
+                if is_animated:
+                    box = crop_box(ops, img.size)
+                    size = target_size((box[2] - box[0], box[3] - box[1]) if box else img.size, settings)
+                else:
+                    img = load_prepared(img, settings, ops, result)
+                    with result.stage('ops'):
+                        img = apply_ops(img, ops)
+
+                save_params = {}
+
+                if to_format_lower == 'gif' and is_animated:
+                    result.codec = 'gif'
+                    result.params = {'palette': settings.get('palette') or 'adaptive', 'frames': img.n_frames,
+                                     'size': size or img.size}
+                    save_animated_gif(img, output_path, size, resample_filter(settings),
+                                      result.params['palette'], result, ops)
+
+                elif to_format_lower == 'webp' and is_animated:
+                    result.codec = 'webp'
+                    save_animated_webp(img, output_path, size, resample_filter(settings), settings, result, ops)
+
+                else:
+                    if to_format_lower in ['jpeg', 'jpg', 'bmp'] and img.mode == 'RGBA':
+                        img = img.convert('RGB')
+
+                    if to_format_lower in ['jpeg', 'jpg', 'webp']:
+                        save_params['quality'] = int(settings.get('quality', 95))
+
+                    # Pillow only knows the JPEG format by its canonical name.
+                    save_format = 'JPEG' if to_format_lower in ['jpeg', 'jpg'] else to_format_lower
+                    result.codec = save_format.lower()
+                    result.params = {'size': img.size, 'mode': img.mode, **save_params}
+                    # Encode to memory first so compression and disk time are reported apart.
+                    encoded = io.BytesIO()
+                    with result.stage('encode'):
+                        img.save(encoded, format=save_format, **save_params)
+                    with result.stage('write'):
+                        with open(output_path, 'wb') as f:
+                            f.write(encoded.getbuffer())
+
+            output.commit()
+
+        if cache_key:
+            with result.stage('cache'):
+                cache.store(cache_key, to_format_lower, output.path)
+
+        return result.succeed()
     except Exception as e:
         print(f"Error converting {input_path} to {to_format}: {e}")
-        return False
+        return result.fail(e)
@@ -0,0 +1,250 @@
+"""
+Delta updates: fetching only the files that changed between releases.
+
+Every release publishes, next to its zip, a manifest (`<zip>.manifest.json`)
+with the size and SHA-256 of each file of the install folder; the same
+manifest is shipped inside the folder as MANIFEST_NAME. To update, the
+installed files are compared with the new manifest (by size, then hash),
+and only the members that differ are read out of the release zip with HTTP
+Range requests: the zip's central directory says where each member is, so
+an unchanged 100 MB FFmpeg costs nothing. Files listed in the installed
+manifest but not in the new one are removed.
+
+fetch_delta() leaves the result in a staging folder:
+
+    delta.json      {"version": ..., "changed": [...], "removed": [...]}
+    files/<path>    the new version of every changed file
+
+which install_update.py applies in place, with rollback. When the server
+does not honour Range requests, or the install has no manifest to compare
+with, DeltaUnavailable is raised and the caller downloads the full zip.
+
+    python delta_update.py manifest dist/UniversalConverter 2.1.0 > manifest.json
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import zipfile
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_SUFFIX = '.manifest.json'
+MANIFEST_VERSION = 1
+DELTA_NAME = 'delta.json'
+STAGED_FILES = 'files'
+# Above this share of the zip's size, fetching the members one by one saves too little.
+MAX_DELTA_SHARE = 0.8
+
+
+class DeltaUnavailable(Exception):
+    """A delta update cannot be made; fall back to the full download."""
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_manifest(directory, version):
+    """
+    The manifest of an install folder: {'version', 'files': {path: {'size', 'sha256'}}},
+    with '/'-separated paths relative to `directory`. The manifest itself is not listed.
+    """
+    files = {}
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, directory).replace(os.sep, '/')
+            if relative != MANIFEST_NAME:
+                files[relative] = {'size': os.path.getsize(path), 'sha256': file_sha256(path)}
+    return {'manifest_version': MANIFEST_VERSION, 'version': version, 'files': files}
+
+
+def load_manifest(install_dir):
+    try:
+        with open(os.path.join(install_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('manifest_version') == MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def plan_delta(install_dir, installed, manifest):
+    """
+    (changed, removed): the paths of `manifest` whose installed copy is
+    missing or different, and the paths of the `installed` manifest that the
+    new release no longer has.
+    """
+    changed = []
+    for path, entry in sorted(manifest['files'].items()):
+        local = os.path.join(install_dir, *path.split('/'))
+        try:
+            same = os.path.getsize(local) == entry['size'] and file_sha256(local) == entry['sha256']
+        except OSError:
+            same = False
+        if not same:
+            changed.append(path)
+    removed = sorted(set(installed['files']) - set(manifest['files']))
+    return changed, removed
+
+
+class RemoteFile:
+    """
+    A read-only, seekable file over HTTP Range requests, for zipfile.
+
+    Sequential reads share one streaming response; a seek elsewhere opens a
+    new one from there, so each run of adjacent zip members costs a single
+    request.
+    """
+
+    def __init__(self, session, url, timeout):
+        self.session = session
+        self.url = url
+        self.timeout = timeout
+        self.position = 0
+        self.response = None
+        self.response_position = None
+        probe = session.get(url, headers={'Range': 'bytes=0-0'}, timeout=timeout)
+        probe.close()
+        content_range = probe.headers.get('content-range', '')
+        if probe.status_code != 206 or '/' not in content_range or content_range.endswith('/*'):
+            raise DeltaUnavailable("The server does not support range requests")
+        self.size = int(content_range.rsplit('/', 1)[1])
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.position, os.SEEK_END: self.size}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        size = min(size, self.size - self.position)
+        if size <= 0:
+            return b''
+        if self.response is None or self.response_position != self.position:
+            self._close_response()
+            self.response = self.session.get(self.url, headers={'Range': f'bytes={self.position}-'},
+                                             stream=True, timeout=self.timeout)
+            if self.response.status_code != 206:
+                self._close_response()
+                raise DeltaUnavailable("The server ignored a range request")
+            self.response_position = self.position
+        chunks, received = [], 0
+        while received < size:
+            chunk = self.response.raw.read(size - received)
+            if not chunk:
+                raise OSError("Connection closed in the middle of a zip member")
+            chunks.append(chunk)
+            received += len(chunk)
+        data = b''.join(chunks)
+        self.position += len(data)
+        self.response_position = self.position
+        return data
+
+    def _close_response(self):
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+
+    def close(self):
+        self._close_response()
+
+
+def fetch_delta(zip_url, install_dir, staging_dir, progress_callback=None, timeout=(10, 30)):
+    """
+    Stages the files that differ between the install in `install_dir` and
+    the release whose zip is at `zip_url`.
+
+    :param progress_callback: Optional; called with the percentage of the
+        changed members' compressed bytes fetched so far.
+    :return: The path of `staging_dir`, ready for install_update.py.
+    :raises DeltaUnavailable: If the install has no manifest, the release has
+        none, the server does not support ranges, or the delta would be
+        nearly as large as the zip.
+    :raises requests.RequestException, OSError: On network and disk errors.
+    """
+    import requests
+
+    installed = load_manifest(install_dir)
+    if installed is None:
+        raise DeltaUnavailable("The installed version has no manifest")
+    with requests.Session() as session:
+        response = session.get(zip_url + MANIFEST_SUFFIX, timeout=timeout)
+        if response.status_code == 404:
+            raise DeltaUnavailable("The release has no manifest")
+        response.raise_for_status()
+        manifest = response.json()
+        if manifest.get('manifest_version') != MANIFEST_VERSION:
+            raise DeltaUnavailable("Unknown manifest version")
+
+        changed, removed = plan_delta(install_dir, installed, manifest)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        files_dir = os.path.join(staging_dir, STAGED_FILES)
+        os.makedirs(files_dir)
+
+        remote = RemoteFile(session, zip_url, timeout)
+        try:
+            with zipfile.ZipFile(remote) as archive:
+                members = {info.filename.replace('\\', '/'): info for info in archive.infolist()}
+                missing = [path for path in changed if path not in members]
+                if missing:
+                    raise DeltaUnavailable(f"Not in the release zip: {missing[0]}")
+                # In archive order, so that adjacent members are read in one request.
+                infos = sorted((members[path] for path in changed), key=lambda info: info.header_offset)
+                total = sum(info.compress_size for info in infos)
+                if total > remote.size * MAX_DELTA_SHARE:
+                    raise DeltaUnavailable("Most of the release changed")
+                done = 0
+                for info in infos:
+                    path = info.filename.replace('\\', '/')
+                    target = os.path.join(files_dir, *path.split('/'))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with archive.open(info) as source, open(target, 'wb') as f:
+                        shutil.copyfileobj(source, f, 1024 * 1024)
+                    if info.external_attr >> 16:
+                        os.chmod(target, info.external_attr >> 16 & 0o777)  # Zips made on Unix keep the mode.
+                    if file_sha256(target) != manifest['files'][path]['sha256']:
+                        raise OSError(f"Checksum mismatch for {path}")
+                    done += info.compress_size
+                    if progress_callback and total:
+                        progress_callback(int(100 * done / total))
+        finally:
+            remote.close()
+
+    # The new manifest goes in too, so the next update can compare against it.
+    with open(os.path.join(files_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    with open(os.path.join(staging_dir, DELTA_NAME), 'w', encoding='utf-8') as f:
+        json.dump({'version': manifest.get('version'), 'changed': changed + [MANIFEST_NAME],
+                   'removed': removed}, f, indent=2)
+    return staging_dir
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 3 or argv[0] != 'manifest':
+        print("Usage: python delta_update.py manifest <install folder> <version>", file=sys.stderr)
+        return 2
+    json.dump(build_manifest(argv[1], argv[2]), sys.stdout, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
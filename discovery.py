@@ -0,0 +1,221 @@
+"""
+Finding convertible files in folders, by content rather than by name.
+
+walk() lists a tree with os.scandir, one directory at a time, and
+discover() sniffs each file from its first HEADER_BYTES bytes (magic
+numbers; no Image.open or ffprobe), so a huge tree yields its first files
+straight away and conversions can start while the walk goes on.
+
+Files are classified by what they contain: a PNG saved as photo.jpg, or an
+audio-only MP4 named .m4a, go to the converter that can read them. Files
+whose header is not recognised fall back to their extension, and files
+that match neither are skipped, as are outputs still being written (see
+output_writer).
+
+DiscoveryIndex groups what has been found so far by media type and format.
+"""
+import os
+from collections import namedtuple
+
+from batch import media_type_for_format
+from output_writer import TEMP_PREFIX
+
+HEADER_BYTES = 64
+
+Found = namedtuple('Found', ['path', 'media_type', 'format', 'sniffed'])
+
+# Source media types each converter can read: the audio converter also
+# extracts the soundtrack of a video.
+ACCEPTED_SOURCES = {
+    'image': {'image'},
+    'audio': {'audio', 'video'},
+    'video': {'video'},
+}
+
+# Simple signatures at offset 0; RIFF, ISO BMFF, Ogg, EBML and MPEG audio are
+# told apart in sniff_header().
+MAGIC = [
+    (b'\xff\xd8\xff', 'image', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'image', 'png'),
+    (b'GIF87a', 'image', 'gif'),
+    (b'GIF89a', 'image', 'gif'),
+    (b'II*\x00', 'image', 'tiff'),
+    (b'MM\x00*', 'image', 'tiff'),
+    (b'fLaC', 'audio', 'flac'),
+    (b'ID3', 'audio', 'mp3'),
+    (b'FLV\x01', 'video', 'flv'),
+]
+RIFF_TYPES = {b'WEBP': ('image', 'webp'), b'WAVE': ('audio', 'wav'), b'AVI ': ('video', 'avi')}
+AUDIO_BRANDS = {b'M4A ', b'M4B ', b'M4P ', b'F4A '}
+IMAGE_BRANDS = {b'avif': 'avif', b'avis': 'avif', b'heic': 'heic', b'heix': 'heic', b'mif1': 'heic'}
+BMP_HEADER_SIZES = {12, 40, 52, 56, 64, 108, 124}
+
+
+def sniff_header(header):
+    """(media_type, format) for the first bytes of a file, or None if unrecognised."""
+    for magic, media_type, fmt in MAGIC:
+        if header.startswith(magic):
+            return media_type, fmt
+    if header[:4] == b'RIFF':
+        return RIFF_TYPES.get(header[8:12])
+    if header[:4] == b'FORM' and header[8:12] in (b'AIFF', b'AIFC'):
+        return 'audio', 'aiff'
+    if header[4:8] == b'ftyp':
+        brand = header[8:12]
+        if brand in AUDIO_BRANDS:
+            return 'audio', 'm4a'
+        if brand in IMAGE_BRANDS:
+            return 'image', IMAGE_BRANDS[brand]
+        return 'video', 'mov' if brand == b'qt  ' else 'mp4'
+    if header[:4] == b'OggS':
+        if b'OpusHead' in header:
+            return 'audio', 'opus'
+        if b'theora' in header:
+            return 'video', 'ogv'
+        return 'audio', 'ogg'
+    if header[:4] == b'\x1aE\xdf\xa3':
+        return 'video', 'webm' if b'webm' in header else 'mkv'
+    if header[:2] == b'BM' and int.from_bytes(header[14:18], 'little') in BMP_HEADER_SIZES:
+        return 'image', 'bmp'
+    fmt = _mpeg_audio(header)
+    if fmt:
+        return 'audio', fmt
+    return None
+
+
+def _mpeg_audio(header):
+    """
+    'aac' or 'mp3' if `header` starts with a valid ADTS or MPEG audio frame
+    header. A frame sync alone is too weak: it also matches, for instance,
+    the UTF-16 byte-order mark FF FE, so the other fields are checked too.
+    """
+    if len(header) < 4 or header[0] != 0xFF or header[1] in (0xFE, 0xFF):
+        return None
+    if header[1] & 0xF6 == 0xF0:
+        # ADTS: 12-bit sync and layer 00; sampling frequency indexes 13-15 are invalid.
+        return 'aac' if header[2] >> 2 & 0x0F < 13 else None
+    if header[1] & 0xE0 != 0xE0:
+        return None
+    version, layer = header[1] >> 3 & 0x03, header[1] >> 1 & 0x03
+    bitrate, sample_rate = header[2] >> 4, header[2] >> 2 & 0x03
+    if version == 0b01 or layer == 0b00 or bitrate == 0x0F or sample_rate == 0b11:
+        return None  # Reserved values.
+    return 'mp3'
+
+
+def sniff(path):
+    """sniff_header() of a file's first HEADER_BYTES bytes; None if unreadable or unrecognised."""
+    try:
+        with open(path, 'rb') as f:
+            return sniff_header(f.read(HEADER_BYTES))
+    except OSError:
+        return None
+
+
+def detect(path):
+    """
+    Classifies one file, by content first and by extension otherwise.
+
+    :return: A Found, or None if the file is not a media file we know.
+    """
+    sniffed = sniff(path)
+    if sniffed:
+        return Found(path, sniffed[0], sniffed[1], True)
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    media_type = media_type_for_format(ext) if ext else None
+    if media_type is None:
+        return None
+    return Found(path, media_type, ext, False)
+
+
+def walk(directory, recursive=True):
+    """
+    Yields the paths of the files under `directory`, sorted by name within
+    each directory and each directory's files before its subdirectories,
+    as os.walk would. Symlinked directories are not followed, and
+    directories that cannot be read are skipped.
+    """
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path
+            except OSError:
+                continue
+        if recursive:
+            pending.extend(reversed(subdirs))
+
+
+def discover(paths, recursive=True, accept=None):
+    """
+    Lazily yields a Found for every media file among `paths`, which may be
+    files or directories (walked with walk()). Each file is yielded once.
+
+    :param accept: Optional set of media types to keep; others are skipped.
+    """
+    seen = set()
+    for path in paths:
+        candidates = walk(path, recursive) if os.path.isdir(path) else [path]
+        for candidate in candidates:
+            if candidate in seen or os.path.basename(candidate).startswith(TEMP_PREFIX):
+                continue  # Outputs still being written by a conversion are not inputs.
+            seen.add(candidate)
+            found = detect(candidate)
+            if found and (accept is None or found.media_type in accept):
+                yield found
+
+
+def is_misnamed(found):
+    """True if the content of a file does not match the media type its extension suggests."""
+    ext = os.path.splitext(found.path)[1].lstrip('.')
+    return media_type_for_format(ext) != found.media_type if ext else True
+
+
+class DiscoveryIndex:
+    """
+    Files found so far, grouped by (media_type, format). Wrap a discover()
+    generator in track() to fill the index as the files are consumed:
+
+        index = DiscoveryIndex()
+        for found in index.track(discover([folder])):
+            ...
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self.misnamed = []
+
+    def add(self, found):
+        self.groups.setdefault((found.media_type, found.format), []).append(found.path)
+        if found.sniffed and is_misnamed(found):
+            self.misnamed.append(found.path)
+
+    def track(self, found_items):
+        for found in found_items:
+            self.add(found)
+            yield found
+
+    def __len__(self):
+        return sum(len(paths) for paths in self.groups.values())
+
+    def paths(self, media_type=None, fmt=None):
+        return [path for (group_type, group_format), paths in sorted(self.groups.items())
+                if media_type in (None, group_type) and fmt in (None, group_format)
+                for path in paths]
+
+    def counts(self):
+        """{media_type: {format: number of files}}."""
+        counts = {}
+        for (media_type, fmt), paths in sorted(self.groups.items()):
+            counts.setdefault(media_type, {})[fmt] = len(paths)
+        return counts
@@ -0,0 +1,195 @@
+"""
+Runs FFmpeg as a child process and streams its machine-readable progress.
+
+FFmpeg is started with `-progress pipe:1 -nostats`, so stdout carries
+`key=value` blocks (one per ~0.5 s) which are parsed as they arrive.
+Stderr is drained on a background thread that keeps only the last lines
+for error messages, instead of buffering hours of log output in memory.
+"""
+import re
+import sys
+import json
+import subprocess
+import threading
+from collections import deque
+
+FFMPEG = 'ffmpeg'
+FFPROBE = 'ffprobe'
+STDERR_TAIL_LINES = 40
+TERMINATE_TIMEOUT = 5
+
+# Prevents a console window from flashing up for every FFmpeg child when the
+# packaged (--noconsole) build runs on Windows.
+POPEN_FLAGS = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+
+DURATION_RE = re.compile(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)')
+
+
+class FFmpegError(Exception):
+    """FFmpeg exited with a non-zero status."""
+
+    def __init__(self, returncode, stderr_tail):
+        super().__init__(f"FFmpeg exited with status {returncode}")
+        self.returncode = returncode
+        self.stderr = stderr_tail
+
+
+def probe(input_path):
+    """
+    Returns ffprobe's JSON description of a file: {'streams': [...], 'format': {...}}.
+
+    :raises FFmpegError: If ffprobe cannot read the file.
+    :raises OSError: If ffprobe is not installed.
+    """
+    command = [FFPROBE, '-v', 'error', '-show_streams', '-show_format', '-of', 'json', input_path]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            creationflags=POPEN_FLAGS)
+    if result.returncode != 0:
+        raise FFmpegError(result.returncode, result.stderr.decode('utf-8', errors='replace'))
+    return json.loads(result.stdout)
+
+
+def parse_timestamp(value):
+    """Converts 'HH:MM:SS.micro' to seconds, or None if it cannot be parsed."""
+    match = re.match(r'(-?\d+):(\d+):(\d+(?:\.\d+)?)', value or '')
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def build_progress(fields, duration):
+    """
+    Turns one raw `-progress` block into a progress dict.
+
+    Keys: 'frame', 'fps', 'bitrate', 'out_time' (seconds), 'speed' (realtime
+    factor), 'percent' (0-100, or None if the duration is unknown) and 'eta'
+    (seconds remaining, or None).
+    """
+    out_time = None
+    if fields.get('out_time_us', 'N/A') != 'N/A':
+        out_time = int(fields['out_time_us']) / 1_000_000
+    elif 'out_time' in fields:
+        out_time = parse_timestamp(fields['out_time'])
+
+    speed = None
+    raw_speed = fields.get('speed', '').rstrip('x').strip()
+    try:
+        speed = float(raw_speed)
+    except ValueError:
+        pass
+
+    percent = None
+    eta = None
+    if duration and out_time is not None:
+        out_time = max(out_time, 0.0)
+        percent = min(100, int(100 * out_time / duration))
+        if speed:
+            eta = max(duration - out_time, 0.0) / speed
+    if fields.get('progress') == 'end':
+        percent = 100
+        eta = 0.0
+
+    return {
+        'frame': int(fields['frame']) if fields.get('frame', '').isdigit() else None,
+        'fps': fields.get('fps'),
+        'bitrate': fields.get('bitrate'),
+        'out_time': out_time,
+        'speed': speed,
+        'percent': percent,
+        'eta': eta,
+    }
+
+
+def scaled_progress(callback, offset, share):
+    """
+    Wraps a progress callback for one step of a multi-step job, mapping the
+    step's 0-100% onto `offset` .. `offset + share` of the overall progress.
+    """
+    if callback is None:
+        return None
+
+    def report(progress):
+        progress = dict(progress)
+        if progress['percent'] is not None:
+            progress['percent'] = offset + progress['percent'] * share // 100
+        callback(progress)
+    return report
+
+
+def run_ffmpeg(args, duration=None, progress_callback=None, cancel_event=None):
+    """
+    Runs `ffmpeg <args>` and reports progress while it encodes.
+
+    :param args: FFmpeg arguments, without the executable name.
+    :param duration: Input duration in seconds used for percent/ETA. If None,
+        it is read from the "Duration:" line FFmpeg prints for the first input.
+    :param progress_callback: Called with a progress dict (see build_progress).
+    :param cancel_event: A threading.Event; when set, FFmpeg is terminated.
+    :return: True if FFmpeg finished, False if it was cancelled.
+    :raises FFmpegError: If FFmpeg fails.
+    """
+    command = [FFMPEG, '-hide_banner', '-nostats', '-progress', 'pipe:1'] + list(args)
+    process = subprocess.Popen(
+        command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        text=True, encoding='utf-8', errors='replace', creationflags=POPEN_FLAGS
+    )
+
+    state = {'duration': duration, 'cancelled': False}
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    stderr_thread = threading.Thread(target=_drain_stderr, args=(process.stderr, tail, state), daemon=True)
+    stderr_thread.start()
+
+    if cancel_event is not None:
+        threading.Thread(target=_watch_cancel, args=(process, cancel_event, state), daemon=True).start()
+
+    fields = {}
+    for line in process.stdout:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            continue
+        fields[key] = value.strip()
+        if key == 'progress':
+            if progress_callback:
+                progress_callback(build_progress(fields, state['duration']))
+            fields = {}
+
+    returncode = process.wait()
+    stderr_thread.join()
+
+    if state['cancelled']:
+        return False
+    if returncode != 0:
+        raise FFmpegError(returncode, '\n'.join(tail))
+    return True
+
+
+def _drain_stderr(stream, tail, state):
+    for line in stream:
+        line = line.rstrip()
+        tail.append(line)
+        if state['duration'] is None:
+            match = DURATION_RE.search(line)
+            if match:
+                hours, minutes, seconds = match.groups()
+                state['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _watch_cancel(process, cancel_event, state):
+    while process.poll() is None:
+        if cancel_event.wait(0.2):
+            state['cancelled'] = True
+            terminate(process)
+            return
+
+
+def terminate(process):
+    """Asks FFmpeg to stop, and kills it if it does not exit in time."""
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=TERMINATE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
@@ -0,0 +1,260 @@
+"""
+Declarative image operations for convert_image.
+
+Operations are given as a spec string, e.g.
+
+    auto_orient;crop=100,50,1600,900;sharpen=2,150,3;watermark=logo.png,bottom-right,0.4
+
+and always run in a fixed order, whatever order they were written in:
+
+    auto_orient  apply the EXIF orientation
+    crop         x,y,width,height in (oriented) source pixels
+    (resize)     the width/height settings of convert_image
+    rotate       degrees counter-clockwise; the canvas grows to fit
+    pad          width,height[,color]: centre the image on a canvas of that size
+    sharpen      [radius[,percent[,threshold]]]: unsharp mask
+    colorspace   L, RGB, RGBA, CMYK, or sRGB to convert an embedded ICC profile
+    watermark    path[,position[,opacity[,scale]]]: overlay an image
+
+parse_ops() turns a spec into a tuple of Op namedtuples in that order, and
+format_ops() back into a canonical string, so equal pipelines produce the
+same settings (and cache keys) however they were typed.
+
+Crop and resize are done together by one resize(box=...) call, and JPEG
+sources are decoded at reduced scale first (see converter.load_scaled).
+Orientation is applied after the resize, on the smaller image. Sharpening,
+colour conversion and compositing use Pillow's C implementations, and the
+watermark is pasted in place.
+"""
+import os
+from collections import namedtuple
+
+from PIL import Image, ImageColor, ImageFilter
+
+from cache import file_digest
+
+Op = namedtuple('Op', ['name', 'args'])
+
+OP_ORDER = ['auto_orient', 'crop', 'rotate', 'pad', 'sharpen', 'colorspace', 'watermark']
+COLORSPACES = ['L', 'RGB', 'RGBA', 'CMYK', 'sRGB']
+WATERMARK_POSITIONS = ['top-left', 'top-right', 'bottom-left', 'bottom-right', 'center']
+WATERMARK_MARGIN = 0.02  # fraction of the image width
+
+# EXIF orientation value -> transpose that displays the image upright.
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+EXIF_ORIENTATION = 0x0112
+
+
+def _parse_args(name, values):
+    if name == 'auto_orient':
+        if values:
+            raise ValueError("auto_orient takes no arguments")
+        return ()
+    if name == 'crop':
+        if len(values) != 4:
+            raise ValueError("crop needs x,y,width,height")
+        x, y, w, h = (int(v) for v in values)
+        if w <= 0 or h <= 0 or x < 0 or y < 0:
+            raise ValueError("crop needs a non-empty box inside the image")
+        return (x, y, w, h)
+    if name == 'rotate':
+        if len(values) != 1:
+            raise ValueError("rotate needs an angle in degrees")
+        return (float(values[0]) % 360,)
+    if name == 'pad':
+        if len(values) not in (2, 3):
+            raise ValueError("pad needs width,height[,color]")
+        color = values[2] if len(values) == 3 else 'black'
+        ImageColor.getrgb(color)  # Validate now rather than mid-batch.
+        return (int(values[0]), int(values[1]), color)
+    if name == 'sharpen':
+        defaults = [2.0, 150, 3]
+        if len(values) > 3:
+            raise ValueError("sharpen takes radius,percent,threshold")
+        values = list(values) + [str(v) for v in defaults[len(values):]]
+        return (float(values[0]), int(values[1]), int(values[2]))
+    if name == 'colorspace':
+        if len(values) != 1 or values[0] not in COLORSPACES:
+            raise ValueError(f"colorspace must be one of {', '.join(COLORSPACES)}")
+        return (values[0],)
+    if name == 'watermark':
+        if not 1 <= len(values) <= 4:
+            raise ValueError("watermark needs path[,position[,opacity[,scale]]]")
+        path = values[0]
+        position = values[1] if len(values) > 1 else 'bottom-right'
+        if position not in WATERMARK_POSITIONS:
+            raise ValueError(f"watermark position must be one of {', '.join(WATERMARK_POSITIONS)}")
+        opacity = float(values[2]) if len(values) > 2 else 0.5
+        scale = float(values[3]) if len(values) > 3 else 0.2
+        return (os.path.abspath(path), position, opacity, scale)
+    raise ValueError(f"Unknown image operation: {name}")
+
+
+def parse_ops(spec):
+    """
+    Parses an operations spec (a 'name=args;...' string, or an iterable of
+    'name=args' strings) into a tuple of Op in OP_ORDER.
+
+    :raises ValueError: For unknown or repeated operations and bad arguments.
+    """
+    if not spec:
+        return ()
+    items = spec.split(';') if isinstance(spec, str) else list(spec)
+    ops = {}
+    for item in items:
+        item = item.strip()
+        if not item:
+            continue
+        name, _, raw = item.partition('=')
+        name = name.strip().lower()
+        if name in ops:
+            raise ValueError(f"Image operation given twice: {name}")
+        values = [v.strip() for v in raw.split(',')] if raw.strip() else []
+        ops[name] = Op(name, _parse_args(name, values))
+    return tuple(ops[name] for name in OP_ORDER if name in ops)
+
+
+def _format_value(value):
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def format_ops(ops):
+    """The canonical spec string for parsed ops (the inverse of parse_ops)."""
+    return ';'.join(op.name + (('=' + ','.join(_format_value(v) for v in op.args)) if op.args else '')
+                    for op in ops)
+
+
+def find_op(ops, name):
+    return next((op for op in ops if op.name == name), None)
+
+
+def asset_digests(ops):
+    """Content hashes of files the ops read (watermarks), for cache keys."""
+    return [file_digest(op.args[0]) for op in ops if op.name == 'watermark']
+
+
+def orientation(img, ops):
+    """The EXIF orientation to correct (1 = none) if auto_orient was asked for."""
+    if not find_op(ops, 'auto_orient'):
+        return 1
+    return img.getexif().get(EXIF_ORIENTATION, 1)
+
+
+def oriented_size(size, orientation_value):
+    return (size[1], size[0]) if orientation_value in (5, 6, 7, 8) else size
+
+
+def crop_box(ops, size):
+    """The crop op as a (left, top, right, bottom) box clipped to `size`, or None."""
+    op = find_op(ops, 'crop')
+    if op is None:
+        return None
+    x, y, w, h = op.args
+    box = (min(x, size[0]), min(y, size[1]), min(x + w, size[0]), min(y + h, size[1]))
+    if box[2] <= box[0] or box[3] <= box[1]:
+        raise ValueError(f"Crop box {op.args} lies outside the {size[0]}x{size[1]} image")
+    return box
+
+
+def transpose(img, orientation_value):
+    method = ORIENTATION_TRANSPOSE.get(orientation_value)
+    return img.transpose(method) if method is not None else img
+
+
+def apply_ops(img, ops, animated=False):
+    """
+    Runs the operations that follow the resize (rotate, pad, sharpen,
+    colorspace, watermark) on an already cropped and resized image.
+    Colour-space changes are skipped for animation frames, which stay RGBA.
+    """
+    for op in ops:
+        if op.name == 'rotate':
+            img = _rotate(img, op.args[0])
+        elif op.name == 'pad':
+            img = _pad(img, *op.args)
+        elif op.name == 'sharpen':
+            img = _sharpen(img, *op.args)
+        elif op.name == 'colorspace' and not animated:
+            img = _convert_colorspace(img, op.args[0])
+        elif op.name == 'watermark':
+            img = _watermark(img, *op.args)
+    return img
+
+
+def _rotate(img, degrees):
+    exact = {90.0: Image.Transpose.ROTATE_90, 180.0: Image.Transpose.ROTATE_180, 270.0: Image.Transpose.ROTATE_270}
+    if degrees == 0:
+        return img
+    if degrees in exact:
+        return img.transpose(exact[degrees])
+    if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        img = img.convert('RGBA')
+    return img.rotate(degrees, resample=Image.Resampling.BICUBIC, expand=True)
+
+
+def _sharpen(img, radius, percent, threshold):
+    # UnsharpMask only takes 8-bit bands: palette, 1-bit and 16-bit images are converted first.
+    if img.mode.startswith('I;16') or img.mode == 'I':
+        img = img.convert('I').point(lambda value: value / 256).convert('L')
+    elif img.mode == '1':
+        img = img.convert('L')
+    elif img.mode not in ('RGB', 'RGBA', 'L', 'LA', 'CMYK'):
+        img = img.convert('RGBA' if 'A' in img.mode or 'transparency' in img.info else 'RGB')
+    return img.filter(ImageFilter.UnsharpMask(radius, percent, threshold))
+
+
+def _pad(img, width, height, color):
+    if img.width > width or img.height > height:
+        raise ValueError(f"Cannot pad a {img.width}x{img.height} image to {width}x{height}")
+    if img.mode == 'P':
+        img = img.convert('RGBA')
+    canvas = Image.new(img.mode, (width, height), ImageColor.getcolor(color, img.mode))
+    canvas.paste(img, ((width - img.width) // 2, (height - img.height) // 2))
+    return canvas
+
+
+def _convert_colorspace(img, target):
+    if target != 'sRGB':
+        return img.convert(target)
+    icc = img.info.get('icc_profile')
+    if not icc:
+        return img if img.mode in ('RGB', 'RGBA') else img.convert('RGB')
+    import io
+    from PIL import ImageCms
+    source = ImageCms.ImageCmsProfile(io.BytesIO(icc))
+    mode = 'RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB'
+    converted = ImageCms.profileToProfile(img, source, ImageCms.createProfile('sRGB'), outputMode=mode)
+    converted.info.pop('icc_profile', None)
+    return converted
+
+
+def _watermark(img, path, position, opacity, scale):
+    """Pastes the watermark onto `img`, in place unless its mode needs converting first."""
+    with Image.open(path) as mark:
+        mark = mark.convert('RGBA')
+    width = max(1, round(img.width * scale))
+    mark = mark.resize((width, max(1, round(mark.height * width / mark.width))), Image.Resampling.LANCZOS)
+    if opacity < 1:
+        alpha = mark.getchannel('A').point(lambda a: round(a * opacity))
+        mark.putalpha(alpha)
+
+    margin = round(img.width * WATERMARK_MARGIN)
+    x = {'left': margin, 'right': img.width - mark.width - margin}.get(position.split('-')[-1],
+                                                                       (img.width - mark.width) // 2)
+    y = {'top': margin, 'bottom': img.height - mark.height - margin}.get(position.split('-')[0],
+                                                                         (img.height - mark.height) // 2)
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.mode or 'transparency' in img.info else 'RGB')
+    if img.mode == 'RGBA':
+        img.alpha_composite(mark, (x, y))
+    else:
+        img.paste(mark, (x, y), mask=mark)
+    return img
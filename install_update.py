@@ -5,46 +5,197 @@ import time
 import zipfile
 import subprocess
 import shutil
+import json
+import hashlib
+
+# Written by delta_update.fetch_delta in the staging folder of a delta update.
+DELTA_NAME = 'delta.json'
+STAGED_FILES = 'files'
+# Inside the install folder, so that replacing and restoring files are renames.
+DELTA_BACKUP_DIR = '.update-backup'
+DELTA_STAGING_DIR = '.update-staging'
+# Per-file hashes shipped in each release (see delta_update.build_manifest).
+MANIFEST_NAME = 'manifest.json'
+# Only used where the process exit cannot be waited on directly.
+POLL_SECONDS = 0.5
+
+def wait_for_exit(pid):
+    """
+    Blocks until process `pid` has exited: on a process handle on Windows,
+    on a pidfd on Linux, and by polling elsewhere.
+    """
+    if sys.platform == 'win32':
+        import ctypes
+        SYNCHRONIZE, INFINITE = 0x00100000, 0xFFFFFFFF
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(SYNCHRONIZE, False, pid)
+        if handle:
+            kernel32.WaitForSingleObject(handle, INFINITE)
+            kernel32.CloseHandle(handle)
+        # No handle: the process is already gone. (os.kill would terminate it on Windows.)
+        return
+
+    if hasattr(os, 'pidfd_open'):
+        import select
+        try:
+            fd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            return
+        except OSError:
+            pass  # e.g. a kernel older than 5.3; poll instead.
+        else:
+            try:
+                # The pidfd becomes readable when the process exits.
+                select.select([fd], [], [])
+            finally:
+                os.close(fd)
+            return
+
+    while True:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return
+        except OSError:
+            pass  # Exists, but belongs to someone else.
+        time.sleep(POLL_SECONDS)
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _safe_parts(name):
+    """The path components of a zip member name, refusing absolute paths and '..'."""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if name.startswith(('/', '\\')) or '..' in parts or (parts and ':' in parts[0]):
+        raise ValueError(f"Unsafe path in update: {name}")
+    return parts
+
+def verify(directory, manifest):
+    """Raises ValueError unless every file listed in `manifest` is in `directory` with its hash."""
+    for relative, entry in manifest['files'].items():
+        path = os.path.join(directory, *relative.split('/'))
+        if not os.path.isfile(path) or os.path.getsize(path) != entry['size'] or _sha256(path) != entry['sha256']:
+            raise ValueError(f"Update file missing or corrupt: {relative}")
+
+def extract_update(zip_path, staging_dir):
+    """
+    Extracts the release zip into `staging_dir` one member at a time, then
+    checks the result against the manifest inside the zip, if it has one
+    (releases before delta updates do not).
+    """
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+    with zipfile.ZipFile(zip_path, 'r') as archive:
+        for info in archive.infolist():
+            parts = _safe_parts(info.filename)
+            if not parts or info.is_dir():
+                continue
+            target = os.path.join(staging_dir, *parts)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with archive.open(info) as source, open(target, 'wb') as f:
+                shutil.copyfileobj(source, f, 1024 * 1024)
+            if info.external_attr >> 16:
+                os.chmod(target, info.external_attr >> 16 & 0o777)  # Zips made on Unix keep the mode.
+    manifest_path = os.path.join(staging_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            verify(staging_dir, json.load(f))
+
+def apply_delta(staging_dir, install_dir):
+    """
+    Applies a staged delta update in place. The new files are first moved
+    into DELTA_STAGING_DIR inside the install folder, on the same file
+    system (a copy only if the download folder is elsewhere), and checked
+    against the new manifest; nothing has been replaced yet at that point.
+    Then each replaced or removed file is renamed into DELTA_BACKUP_DIR and
+    the new one renamed into place. If any step fails, the steps done so
+    far are undone in reverse order and the error is raised again.
+    """
+    with open(os.path.join(staging_dir, DELTA_NAME), 'r', encoding='utf-8') as f:
+        delta = json.load(f)
+    backup_dir = os.path.join(install_dir, DELTA_BACKUP_DIR)
+    local_dir = os.path.join(install_dir, DELTA_STAGING_DIR)
+    shutil.rmtree(backup_dir, ignore_errors=True)
+    shutil.rmtree(local_dir, ignore_errors=True)
+    shutil.move(os.path.join(staging_dir, STAGED_FILES), local_dir)
+    try:
+        with open(os.path.join(local_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        verify(local_dir, {'files': {path: entry for path, entry in manifest['files'].items()
+                                     if path in delta['changed']}})
+    except Exception:
+        shutil.rmtree(local_dir, ignore_errors=True)
+        raise
+
+    done = []  # (path in the install, path of its backup or None, whether a new file goes there)
+    try:
+        for relative in delta['changed']:
+            target = os.path.join(install_dir, *relative.split('/'))
+            done.append((target, _back_up(target, os.path.join(backup_dir, *relative.split('/'))), True))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(os.path.join(local_dir, *relative.split('/')), target)
+        for relative in delta['removed']:
+            target = os.path.join(install_dir, *relative.split('/'))
+            done.append((target, _back_up(target, os.path.join(backup_dir, *relative.split('/'))), False))
+    except Exception:
+        for target, backup, replaced in reversed(done):
+            if replaced and os.path.exists(target):
+                os.remove(target)  # The new file, if it got there.
+            if backup:
+                os.replace(backup, target)
+        shutil.rmtree(backup_dir, ignore_errors=True)
+        raise
+    finally:
+        shutil.rmtree(local_dir, ignore_errors=True)
+    shutil.rmtree(backup_dir, ignore_errors=True)
+
+def _back_up(path, backup):
+    if not os.path.exists(path):
+        return None
+    os.makedirs(os.path.dirname(backup), exist_ok=True)
+    os.replace(path, backup)
+    return backup
 
 def main():
     try:
         # The script is called with: python install_update.py <zip_path> <app_path> <app_pid>
-        zip_path = sys.argv[1]
-        app_path = sys.argv[2]
+        # <zip_path> may also be the staging folder of a delta update (see delta_update.py).
+        zip_path = os.path.abspath(sys.argv[1])
+        app_path = os.path.abspath(sys.argv[2])
         app_pid = int(sys.argv[3])
 
-        # 1. Wait for the main application to exit by checking if the PID is still active
-        while True:
-            try:
-                os.kill(app_pid, 0)
-                time.sleep(0.5)
-            except OSError:
-                # PID does not exist, so the process has terminated
-                break
+        # 1. Wait for the main application to exit
+        wait_for_exit(app_pid)
 
         # The parent application's directory
-        install_dir = os.path.dirname(app_path)
+        install_dir = os.path.dirname(os.path.abspath(app_path))
+        # Windows will not rename a folder that is a process's working directory,
+        # ours included; the relaunched application inherits this one as well.
+        os.chdir(os.path.dirname(install_dir))
 
-        # 2. Unzip the update to a temporary directory
-        temp_update_dir = os.path.join(os.path.dirname(zip_path), 'temp_update')
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_update_dir)
+        if os.path.isdir(zip_path):
+            # Delta update: only the changed files are replaced, in place.
+            apply_delta(zip_path, install_dir)
+            subprocess.Popen([app_path])
+            shutil.rmtree(zip_path, ignore_errors=True)
+            return
 
-        # 3. Replace the old files with the new ones
-        # A simple but effective method: move the old dir, move the new dir in its place.
-        old_app_backup_dir = os.path.join(install_dir, '..', 'UniversalConverter_old')
-        if os.path.exists(old_app_backup_dir):
-             shutil.rmtree(old_app_backup_dir)
+        # 2. Unzip the update next to the installation, so that it is on the same
+        # file system and the swap below is two renames instead of a copy.
+        parent_dir, app_dir_name = os.path.split(install_dir)
+        new_app_dir = os.path.join(parent_dir, f'.{app_dir_name}_new')
+        extract_update(zip_path, new_app_dir)
 
-        # Move current installation to a backup location
-        shutil.move(install_dir, old_app_backup_dir)
-
-        # Move the new version into the original location
-        # The unzipped content is assumed to be in a directory inside temp_update_dir
-        # This needs to be robust. Let's assume the unzipped folder is 'UniversalConverter'.
-        # This part might need adjustment depending on how the zip is structured.
-        # Let's assume for now that the contents are directly inside `temp_update_dir`
-        shutil.move(temp_update_dir, install_dir)
+        # 3. Replace the old files with the new ones: move the old dir, move the new dir in its place.
+        old_app_backup_dir = os.path.join(parent_dir, f'{app_dir_name}_old')
+        if os.path.exists(old_app_backup_dir):
+            shutil.rmtree(old_app_backup_dir)
+        os.rename(install_dir, old_app_backup_dir)
+        os.rename(new_app_dir, install_dir)
 
         # 4. Relaunch the application
         subprocess.Popen([app_path])
@@ -57,7 +208,9 @@ def main():
         # If anything goes wrong, try to restore the backup
         if 'install_dir' in locals() and 'old_app_backup_dir' in locals():
             if not os.path.exists(install_dir) and os.path.exists(old_app_backup_dir):
-                shutil.move(old_app_backup_dir, install_dir)
+                os.rename(old_app_backup_dir, install_dir)
+        if 'new_app_dir' in locals():
+            shutil.rmtree(new_app_dir, ignore_errors=True)
         # We can't do much more here, but at least we tried to recover.
         pass
 
@@ -0,0 +1,447 @@
+"""
+A persistent, prioritised conversion queue shared by the whole GUI.
+
+Jobs (batch.Job) are submitted in batches, one per click of "Converter",
+and run in the background:
+
+  * highest priority first, then in submission order;
+  * at most `limits[media_type]` at a time for each media type, so a long
+    video encode does not hold up a folder of quick image conversions;
+  * only while the estimated threads and memory of the running jobs fit a
+    scheduler.ResourceBudget; a job that does not fit lets lower-priority
+    jobs that do fit start ahead of it;
+  * images in a process pool (Pillow holds the GIL), audio and video on
+    threads that drive FFmpeg, as in batch.run_batch.
+
+A batch can be cancelled, paused and resumed. Pausing stops queued jobs
+from starting; a running FFmpeg job is stopped and goes back to the queue,
+to start again from the beginning on resume. Image jobs that are already
+running are short and always allowed to finish.
+
+Changes of state are written to a JSON file (queue.json in the config
+directory), so jobs that had not finished when the app was closed or
+crashed are loaded and run again on the next start. The writes are
+coalesced: a change schedules one write SAVE_INTERVAL later, which
+carries every change made in between, and shutdown() writes at once. A
+crash can therefore lose the last SAVE_INTERVAL of changes; those jobs
+just run again.
+
+The queue knows nothing about Qt: it reports every change by calling
+`listener(entry)` from whichever thread made it.
+"""
+import os
+import json
+import uuid
+import itertools
+import tempfile
+import threading
+
+from app_paths import config_dir
+from batch import Job, STREAMING_MEDIA_TYPES, default_workers, run_job
+from conversion_result import ConversionResult
+from scheduler import ResourceBudget, estimate_cost, assign_threads
+
+QUEUE_FILE = 'queue.json'
+QUEUE_VERSION = 1
+# Seconds between writes of the queue file, however many entries change meanwhile.
+SAVE_INTERVAL = 1.0
+
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = {DONE, FAILED, CANCELLED}
+
+LOW, NORMAL, HIGH = -1, 0, 1
+
+
+def default_queue_path():
+    return os.path.join(config_dir(), QUEUE_FILE)
+
+
+def default_limits():
+    """
+    Concurrent jobs per media type. Images are single-threaded, so one per
+    core; FFmpeg's audio encoders use about one core each; video encoders
+    already spread over every core by themselves.
+    """
+    cpus = default_workers()
+    return {'image': cpus, 'audio': max(1, cpus // 2), 'video': 1}
+
+
+class QueueEntry:
+    """One job in the queue, with its priority, state and (once finished) result."""
+
+    def __init__(self, job, priority=NORMAL, batch=None, use_cache=False, entry_id=None, state=QUEUED):
+        self.id = entry_id or uuid.uuid4().hex
+        self.job = job
+        self.priority = priority
+        self.batch = batch
+        self.use_cache = use_cache
+        self.state = state
+        self.progress = 0
+        self.eta = None
+        self.result = None
+        self.seq = 0
+        self.cancel_event = threading.Event()
+        self.requeue_as = None  # State to return to when a stopped job comes back.
+        self.cost = None  # scheduler.Cost, estimated before the first launch.
+        self.claimed = None  # The cost claimed from the budget while running.
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job': self.job._asdict(),
+            'priority': self.priority,
+            'batch': self.batch,
+            'use_cache': self.use_cache,
+            # A job that was running when the queue was saved starts over.
+            'state': QUEUED if self.state == RUNNING else self.state,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(Job(**data['job']), data.get('priority', NORMAL), data.get('batch'),
+                   data.get('use_cache', False), data['id'], data.get('state', QUEUED))
+
+
+class JobQueue:
+    """
+    Runs batch.Job entries in the background. See the module docstring.
+
+    :param path: Queue file; None for the default, False to keep the queue in memory only.
+    :param limits: Concurrent jobs per media type (default: default_limits()).
+    :param cache: ConversionCache used by jobs submitted with use_cache=True.
+    :param listener: Called as listener(entry) after any entry changes state or progress.
+    :param budget: scheduler.ResourceBudget shared by all running jobs (default: every core
+        and half of physical memory).
+    """
+
+    def __init__(self, path=None, limits=None, cache=None, listener=None, budget=None):
+        self.path = default_queue_path() if path is None else path
+        self.limits = {**default_limits(), **(limits or {})}
+        self.budget = budget or ResourceBudget()
+        self.cache = cache
+        self.listener = listener
+        self.entries = []
+        self.paused = False
+        self.stopping = False
+        self.condition = threading.Condition(threading.RLock())
+        self._seq = itertools.count()
+        self._pool = None
+        self._threads = set()
+        self._dispatcher = None
+        self._dirty = False
+        self._save_timer = None
+        self._save_lock = threading.Lock()
+        self._load()
+
+    # --- Public API ---
+
+    def start(self):
+        """Starts running queued jobs, including any restored from the queue file."""
+        with self.condition:
+            if self._dispatcher is None:
+                self.stopping = False
+                self._dispatcher = threading.Thread(target=self._dispatch, name='job-queue', daemon=True)
+                self._dispatcher.start()
+
+    def shutdown(self):
+        """
+        Stops dispatching. Running FFmpeg jobs are stopped and saved as queued,
+        to run again on the next start; running image jobs are waited for.
+        """
+        with self.condition:
+            self.stopping = True
+            for entry in self.entries:
+                if entry.state == RUNNING and entry.job.media_type in STREAMING_MEDIA_TYPES:
+                    entry.requeue_as = QUEUED
+                    entry.cancel_event.set()
+            self.condition.notify_all()
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+            self._dispatcher = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        self._save()
+
+    def submit(self, jobs, priority=NORMAL, use_cache=False, batch=None, paused=False):
+        """
+        Queues `jobs` as one batch and returns the batch id.
+
+        :param batch: Adds the jobs to this existing batch instead, e.g. as a
+            folder walk finds more files.
+        :param paused: Adds the jobs held, as in a paused batch.
+        """
+        batch = batch or uuid.uuid4().hex
+        with self.condition:
+            added = [QueueEntry(job, priority, batch, use_cache, state=PAUSED if paused else QUEUED)
+                     for job in jobs]
+            for entry in added:
+                entry.seq = next(self._seq)
+            self.entries.extend(added)
+            self._mark_dirty()
+            self.condition.notify_all()
+        for entry in added:
+            self._notify(entry)
+        return batch
+
+    def batch_entries(self, batch):
+        with self.condition:
+            return [entry for entry in self.entries if entry.batch == batch]
+
+    def batches(self):
+        """Ids of batches with unfinished entries, oldest first."""
+        with self.condition:
+            return list(dict.fromkeys(entry.batch for entry in self.entries if not entry.finished))
+
+    def batch_progress(self, batch):
+        """Overall percentage (0-100) of a batch, counting finished entries as 100."""
+        entries = self.batch_entries(batch)
+        if not entries:
+            return 100
+        return int(sum(100 if entry.finished else entry.progress for entry in entries) / len(entries))
+
+    def batch_finished(self, batch):
+        return all(entry.finished for entry in self.batch_entries(batch))
+
+    def batch_results(self, batch):
+        """ConversionResult of each finished entry of a batch."""
+        return [entry.result for entry in self.batch_entries(batch) if entry.result is not None]
+
+    def cancel_batch(self, batch):
+        """Cancels the batch: queued and paused jobs are dropped, running FFmpeg jobs are stopped."""
+        self._change_batch(batch, {QUEUED: CANCELLED, PAUSED: CANCELLED}, stop_as=CANCELLED)
+
+    def pause_batch(self, batch):
+        """Holds the batch's queued jobs; running FFmpeg jobs are stopped and held too."""
+        self._change_batch(batch, {QUEUED: PAUSED}, stop_as=PAUSED)
+
+    def resume_batch(self, batch):
+        self._change_batch(batch, {PAUSED: QUEUED})
+
+    def set_priority(self, batch, priority):
+        with self.condition:
+            for entry in self.entries:
+                if entry.batch == batch:
+                    entry.priority = priority
+            self._mark_dirty()
+            self.condition.notify_all()
+
+    def set_limit(self, media_type, limit):
+        with self.condition:
+            self.limits[media_type] = max(1, int(limit))
+            self.condition.notify_all()
+
+    def pause(self):
+        """Stops starting new jobs of any batch; running jobs finish."""
+        with self.condition:
+            self.paused = True
+
+    def resume(self):
+        with self.condition:
+            self.paused = False
+            self.condition.notify_all()
+
+    def counts(self):
+        """Number of entries in each state."""
+        with self.condition:
+            counts = {}
+            for entry in self.entries:
+                counts[entry.state] = counts.get(entry.state, 0) + 1
+            return counts
+
+    def forget_finished(self, batch=None):
+        """Drops finished entries (of one batch, or all) from memory."""
+        with self.condition:
+            self.entries = [entry for entry in self.entries
+                            if not entry.finished or (batch is not None and entry.batch != batch)]
+
+    # --- Scheduling ---
+
+    def _dispatch(self):
+        while True:
+            with self.condition:
+                if self.stopping:
+                    return
+                unestimated = [e for e in self.entries if e.state == QUEUED and e.cost is None]
+                if not unestimated:
+                    for entry in self._runnable():
+                        self._launch(entry)
+                    self.condition.wait()
+                    continue
+            # Estimates read file headers (and run ffprobe), so they are made
+            # outside the lock rather than stalling the GUI thread.
+            for entry in unestimated:
+                entry.cost = estimate_cost(entry.job, self.budget.threads)
+
+    def _runnable(self):
+        if self.paused:
+            return []
+        running = {}
+        for entry in self.entries:
+            if entry.state == RUNNING:
+                running[entry.job.media_type] = running.get(entry.job.media_type, 0) + 1
+        chosen = []
+        for entry in sorted((e for e in self.entries if e.state == QUEUED), key=lambda e: (-e.priority, e.seq)):
+            media_type = entry.job.media_type
+            if running.get(media_type, 0) < self.limits.get(media_type, 1) and self.budget.fits(entry.cost):
+                running[media_type] = running.get(media_type, 0) + 1
+                # Claimed right away so the next candidates see it.
+                entry.claimed = entry.cost
+                self.budget.claim(entry.cost)
+                chosen.append(entry)
+        return chosen
+
+    def _launch(self, entry):
+        entry.state = RUNNING
+        entry.progress = 0
+        entry.cancel_event.clear()
+        entry.requeue_as = None
+        self._mark_dirty()
+        cache = self.cache if entry.use_cache else None
+        job = assign_threads(entry.job, entry.cost)
+        if job.media_type in STREAMING_MEDIA_TYPES:
+            thread = threading.Thread(target=self._run_streaming, args=(entry, job, cache), daemon=True)
+            self._threads.add(thread)
+            thread.start()
+        else:
+            if self._pool is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(max_workers=max(default_workers(), self.limits.get('image', 1)))
+            future = self._pool.submit(run_job, job, cache)
+            future.add_done_callback(lambda done: self._finished_future(entry, done))
+        self._notify(entry)
+
+    def _run_streaming(self, entry, job, cache):
+        def report(progress):
+            if progress.get('percent') is not None:
+                entry.progress = int(progress['percent'])
+                entry.eta = progress.get('eta')
+                self._notify(entry)
+
+        try:
+            try:
+                result = run_job(job, cache, report, entry.cancel_event)
+            except Exception as e:
+                print(f"Error converting {entry.job.input_path}: {e}")
+                result = ConversionResult.failure(entry.job.input_path, e)
+            self._complete(entry, result)
+        finally:
+            with self.condition:
+                self._threads.discard(threading.current_thread())
+
+    def _finished_future(self, entry, future):
+        if future.cancelled():
+            result = ConversionResult.failure(entry.job.input_path, "not started")
+            result.cancelled = True
+        else:
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error converting {entry.job.input_path}: {e}")
+                result = ConversionResult.failure(entry.job.input_path, e)
+        self._complete(entry, result)
+
+    def _complete(self, entry, result):
+        with self.condition:
+            if entry.claimed is not None:
+                self.budget.release(entry.claimed)
+                entry.claimed = None
+            if result.cancelled and entry.requeue_as in (QUEUED, PAUSED):
+                entry.state = entry.requeue_as
+                entry.progress = 0
+            else:
+                entry.result = result
+                entry.state = DONE if result else CANCELLED if result.cancelled else FAILED
+                entry.progress = 100
+            idle = not any(e.state in (RUNNING, QUEUED) for e in self.entries)
+            self._mark_dirty()
+            self.condition.notify_all()
+        if idle and self.cache is not None:
+            self.cache.evict()
+        self._notify(entry)
+
+    def _change_batch(self, batch, transitions, stop_as=None):
+        changed = []
+        with self.condition:
+            for entry in self.entries:
+                if entry.batch != batch:
+                    continue
+                if entry.state in transitions:
+                    entry.state = transitions[entry.state]
+                    changed.append(entry)
+                elif (stop_as and entry.state == RUNNING
+                      and entry.job.media_type in STREAMING_MEDIA_TYPES):
+                    entry.requeue_as = stop_as if stop_as != CANCELLED else None
+                    entry.cancel_event.set()
+            self._mark_dirty()
+            self.condition.notify_all()
+        for entry in changed:
+            self._notify(entry)
+
+    # --- Persistence ---
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != QUEUE_VERSION:
+                return
+            for item in data.get('entries', []):
+                entry = QueueEntry.from_dict(item)
+                entry.seq = next(self._seq)
+                self.entries.append(entry)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable queue file {self.path}: {e}")
+
+    def _mark_dirty(self):
+        """Schedules a write of the queue file; called with the condition held."""
+        if not self.path:
+            return
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(SAVE_INTERVAL, self._save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save(self):
+        """Writes the unfinished entries to the queue file, atomically, if anything changed."""
+        if not self.path:
+            return
+        # Never called with the condition held: the timer thread takes the two locks in this order.
+        with self._save_lock:
+            with self.condition:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                pending = [entry.to_dict() for entry in self.entries if not entry.finished]
+            directory = os.path.dirname(self.path) or '.'
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.queue-', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump({'version': QUEUE_VERSION, 'entries': pending}, f, indent=1)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Could not save the queue to {self.path}: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _notify(self, entry):
+        if self.listener:
+            self.listener(entry)
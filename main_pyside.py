@@ -1,39 +1,126 @@
 
 import sys
 import os
+import time
+import shutil
+import tempfile
 import subprocess
+import threading
 from functools import partial
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel,
     QPushButton, QStackedWidget, QFileDialog, QProgressBar, QSlider,
-    QComboBox, QGridLayout, QTabWidget, QMessageBox
+    QComboBox, QGridLayout, QTabWidget, QMessageBox, QSpinBox, QCheckBox, QInputDialog,
+    QLineEdit
 )
-from PySide6.QtCore import Qt, QThread, Signal, QObject
+from PySide6.QtCore import Qt, QThread, QTimer, Signal, QObject
 from PySide6.QtGui import QFont
 
-from converter import convert_image
-from audio_converter import convert_audio
-from video_converter import convert_video
-from updater import check_for_updates, download_update
+from cache import ConversionCache
+from batch import make_jobs, default_workers, media_type_for_format
+from job_queue import JobQueue, LOW, NORMAL, HIGH
+from discovery import ACCEPTED_SOURCES, DiscoveryIndex, discover
+from conversion_result import summarize
+from mirror import sync_folder
+from video_profiles import (
+    VIDEO_CODECS, SPEED_PRESETS, list_profiles, load_profile, save_profile, crf_value
+)
+from audio_profiles import LOSSLESS_TARGETS, SAMPLE_RATES, BIT_DEPTHS
+from updater import check_for_updates, download_update, download_delta
+
+# The automatic update check waits until the window has been shown.
+UPDATE_CHECK_DELAY_MS = 2000
+# Temporary folders holding the copy of the installer that ran the last update.
+INSTALLER_DIR_PREFIX = 'UniversalConverter-installer-'
+
+def remove_installer_copies():
+    """Deletes the installer copies left by earlier updates (one still running is skipped)."""
+    temp_dir = tempfile.gettempdir()
+    for name in os.listdir(temp_dir):
+        if name.startswith(INSTALLER_DIR_PREFIX):
+            shutil.rmtree(os.path.join(temp_dir, name), ignore_errors=True)
 
 # --- Worker for background tasks (file conversion) ---
-class Worker(QObject):
+def format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def format_throughput(summary):
+    """'2,4 arquivo(s)/s, 13,1 MB/s' from a conversion_result.summarize() report."""
+    files = f"{summary['files_per_s'] or 0:.1f}".replace('.', ',')
+    megabytes = f"{summary['mb_per_s'] or 0:.1f}".replace('.', ',')
+    return f"{files} arquivo(s)/s, {megabytes} MB/s"
+
+class QueueBridge(QObject):
+    """Carries JobQueue notifications, made on worker threads, to the GUI thread."""
+    changed = Signal(object)
+
+class SyncWorker(QObject):
     progress = Signal(int)
+    status = Signal(str)
     finished = Signal(str)
     error = Signal(str)
 
-    def __init__(self, target, *args, **kwargs):
+    def __init__(self, source_dir, output_dir, to_format, settings, delete=False, max_workers=None, cache=None):
         super().__init__()
-        self.target = target
-        self.args = args
-        self.kwargs = kwargs
+        self.source_dir = source_dir
+        self.output_dir = output_dir
+        self.to_format = to_format
+        self.settings = settings
+        self.delete = delete
+        self.max_workers = max_workers
+        self.cache = cache
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
 
     def run(self):
         try:
-            self.target(*self.args, **self.kwargs, progress_callback=self.progress.emit)
-            self.finished.emit("Conversão concluída com sucesso!")
+            summary = sync_folder(
+                self.source_dir, self.output_dir, self.to_format, self.settings, delete=self.delete,
+                max_workers=self.max_workers, progress_callback=self.progress.emit, cache=self.cache,
+                cancel_event=self.cancel_event
+            )
+            self.finished.emit(
+                f"Sincronização concluída: {summary['converted']} convertido(s), {summary['skipped']} inalterado(s), "
+                f"{summary['deleted']} removido(s), {summary['failed']} com erro."
+            )
         except Exception as e:
-            self.error.emit(f"Erro na conversão: {e}")
+            self.error.emit(f"Erro na sincronização: {e}")
+
+class DiscoveryWorker(QObject):
+    """Walks a folder and emits the files it finds in chunks, so conversion starts before the walk ends."""
+    found = Signal(list)
+    finished = Signal(int, int)  # Files found, and how many of them were recognised despite their extension.
+
+    CHUNK_SECONDS = 0.25
+    CHUNK_FILES = 500
+
+    def __init__(self, folder, media_type):
+        super().__init__()
+        self.folder = folder
+        self.media_type = media_type
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        index = DiscoveryIndex()
+        chunk = []
+        last_emit = time.monotonic()
+        for found in index.track(discover([self.folder], accept=ACCEPTED_SOURCES[self.media_type])):
+            if self.cancel_event.is_set():
+                break
+            chunk.append(found.path)
+            if len(chunk) >= self.CHUNK_FILES or time.monotonic() - last_emit >= self.CHUNK_SECONDS:
+                self.found.emit(chunk)
+                chunk = []
+                last_emit = time.monotonic()
+        if chunk and not self.cancel_event.is_set():
+            self.found.emit(chunk)
+        self.finished.emit(len(index), len(index.misnamed))
 
 # --- Workers for the update process ---
 class CheckUpdateWorker(QObject):
@@ -57,16 +144,27 @@ class DownloadWorker(QObject):
         self.url = url
 
     def run(self):
-        file_path = download_update(self.url, self.progress.emit)
+        file_path = None
+        if getattr(sys, 'frozen', False):
+            # Only the changed files, when the installed version allows it.
+            file_path = download_delta(self.url, self.progress.emit, os.path.dirname(sys.executable))
+        file_path = file_path or download_update(self.url, self.progress.emit)
         if file_path:
             self.finished.emit(self.version, file_path)
 
 class BaseConversionWidget(QWidget):
+    media_type = None
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.main_window = parent
         self.files = []
+        self.source_dir = ""
+        self.input_dir = ""
         self.output_dir = ""
+        self.batch = None
+        self.discovering = False
+        self.main_window.queue_bridge.changed.connect(self.on_queue_changed)
 
         layout = QVBoxLayout(self)
         layout.setAlignment(Qt.AlignCenter)
@@ -80,6 +178,33 @@ class BaseConversionWidget(QWidget):
         self.options_layout = QVBoxLayout()
         layout.addLayout(self.options_layout)
 
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, default_workers())
+        self.workers_spin.setValue(self.main_window.job_queue.limits.get(self.media_type, default_workers()))
+        layout.addWidget(QLabel("Conversões simultâneas deste tipo:"))
+        layout.addWidget(self.workers_spin)
+
+        self.priority_combo = QComboBox()
+        self.priority_combo.addItem("Baixa", LOW)
+        self.priority_combo.addItem("Normal", NORMAL)
+        self.priority_combo.addItem("Alta", HIGH)
+        self.priority_combo.setCurrentIndex(1)
+        layout.addWidget(QLabel("Prioridade na fila:"))
+        layout.addWidget(self.priority_combo)
+
+        self.if_exists_combo = QComboBox()
+        self.if_exists_combo.addItem("Criar uma cópia numerada (nome-1)", 'suffix')
+        self.if_exists_combo.addItem("Substituir o arquivo existente", 'overwrite')
+        self.if_exists_combo.addItem("Pular o arquivo", 'skip')
+        layout.addWidget(QLabel("Se o arquivo de destino já existir:"))
+        layout.addWidget(self.if_exists_combo)
+
+        self.cache_checkbox = QCheckBox("Reutilizar conversões anteriores (cache)")
+        layout.addWidget(self.cache_checkbox)
+
+        self.delete_checkbox = QCheckBox("Espelhamento: remover convertidos cujos originais foram apagados")
+        layout.addWidget(self.delete_checkbox)
+
         self.progress_bar = QProgressBar(self)
         self.progress_bar.setVisible(False)
         layout.addWidget(self.progress_bar)
@@ -92,6 +217,14 @@ class BaseConversionWidget(QWidget):
         self.select_files_button.clicked.connect(self.select_files)
         button_layout.addWidget(self.select_files_button)
 
+        self.select_input_button = QPushButton("Selecionar Pasta de Arquivos")
+        self.select_input_button.clicked.connect(self.select_input_folder)
+        button_layout.addWidget(self.select_input_button)
+
+        self.select_source_button = QPushButton("Espelhar Pasta de Origem")
+        self.select_source_button.clicked.connect(self.select_source_folder)
+        button_layout.addWidget(self.select_source_button)
+
         self.select_folder_button = QPushButton("Selecionar Pasta")
         self.select_folder_button.clicked.connect(self.select_folder)
         button_layout.addWidget(self.select_folder_button)
@@ -101,6 +234,16 @@ class BaseConversionWidget(QWidget):
         self.convert_button.clicked.connect(self.start_conversion)
         layout.addWidget(self.convert_button)
 
+        self.cancel_button = QPushButton("Cancelar")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_conversion)
+        layout.addWidget(self.cancel_button)
+
+        self.pause_button = QPushButton("Pausar")
+        self.pause_button.setEnabled(False)
+        self.pause_button.clicked.connect(self.toggle_pause)
+        layout.addWidget(self.pause_button)
+
         self.back_button = QPushButton("Voltar")
         self.back_button.clicked.connect(self.main_window.show_dashboard)
         layout.addWidget(self.back_button)
@@ -109,13 +252,37 @@ class BaseConversionWidget(QWidget):
         files, _ = QFileDialog.getOpenFileNames(self, "Selecionar Arquivos")
         if files:
             self.files = files
+            self.source_dir = ""
+            self.input_dir = ""
             self.status_label.setText(f"{len(self.files)} arquivo(s) selecionado(s).")
 
+    def select_source_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Selecionar Pasta de Origem")
+        if folder:
+            self.source_dir = folder
+            self.input_dir = ""
+            self.files = []
+            self.status_label.setText("Pasta de origem selecionada: apenas arquivos novos ou alterados serão convertidos.")
+
+    def select_input_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Selecionar Pasta de Arquivos")
+        if folder:
+            self.input_dir = folder
+            self.source_dir = ""
+            self.files = []
+            self.status_label.setText("Pasta selecionada: os arquivos, inclusive das subpastas, "
+                                      "serão reconhecidos pelo conteúdo.")
+
     def select_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "Selecionar Pasta de Destino")
         if folder:
             self.output_dir = folder
-            self.status_label.setText(f"Pasta de destino selecionada. {len(self.files)} arquivo(s) pronto(s) para converter.")
+            if self.source_dir:
+                self.status_label.setText("Pasta de destino selecionada. Pronto para sincronizar.")
+            elif self.input_dir:
+                self.status_label.setText("Pasta de destino selecionada. Pronto para converter a pasta.")
+            else:
+                self.status_label.setText(f"Pasta de destino selecionada. {len(self.files)} arquivo(s) pronto(s) para converter.")
 
     def update_progress(self, value):
         self.progress_bar.setValue(value)
@@ -124,117 +291,407 @@ class BaseConversionWidget(QWidget):
         self.status_label.setText(message)
         self.progress_bar.setVisible(False)
         self.convert_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
 
     def on_conversion_error(self, message):
         self.status_label.setText(message)
         self.progress_bar.setVisible(False)
         self.convert_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+
+    def cancel_conversion(self):
+        self.cancel_button.setEnabled(False)
+        self.pause_button.setEnabled(False)
+        self.status_label.setText("Cancelando...")
+        if self.discovering:
+            self.discovery_worker.cancel()
+        if self.batch:
+            self.main_window.job_queue.cancel_batch(self.batch)
+        elif not self.discovering:
+            # Set directly from the GUI thread: the worker's own thread is busy in run().
+            self.worker.cancel()
+
+    def toggle_pause(self):
+        job_queue = self.main_window.job_queue
+        if self.pause_button.text() == "Pausar":
+            job_queue.pause_batch(self.batch)
+            self.pause_button.setText("Retomar")
+            self.status_label.setText("Pausado.")
+        else:
+            job_queue.resume_batch(self.batch)
+            self.pause_button.setText("Pausar")
+            self.status_label.setText("Retomando...")
 
-    def start_conversion(self):
+    def on_queue_changed(self, entry):
+        if entry.batch != self.batch:
+            return
+        job_queue = self.main_window.job_queue
+        self.progress_bar.setValue(job_queue.batch_progress(self.batch))
+        if job_queue.batch_finished(self.batch) and not self.discovering:
+            self.on_batch_finished()
+        elif entry.eta is not None and entry.state == 'running':
+            name = os.path.basename(entry.job.input_path)
+            self.status_label.setText(f"{name}: {entry.progress}% - tempo restante {format_eta(entry.eta)}")
+        elif entry.result is not None:
+            entries = job_queue.batch_entries(self.batch)
+            summary = summarize(job_queue.batch_results(self.batch), time.perf_counter() - self.batch_started)
+            self.status_label.setText(f"{summary['converted']} de {len(entries)} arquivo(s) - "
+                                      f"{format_throughput(summary)}")
+
+    def on_files_found(self, paths):
+        if self.discovery_worker.cancel_event.is_set():
+            return
+        jobs = make_jobs(self.media_type, paths, self.output_dir, self.to_format, self.discovery_settings)
+        self.batch = self.main_window.job_queue.submit(
+            jobs, priority=self.priority_combo.currentData(), use_cache=self.cache_checkbox.isChecked(),
+            batch=self.batch, paused=self.pause_button.text() == "Retomar")
+        self.pause_button.setEnabled(True)
+
+    def on_discovery_finished(self, total, misnamed):
+        self.discovering = False
+        if self.batch is None:
+            cancelled = self.discovery_worker.cancel_event.is_set()
+            self.on_conversion_finished("Conversão cancelada." if cancelled else "Nenhum arquivo encontrado na pasta.")
+        elif self.main_window.job_queue.batch_finished(self.batch):
+            self.on_batch_finished()
+        elif misnamed:
+            self.status_label.setText(f"{total} arquivo(s) encontrado(s); {misnamed} reconhecido(s) pelo conteúdo, "
+                                      f"apesar da extensão.")
+
+    def on_batch_finished(self):
+        job_queue = self.main_window.job_queue
+        entries = job_queue.batch_entries(self.batch)
+        summary = summarize(job_queue.batch_results(self.batch), time.perf_counter() - self.batch_started)
+        converted = summary['converted']
+        if any(entry.state == 'cancelled' for entry in entries):
+            message = f"Conversão cancelada: {converted} de {len(entries)} arquivo(s) convertido(s)."
+        elif converted < len(entries):
+            message = (f"Conversão concluída: {converted} de {len(entries)} arquivo(s) convertido(s) "
+                       f"({format_throughput(summary)}).")
+        else:
+            message = f"Conversão concluída com sucesso! {format_throughput(summary)}"
+        job_queue.forget_finished(self.batch)
+        self.batch = None
+        self.pause_button.setEnabled(False)
+        self.pause_button.setText("Pausar")
+        self.on_conversion_finished(message)
+
+    def conversion_settings(self):
         raise NotImplementedError
 
-class ImageConversionWidget(BaseConversionWidget):
-    def __init__(self, from_format, to_format, parent=None):
-        super().__init__(parent)
-        self.from_format = from_format
-        self.to_format = to_format
-        self.title_label.setText(f"Converter {from_format} para {to_format}")
-
-        self.quality_slider = QSlider(Qt.Horizontal)
-        self.quality_slider.setRange(1, 100)
-        self.quality_slider.setValue(90)
-        self.options_layout.addWidget(QLabel("Qualidade:"))
-        self.options_layout.addWidget(self.quality_slider)
+    def job_settings(self):
+        """conversion_settings() plus what to do with outputs that already exist."""
+        return {**self.conversion_settings(), 'if_exists': self.if_exists_combo.currentData()}
 
     def start_conversion(self):
-        if not self.files or not self.output_dir:
+        if not (self.files or self.source_dir or self.input_dir) or not self.output_dir:
             self.status_label.setText("Por favor, selecione os arquivos e a pasta de destino.")
             return
 
         self.convert_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
         self.progress_bar.setVisible(True)
         self.progress_bar.setValue(0)
 
-        quality = self.quality_slider.value()
+        if self.input_dir:
+            # The folder is walked in the background and its files join one queue batch as they are found.
+            self.main_window.job_queue.set_limit(self.media_type, self.workers_spin.value())
+            self.discovery_settings = self.job_settings()
+            self.batch = None
+            self.batch_started = time.perf_counter()
+            self.discovering = True
+            self.status_label.setText("Procurando arquivos...")
+            self.discovery_worker = DiscoveryWorker(self.input_dir, self.media_type)
+            self.discovery_thread = QThread()
+            self.discovery_worker.moveToThread(self.discovery_thread)
+            self.discovery_worker.found.connect(self.on_files_found)
+            self.discovery_worker.finished.connect(self.on_discovery_finished)
+            self.discovery_worker.finished.connect(self.discovery_thread.quit)
+            self.discovery_thread.started.connect(self.discovery_worker.run)
+            self.discovery_thread.start()
+            return
+
+        if not self.source_dir:
+            # Plain conversions go through the shared queue, which persists them across restarts.
+            job_queue = self.main_window.job_queue
+            job_queue.set_limit(self.media_type, self.workers_spin.value())
+            jobs = make_jobs(self.media_type, self.files, self.output_dir, self.to_format, self.job_settings())
+            self.batch_started = time.perf_counter()
+            self.batch = job_queue.submit(jobs, priority=self.priority_combo.currentData(),
+                                          use_cache=self.cache_checkbox.isChecked())
+            self.pause_button.setEnabled(True)
+            self.status_label.setText(f"{len(jobs)} arquivo(s) na fila.")
+            return
+
+        cache = ConversionCache() if self.cache_checkbox.isChecked() else None
+        self.worker = SyncWorker(
+            self.source_dir, self.output_dir, self.to_format, self.conversion_settings(),
+            delete=self.delete_checkbox.isChecked(), max_workers=self.workers_spin.value(), cache=cache
+        )
 
-        self.worker = Worker(convert_image, self.files, self.output_dir, self.to_format, quality=quality)
         self.thread = QThread()
         self.worker.moveToThread(self.thread)
         self.worker.progress.connect(self.update_progress)
+        self.worker.status.connect(self.status_label.setText)
         self.worker.finished.connect(self.on_conversion_finished)
         self.worker.error.connect(self.on_conversion_error)
+        self.worker.finished.connect(self.thread.quit)
+        self.worker.error.connect(self.thread.quit)
         self.thread.started.connect(self.worker.run)
         self.thread.start()
 
-class AudioConversionWidget(BaseConversionWidget):
+class ImageConversionWidget(BaseConversionWidget):
+    media_type = 'image'
+
     def __init__(self, from_format, to_format, parent=None):
         super().__init__(parent)
         self.from_format = from_format
         self.to_format = to_format
         self.title_label.setText(f"Converter {from_format} para {to_format}")
 
-        self.bitrate_combo = QComboBox()
-        self.bitrate_combo.addItems(["96k", "128k", "192k", "256k", "320k"])
-        self.bitrate_combo.setCurrentText("192k")
-        self.options_layout.addWidget(QLabel("Bitrate:"))
-        self.options_layout.addWidget(self.bitrate_combo)
+        self.quality_slider = QSlider(Qt.Horizontal)
+        self.quality_slider.setRange(1, 100)
+        self.quality_slider.setValue(90)
+        self.options_layout.addWidget(QLabel("Qualidade:"))
+        self.options_layout.addWidget(self.quality_slider)
 
-    def start_conversion(self):
-        if not self.files or not self.output_dir:
-            self.status_label.setText("Por favor, selecione os arquivos e a pasta de destino.")
-            return
+        size_layout = QHBoxLayout()
+        self.width_edit = QLineEdit()
+        self.width_edit.setPlaceholderText("Largura")
+        self.height_edit = QLineEdit()
+        self.height_edit.setPlaceholderText("Altura")
+        size_layout.addWidget(self.width_edit)
+        size_layout.addWidget(self.height_edit)
+        self.options_layout.addWidget(QLabel("Redimensionar (px, opcional):"))
+        self.options_layout.addLayout(size_layout)
+
+        self.keep_aspect_checkbox = QCheckBox("Manter proporção")
+        self.keep_aspect_checkbox.setChecked(True)
+        self.options_layout.addWidget(self.keep_aspect_checkbox)
+
+        # Names understood by converter.resample_filter (not imported here to keep Pillow out of startup).
+        self.resample_combo = QComboBox()
+        self.resample_combo.addItems(["lanczos", "bicubic", "bilinear", "hamming", "box", "nearest"])
+        self.options_layout.addWidget(QLabel("Filtro de redimensionamento:"))
+        self.options_layout.addWidget(self.resample_combo)
+
+        self.global_palette_checkbox = QCheckBox("Paleta única para GIF animado (mais rápido)")
+        self.options_layout.addWidget(self.global_palette_checkbox)
+
+        self.options_layout.addWidget(QLabel("Operações (ex.: auto_orient;crop=0,0,800,600;sharpen):"))
+        self.ops_input = QLineEdit()
+        self.options_layout.addWidget(self.ops_input)
+
+    def conversion_settings(self):
+        return {
+            'quality': self.quality_slider.value(),
+            'width': self.width_edit.text(),
+            'height': self.height_edit.text(),
+            'keep_aspect_ratio': self.keep_aspect_checkbox.isChecked(),
+            'resample': self.resample_combo.currentText(),
+            'palette': 'global' if self.global_palette_checkbox.isChecked() else 'adaptive',
+            'ops': self.ops_input.text().strip(),
+        }
 
-        self.convert_button.setEnabled(False)
-        self.progress_bar.setVisible(True)
-        self.progress_bar.setValue(0)
+class AudioConversionWidget(BaseConversionWidget):
+    media_type = 'audio'
 
-        bitrate = self.bitrate_combo.currentText()
+    def __init__(self, from_format, to_format, parent=None):
+        super().__init__(parent)
+        self.from_format = from_format
+        self.to_format = to_format
+        self.title_label.setText(f"Converter {from_format} para {to_format}")
 
-        self.worker = Worker(convert_audio, self.files, self.output_dir, self.to_format, bitrate=bitrate)
-        self.thread = QThread()
-        self.worker.moveToThread(self.thread)
-        self.worker.progress.connect(self.update_progress)
-        self.worker.finished.connect(self.on_conversion_finished)
-        self.worker.error.connect(self.on_conversion_error)
-        self.thread.started.connect(self.worker.run)
-        self.thread.start()
+        target = to_format.lower()
+        self.lossless = target in LOSSLESS_TARGETS
+        if not self.lossless:
+            self.bitrate_combo = QComboBox()
+            self.bitrate_combo.addItems(["64k", "96k", "128k", "192k", "256k", "320k"])
+            self.bitrate_combo.setCurrentText("192k")
+            self.options_layout.addWidget(QLabel("Bitrate:"))
+            self.options_layout.addWidget(self.bitrate_combo)
+
+            self.bitrate_mode_combo = QComboBox()
+            for label, mode in [("Constante (CBR)", 'cbr'), ("Média (ABR)", 'abr'), ("Variável (VBR)", 'vbr')]:
+                self.bitrate_mode_combo.addItem(label, mode)
+            self.options_layout.addWidget(QLabel("Modo de bitrate:"))
+            self.options_layout.addWidget(self.bitrate_mode_combo)
+
+        self.sample_rate_combo = QComboBox()
+        self.sample_rate_combo.addItem("Manter original", None)
+        for rate in SAMPLE_RATES:
+            self.sample_rate_combo.addItem(f"{rate} Hz", rate)
+        self.options_layout.addWidget(QLabel("Taxa de amostragem:"))
+        self.options_layout.addWidget(self.sample_rate_combo)
+
+        self.channels_combo = QComboBox()
+        for label, channels in [("Manter original", None), ("Mono", 1), ("Estéreo", 2)]:
+            self.channels_combo.addItem(label, channels)
+        self.options_layout.addWidget(QLabel("Canais:"))
+        self.options_layout.addWidget(self.channels_combo)
+
+        if self.lossless:
+            self.bit_depth_combo = QComboBox()
+            self.bit_depth_combo.addItem("Manter padrão (16 bits)", None)
+            for depth in BIT_DEPTHS if target == 'wav' else [16, 24]:
+                self.bit_depth_combo.addItem(f"{depth} bits", depth)
+            self.options_layout.addWidget(QLabel("Profundidade de bits:"))
+            self.options_layout.addWidget(self.bit_depth_combo)
+
+        if target == 'flac':
+            self.compression_spin = QSpinBox()
+            self.compression_spin.setRange(0, 12)
+            self.compression_spin.setValue(5)
+            self.options_layout.addWidget(QLabel("Nível de compressão FLAC (maior = menor e mais lento):"))
+            self.options_layout.addWidget(self.compression_spin)
+
+        self.loudness_combo = QComboBox()
+        for label, target in [("Não normalizar", None), ("-23 LUFS (EBU R128)", -23),
+                              ("-16 LUFS (podcast)", -16), ("-14 LUFS (streaming)", -14)]:
+            self.loudness_combo.addItem(label, target)
+        self.options_layout.addWidget(QLabel("Normalizar volume:"))
+        self.options_layout.addWidget(self.loudness_combo)
+
+        self.trim_silence_checkbox = QCheckBox("Remover silêncio no início e no fim")
+        self.options_layout.addWidget(self.trim_silence_checkbox)
+
+    def conversion_settings(self):
+        settings = {
+            'sample_rate': self.sample_rate_combo.currentData(),
+            'channels': self.channels_combo.currentData(),
+        }
+        if self.lossless:
+            settings['bit_depth'] = self.bit_depth_combo.currentData()
+        else:
+            settings['bitrate'] = self.bitrate_combo.currentText()
+            settings['bitrate_mode'] = self.bitrate_mode_combo.currentData()
+        if hasattr(self, 'compression_spin'):
+            settings['compression_level'] = self.compression_spin.value()
+        if self.loudness_combo.currentData() is not None:
+            settings['normalize'] = True
+            settings['target_loudness'] = self.loudness_combo.currentData()
+        if self.trim_silence_checkbox.isChecked():
+            settings['trim_silence'] = True
+        return settings
 
 class VideoConversionWidget(BaseConversionWidget):
+    media_type = 'video'
+    # (label, settings['stream_copy']); see video_profiles.plan_stream_copy.
+    STREAM_COPY_MODES = [
+        ("Remuxar (sem recodificar) os streams compatíveis, se não escolher codec/qualidade", 'auto'),
+        ("Sempre remuxar os streams compatíveis (ignora codec e qualidade)", True),
+        ("Sempre recodificar", False),
+    ]
+
     def __init__(self, from_format, to_format, parent=None):
         super().__init__(parent)
         self.from_format = from_format
         self.to_format = to_format
         self.title_label.setText(f"Converter {from_format} para {to_format}")
 
+        self.profile_combo = QComboBox()
+        self.profile_combo.addItem("Personalizado")
+        self.profile_combo.addItems(list_profiles())
+        self.profile_combo.currentTextChanged.connect(self.apply_profile)
+        self.options_layout.addWidget(QLabel("Perfil:"))
+        self.options_layout.addWidget(self.profile_combo)
+
+        self.codec_combo = QComboBox()
+        self.codec_combo.addItems(VIDEO_CODECS.get(to_format.lower(), VIDEO_CODECS['mkv']))
+        self.options_layout.addWidget(QLabel("Codec de vídeo:"))
+        self.options_layout.addWidget(self.codec_combo)
+
+        self.preset_combo = QComboBox()
+        self.preset_combo.addItems(SPEED_PRESETS)
+        self.preset_combo.setCurrentText('medium')
+        self.options_layout.addWidget(QLabel("Velocidade (preset):"))
+        self.options_layout.addWidget(self.preset_combo)
+
+        self.threads_spin = QSpinBox()
+        self.threads_spin.setRange(0, default_workers())
+        self.threads_spin.setSpecialValueText("Automático")
+        self.options_layout.addWidget(QLabel("Threads do codificador:"))
+        self.options_layout.addWidget(self.threads_spin)
+
         self.quality_slider = QSlider(Qt.Horizontal)
         self.quality_slider.setRange(18, 28)
         self.quality_slider.setValue(23)
         self.options_layout.addWidget(QLabel("Qualidade (CRF):"))
         self.options_layout.addWidget(self.quality_slider)
 
-    def start_conversion(self):
-        if not self.files or not self.output_dir:
-            self.status_label.setText("Por favor, selecione os arquivos e a pasta de destino.")
+        self.stream_copy_combo = QComboBox()
+        for label, mode in self.STREAM_COPY_MODES:
+            self.stream_copy_combo.addItem(label, mode)
+        self.options_layout.addWidget(QLabel("Remux:"))
+        self.options_layout.addWidget(self.stream_copy_combo)
+        # Whether the user (or a profile) picked the codec, preset or quality.
+        self.encode_chosen = False
+        for signal in (self.codec_combo.currentTextChanged, self.preset_combo.currentTextChanged,
+                       self.quality_slider.valueChanged):
+            signal.connect(self.mark_encode_chosen)
+
+        self.segments_checkbox = QCheckBox("Dividir arquivos longos em segmentos codificados em paralelo")
+        self.options_layout.addWidget(self.segments_checkbox)
+
+        self.save_profile_button = QPushButton("Salvar Perfil")
+        self.save_profile_button.clicked.connect(self.save_current_profile)
+        self.options_layout.addWidget(self.save_profile_button)
+
+    def mark_encode_chosen(self, *args):
+        self.encode_chosen = True
+
+    def apply_profile(self, name):
+        if name == "Personalizado":
             return
-
-        self.convert_button.setEnabled(False)
-        self.progress_bar.setVisible(True)
-        self.progress_bar.setValue(0)
-
-        quality = self.quality_slider.value()
-
-        self.worker = Worker(convert_video, self.files, self.output_dir, self.to_format, quality=quality)
-        self.thread = QThread()
-        self.worker.moveToThread(self.thread)
-        self.worker.progress.connect(self.update_progress)
-        self.worker.finished.connect(self.on_conversion_finished)
-        self.worker.error.connect(self.on_conversion_error)
-        self.thread.started.connect(self.worker.run)
-        self.thread.start()
+        profile = load_profile(name)
+        if profile.get('video_codec') and self.codec_combo.findText(profile['video_codec']) >= 0:
+            self.codec_combo.setCurrentText(profile['video_codec'])
+        self.preset_combo.setCurrentText(profile.get('preset', 'medium'))
+        self.threads_spin.setValue(int(profile.get('threads', 0)))
+        if crf_value(profile.get('quality')) is not None:
+            self.quality_slider.setValue(crf_value(profile['quality']))
+
+    def save_current_profile(self):
+        name, ok = QInputDialog.getText(self, "Salvar Perfil", "Nome do perfil:")
+        if ok and name:
+            save_profile(name, self.conversion_settings())
+            if self.profile_combo.findText(name) < 0:
+                self.profile_combo.addItem(name)
+            self.profile_combo.setCurrentText(name)
+
+    def conversion_settings(self):
+        settings = {
+            'video_codec': self.codec_combo.currentText(),
+            'preset': self.preset_combo.currentText(),
+            'quality': self.quality_slider.value(),
+        }
+        if self.threads_spin.value():
+            settings['threads'] = self.threads_spin.value()
+        stream_copy = self.stream_copy_combo.currentData()
+        if stream_copy == 'auto' and not self.encode_chosen:
+            # The widgets always carry a codec, preset and quality, which 'auto' would
+            # take as a request to re-encode; untouched, they are only the defaults.
+            stream_copy = True
+        if stream_copy != 'auto':
+            settings['stream_copy'] = stream_copy
+        if self.segments_checkbox.isChecked():
+            settings['segments'] = 'auto'
+        return settings
 
 class DashboardWidget(QWidget):
+    # (title, favourite conversions, formats offered under "Outros").
+    TABS = [
+        ("Imagem", [("JPG", "PNG"), ("PNG", "JPG"), ("WEBP", "PNG"), ("JPG", "WEBP")],
+         ["WEBP", "GIF", "PNG", "JPG", "BMP"]),
+        ("Áudio", [("MP3", "WAV"), ("WAV", "MP3"), ("FLAC", "MP3"), ("FLAC", "WAV")],
+         ["MP3", "WAV", "FLAC", "OGG", "OPUS", "M4A", "AAC"]),
+        ("Vídeo", [("MP4", "WEBM"), ("WEBM", "MP4"), ("MKV", "MP4")],
+         ["MP4", "WEBM", "MKV", "MOV"]),
+    ]
+
     def __init__(self, start_conversion_callback, check_for_updates_callback):
         super().__init__()
+        self.start_conversion_callback = start_conversion_callback
         main_layout = QVBoxLayout(self)
 
         top_layout = QHBoxLayout()
@@ -246,63 +703,28 @@ class DashboardWidget(QWidget):
 
         main_layout.setAlignment(Qt.AlignCenter)
 
+        # Each tab starts as an empty page and gets its buttons the first time
+        # it is shown, so only the visible one is built at startup.
         self.tabs = QTabWidget()
-        self.image_tab = self.create_image_tab(start_conversion_callback)
-        self.audio_tab = self.create_audio_tab(start_conversion_callback)
-        self.video_tab = self.create_video_tab(start_conversion_callback)
-
-        self.tabs.addTab(self.image_tab, "Imagem")
-        self.tabs.addTab(self.audio_tab, "Áudio")
-        self.tabs.addTab(self.video_tab, "Vídeo")
+        for title, _, _ in self.TABS:
+            page = QWidget()
+            QVBoxLayout(page)
+            self.tabs.addTab(page, title)
+        self.built_tabs = set()
+        self.tabs.currentChanged.connect(self.build_tab)
+        self.build_tab(self.tabs.currentIndex())
 
         main_layout.addWidget(self.tabs)
 
-    def create_image_tab(self, callback):
-        widget = QWidget()
-        layout = QVBoxLayout(widget)
-
-        favorites_layout = QGridLayout()
-        favorites = [("JPG", "PNG"), ("PNG", "JPG"), ("WEBP", "PNG"), ("JPG", "WEBP")]
-
-        positions = [(i, j) for i in range(2) for j in range(2)]
-        for pos, (f_from, f_to) in zip(positions, favorites):
-            card = QPushButton(f"{f_from} para {f_to}")
-            card.setMinimumSize(150, 80)
-            card.clicked.connect(partial(callback, f_from, f_to))
-            favorites_layout.addWidget(card, pos[0], pos[1])
-
-        layout.addWidget(QLabel("Favoritos:"))
-        layout.addLayout(favorites_layout)
-        layout.addStretch()
-
-        other_formats_label = QLabel("Outros:")
-        layout.addWidget(other_formats_label)
-
-        other_formats_layout = QGridLayout()
-        all_formats = ["WEBP", "GIF", "PNG", "JPG", "BMP"]
-        all_combinations = [(f_from, f_to) for f_from in all_formats for f_to in all_formats if f_from != f_to]
-        other_combinations = [c for c in all_combinations if c not in favorites]
-
-        row, col = 0, 0
-        for f_from, f_to in other_combinations:
-            button = QPushButton(f"{f_from} para {f_to}")
-            button.clicked.connect(partial(callback, f_from, f_to))
-            other_formats_layout.addWidget(button, row, col)
-            col += 1
-            if col > 3:
-                col = 0
-                row += 1
-
-        layout.addLayout(other_formats_layout)
-        return widget
-
-    def create_audio_tab(self, callback):
-        widget = QWidget()
-        layout = QVBoxLayout(widget)
+    def build_tab(self, index):
+        if index < 0 or index in self.built_tabs:
+            return
+        self.built_tabs.add(index)
+        _, favorites, all_formats = self.TABS[index]
+        callback = self.start_conversion_callback
+        layout = self.tabs.widget(index).layout()
 
         favorites_layout = QGridLayout()
-        favorites = [("MP3", "WAV"), ("WAV", "MP3"), ("FLAC", "MP3"), ("FLAC", "WAV")]
-
         positions = [(i, j) for i in range(2) for j in range(2)]
         for pos, (f_from, f_to) in zip(positions, favorites):
             card = QPushButton(f"{f_from} para {f_to}")
@@ -318,54 +740,6 @@ class DashboardWidget(QWidget):
         layout.addWidget(other_formats_label)
 
         other_formats_layout = QGridLayout()
-        all_formats = ["MP3", "WAV", "FLAC"]
-        all_combinations = [(f_from, f_to) for f_from in all_formats for f_to in all_formats if f_from != f_to]
-        other_combinations = [c for c in all_combinations if c not in favorites]
-
-        row, col = 0, 0
-        for f_from, f_to in other_combinations:
-            button = QPushButton(f"{f_from} para {f_to}")
-            button.clicked.connect(partial(callback, f_from, f_to))
-            other_formats_layout.addWidget(button, row, col)
-            col += 1
-            if col > 3:
-                col = 0
-                row += 1
-
-        layout.addLayout(other_formats_layout)
-        return widget
-
-    def create_video_tab(self, callback):
-        widget = QWidget()
-        layout = QVBoxLayout(widget)
-
-        favorites_layout = QGridLayout()
-        favorites = [("MP4", "WEBM"), ("WEBM", "MP4"), ("MKV", "MP4")]
-
-        card = QPushButton(f"{favorites[0][0]} para {favorites[0][1]}")
-        card.setMinimumSize(150, 80)
-        card.clicked.connect(partial(callback, favorites[0][0], favorites[0][1]))
-        favorites_layout.addWidget(card, 0, 0)
-
-        card = QPushButton(f"{favorites[1][0]} para {favorites[1][1]}")
-        card.setMinimumSize(150, 80)
-        card.clicked.connect(partial(callback, favorites[1][0], favorites[1][1]))
-        favorites_layout.addWidget(card, 0, 1)
-
-        card = QPushButton(f"{favorites[2][0]} para {favorites[2][1]}")
-        card.setMinimumSize(150, 80)
-        card.clicked.connect(partial(callback, favorites[2][0], favorites[2][1]))
-        favorites_layout.addWidget(card, 1, 0)
-
-        layout.addWidget(QLabel("Favoritos:"))
-        layout.addLayout(favorites_layout)
-        layout.addStretch()
-
-        other_formats_label = QLabel("Outros:")
-        layout.addWidget(other_formats_label)
-
-        other_formats_layout = QGridLayout()
-        all_formats = ["MP4", "WEBM", "MKV", "MOV"]
         all_combinations = [(f_from, f_to) for f_from in all_formats for f_to in all_formats if f_from != f_to]
         other_combinations = [c for c in all_combinations if c not in favorites]
 
@@ -380,7 +754,6 @@ class DashboardWidget(QWidget):
                 row += 1
 
         layout.addLayout(other_formats_layout)
-        return widget
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -391,18 +764,27 @@ class MainWindow(QMainWindow):
         self.stacked_widget = QStackedWidget()
         self.setCentralWidget(self.stacked_widget)
 
+        # One queue for every conversion widget; jobs left over from the last session resume at once.
+        self.queue_bridge = QueueBridge()
+        self.job_queue = JobQueue(cache=ConversionCache(), listener=self.queue_bridge.changed.emit)
+        self.queue_bridge.changed.connect(self.show_queue_status)
+        restored = sum(1 for entry in self.job_queue.entries if not entry.finished)
+        self.job_queue.start()
+        if restored:
+            self.statusBar().showMessage(f"Retomando {restored} conversão(ões) pendente(s) da última sessão.")
+
         self.dashboard = DashboardWidget(self.start_conversion, self.check_for_updates)
         self.stacked_widget.addWidget(self.dashboard)
 
-        self.check_for_updates(is_manual_check=False)
+        QTimer.singleShot(UPDATE_CHECK_DELAY_MS, partial(self.check_for_updates, is_manual_check=False))
+        QTimer.singleShot(UPDATE_CHECK_DELAY_MS, remove_installer_copies)
 
     def start_conversion(self, from_format, to_format):
-        image_formats = ["WEBP", "GIF", "PNG", "JPG", "BMP"]
-        audio_formats = ["MP3", "WAV", "FLAC"]
+        media_type = media_type_for_format(from_format)
 
-        if from_format.upper() in image_formats:
+        if media_type == 'image':
             self.conversion_widget = ImageConversionWidget(from_format, to_format, self)
-        elif from_format.upper() in audio_formats:
+        elif media_type == 'audio':
             self.conversion_widget = AudioConversionWidget(from_format, to_format, self)
         else:
             self.conversion_widget = VideoConversionWidget(from_format, to_format, self)
@@ -413,9 +795,28 @@ class MainWindow(QMainWindow):
     def show_dashboard(self):
         self.stacked_widget.setCurrentWidget(self.dashboard)
         if hasattr(self, 'conversion_widget'):
+            # A batch still in the queue keeps running; the status bar tracks it from here.
+            self.queue_bridge.changed.disconnect(self.conversion_widget.on_queue_changed)
             self.stacked_widget.removeWidget(self.conversion_widget)
             del self.conversion_widget
 
+    def show_queue_status(self, entry):
+        counts = self.job_queue.counts()
+        running, queued, paused = counts.get('running', 0), counts.get('queued', 0), counts.get('paused', 0)
+        if running or queued or paused:
+            self.statusBar().showMessage(f"Fila: {running} em andamento, {queued} aguardando, {paused} pausado(s).")
+        else:
+            self.statusBar().showMessage("Fila vazia.", 5000)
+            # The open widget reads its own batch's results before dropping them.
+            widget = getattr(self, 'conversion_widget', None)
+            if widget is None or widget.batch is None:
+                self.job_queue.forget_finished()
+
+    def closeEvent(self, event):
+        # Unfinished jobs stay in the queue file and resume on the next start.
+        self.job_queue.shutdown()
+        super().closeEvent(event)
+
     def check_for_updates(self, is_manual_check=True):
         self.update_check_thread = QThread()
         self.update_check_worker = CheckUpdateWorker()
@@ -463,8 +864,14 @@ class MainWindow(QMainWindow):
             QApplication.instance().quit()
             return
 
-        # For the packaged app, run the executable directly
-        subprocess.Popen([installer_path, file_path, app_path, str(os.getpid())])
+        # For the packaged app, run the executable directly, from a copy outside the
+        # install folder: the folder is renamed during the update, which Windows
+        # refuses while a program inside it is running or is its working directory.
+        # The copy is deleted on the next start (remove_installer_copies).
+        installer_dir = tempfile.mkdtemp(prefix=INSTALLER_DIR_PREFIX)
+        installer_copy = os.path.join(installer_dir, os.path.basename(installer_path))
+        shutil.copy2(installer_path, installer_copy)
+        subprocess.Popen([installer_copy, file_path, app_path, str(os.getpid())], cwd=installer_dir)
         QApplication.instance().quit()
 
     def show_no_update_dialog(self):
@@ -472,6 +879,9 @@ class MainWindow(QMainWindow):
 
 
 if __name__ == "__main__":
+    # Required for the conversion process pool in the frozen (PyInstaller) build.
+    import multiprocessing
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
@@ -0,0 +1,185 @@
+"""
+Incremental folder sync ("mirror" mode).
+
+Converts every file of a source tree into the same relative location under
+an output tree, and records what was converted in a small manifest stored in
+the output tree. Later runs only convert files that were added or changed
+since, instead of writing `name-1.jpg`, `name-2.jpg`, ... duplicates.
+"""
+import os
+import json
+import shutil
+import tempfile
+
+from batch import make_jobs, run_batch, media_type_for_format
+from discovery import ACCEPTED_SOURCES, discover
+from cache import file_digest, normalize_settings
+
+MANIFEST_NAME = '.universalconverter-manifest.json'
+MANIFEST_VERSION = 1
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == MANIFEST_VERSION:
+            return data.get('entries', {})
+    except (OSError, ValueError):
+        pass
+    return {}
+
+
+def save_manifest(output_dir, entries):
+    """Writes the manifest atomically so an interrupted run never leaves it truncated."""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    fd, temp_path = tempfile.mkstemp(dir=output_dir, prefix='.manifest-', suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'entries': entries}, f, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def scan_sources(source_dir, media_type):
+    """
+    Yields the paths of the sources the `media_type` converter can read,
+    recognised by content (see discovery), relative to `source_dir` and
+    using '/' as separator.
+    """
+    for found in discover([source_dir], accept=ACCEPTED_SOURCES[media_type]):
+        yield os.path.relpath(found.path, source_dir).replace(os.sep, '/')
+
+
+def _output_rel_path(rel_source, to_format, claimed):
+    base, ext = os.path.splitext(rel_source)
+    rel_output = f"{base}.{to_format}"
+    if rel_output in claimed:
+        # e.g. photo.png and photo.jpg in the same folder, both converted to JPG.
+        rel_output = f"{base}.{ext.lstrip('.').lower()}.{to_format}"
+    return rel_output
+
+
+def _is_up_to_date(entry, st, to_format, settings_key, output_dir):
+    return (
+        entry is not None
+        and entry.get('to_format') == to_format
+        and entry.get('settings') == settings_key
+        and os.path.exists(os.path.join(output_dir, entry['output']))
+        and entry.get('mtime_ns') == st.st_mtime_ns
+        and entry.get('size') == st.st_size
+    )
+
+
+def sync_folder(source_dir, output_dir, to_format, settings=None, delete=False,
+                max_workers=None, progress_callback=None, cache=None, cancel_event=None, budget=None):
+    """
+    Brings `output_dir` up to date with `source_dir`.
+
+    A source file is converted only if it is new, its size/mtime changed and
+    its content hash no longer matches the manifest, or the target format or
+    settings changed. Outputs are written to the mirrored relative path and
+    replace the previous version in place.
+
+    :param delete: Also remove outputs whose source file no longer exists.
+    :param cancel_event: Passed to run_batch; files not converted before it is set
+        stay pending and are picked up by the next run.
+    :param budget: scheduler.ResourceBudget passed to run_batch.
+    :return: A dict with the number of files 'converted', 'skipped', 'failed' and 'deleted'.
+    """
+    to_format = to_format.lower()
+    media_type = media_type_for_format(to_format)
+    settings = settings or {}
+    settings_key = normalize_settings(settings)
+    summary = {'converted': 0, 'skipped': 0, 'failed': 0, 'deleted': 0}
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    claimed = {entry['output'] for entry in manifest.values()}
+
+    pending = []  # (rel_source, stat, digest)
+    seen = set()
+    for rel_source in scan_sources(source_dir, media_type):
+        seen.add(rel_source)
+        source_path = os.path.join(source_dir, rel_source)
+        st = os.stat(source_path)
+        entry = manifest.get(rel_source)
+        if _is_up_to_date(entry, st, to_format, settings_key, output_dir):
+            summary['skipped'] += 1
+            continue
+
+        digest = file_digest(source_path)
+        if (entry is not None and entry.get('sha256') == digest
+                and entry.get('to_format') == to_format and entry.get('settings') == settings_key
+                and os.path.exists(os.path.join(output_dir, entry['output']))):
+            # Touched but not modified: refresh the stat fields only.
+            entry.update(mtime_ns=st.st_mtime_ns, size=st.st_size)
+            summary['skipped'] += 1
+            continue
+        pending.append((rel_source, st, digest))
+
+    if delete:
+        for rel_source in [rel for rel in manifest if rel not in seen]:
+            entry = manifest.pop(rel_source)
+            try:
+                os.remove(os.path.join(output_dir, entry['output']))
+            except FileNotFoundError:
+                pass
+            claimed.discard(entry['output'])
+            summary['deleted'] += 1
+
+    if pending:
+        # Each job converts into its own staging folder inside the output tree
+        # (same filesystem), and the result is then renamed over the old output.
+        staging_dir = tempfile.mkdtemp(dir=output_dir, prefix='.staging-')
+        try:
+            sources = [os.path.join(source_dir, rel) for rel, _, _ in pending]
+            jobs = make_jobs(media_type, sources, staging_dir, to_format, settings)
+            jobs = [job._replace(output_dir=os.path.join(staging_dir, str(index))) for index, job in enumerate(jobs)]
+            results = run_batch(jobs, max_workers=max_workers, progress_callback=progress_callback,
+                                cache=cache, cancel_event=cancel_event, budget=budget)
+
+            for job, ok, (rel_source, st, digest) in zip(jobs, results, pending):
+                staged = os.listdir(job.output_dir) if ok and os.path.isdir(job.output_dir) else []
+                if not staged:
+                    summary['failed'] += 1
+                    continue
+
+                old_entry = manifest.get(rel_source)
+                if old_entry:
+                    rel_output = old_entry['output']
+                    if os.path.splitext(rel_output)[1] != f".{to_format}":
+                        # Target format changed: drop the stale output.
+                        _remove_quietly(os.path.join(output_dir, rel_output))
+                        claimed.discard(rel_output)
+                        rel_output = _output_rel_path(rel_source, to_format, claimed)
+                else:
+                    rel_output = _output_rel_path(rel_source, to_format, claimed)
+                claimed.add(rel_output)
+
+                output_path = os.path.join(output_dir, rel_output)
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                os.replace(os.path.join(job.output_dir, staged[0]), output_path)
+
+                manifest[rel_source] = {
+                    'mtime_ns': st.st_mtime_ns,
+                    'size': st.st_size,
+                    'sha256': digest,
+                    'to_format': to_format,
+                    'settings': settings_key,
+                    'output': rel_output,
+                }
+                summary['converted'] += 1
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    elif progress_callback:
+        progress_callback(100)
+
+    save_manifest(output_dir, manifest)
+    return summary
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
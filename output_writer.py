@@ -0,0 +1,198 @@
+"""
+Choosing output names and writing outputs atomically.
+
+reserve() picks the output path for a conversion and returns an OutputFile.
+The converter writes to its `temp_path`, a hidden file in the same
+directory, and calls commit(), which renames it over the final name. A
+conversion that fails, is cancelled or crashes therefore never leaves a
+truncated file under the real name.
+
+What happens when the name is taken depends on the policy:
+
+    suffix     keep the existing file and write name-1.ext, name-2.ext, ...
+    overwrite  replace the existing file when the new one is complete
+    skip       leave the existing file alone and convert nothing
+
+For 'suffix' and 'skip' the name is reserved by creating it exclusively
+(O_CREAT | O_EXCL) as an empty placeholder, so two workers can never pick
+the same name. While the reservation lasts, its owner also holds an OS
+lock on a hidden lock file next to it; the OS drops that lock when the
+process dies, so an empty placeholder whose lock is free was left behind
+by a crash or a kill, and is reclaimed instead of being taken for a
+finished output. Names already holding a non-empty file cost one stat.
+After a collision, the next free suffix is remembered per name, so a
+folder of many same-named inputs does not probe name-1, name-2, ... again
+for every file.
+"""
+import os
+import sys
+import uuid
+
+POLICIES = ['suffix', 'overwrite', 'skip']
+DEFAULT_POLICY = 'suffix'
+TEMP_PREFIX = '.uc-part-'
+LOCK_SUFFIX = '.lock'
+
+# (directory, base name, extension) -> first suffix not known to be taken, per process.
+_next_suffix = {}
+
+
+class OutputFile:
+    """
+    A reserved output path. Use as a context manager: leaving the block
+    without commit() removes the temporary file and the reservation.
+
+    :ivar path: The final output path.
+    :ivar temp_path: Where to write; it keeps the extension of `path`, since
+        FFmpeg chooses the container from it.
+    :ivar existing: True if the policy is 'skip' and `path` already exists;
+        nothing should be written then.
+    """
+
+    def __init__(self, path, placeholder=False, existing=False, lock=None):
+        self.path = path
+        directory, name = os.path.split(path)
+        self.temp_path = os.path.join(directory, f"{TEMP_PREFIX}{uuid.uuid4().hex[:12]}-{name}")
+        self.placeholder = placeholder
+        self.existing = existing
+        self.committed = False
+        self.lock = lock
+
+    def commit(self):
+        """Moves the finished temporary file to the final path."""
+        os.replace(self.temp_path, self.path)
+        self.committed = True
+
+    def discard(self):
+        for path in [self.temp_path] + ([self.path] if self.placeholder and not self.committed else []):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._release()
+
+    def _release(self):
+        # Only once the placeholder is either the real output or gone.
+        if self.lock is not None:
+            _unlock(self.lock)
+            self.lock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.committed and not self.existing:
+            self.discard()
+        self._release()
+        return False
+
+
+def reserve(input_path, output_dir, to_format, policy=None):
+    """
+    Reserves the output path for converting `input_path` to `to_format` in
+    `output_dir` (created if needed): the input's base name with the new
+    extension, handled according to `policy` if it is taken.
+
+    :param policy: 'suffix' (default), 'overwrite' or 'skip'.
+    :return: An OutputFile.
+    :raises ValueError: For an unknown policy.
+    """
+    policy = policy or DEFAULT_POLICY
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown output policy: {policy}")
+    os.makedirs(output_dir, exist_ok=True)
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    extension = to_format.lower()
+    path = os.path.join(output_dir, f"{base_name}.{extension}")
+
+    if policy == 'overwrite':
+        return OutputFile(path)
+    lock = _claim(path)
+    if lock is not None:
+        return OutputFile(path, placeholder=True, lock=lock)
+    if policy == 'skip':
+        return OutputFile(path, existing=True)
+
+    key = (os.path.abspath(output_dir), base_name, extension)
+    index = _next_suffix.get(key, 1)
+    while True:
+        candidate = os.path.join(output_dir, f"{base_name}-{index}.{extension}")
+        index += 1
+        lock = _claim(candidate)
+        if lock is not None:
+            _next_suffix[key] = index
+            return OutputFile(candidate, placeholder=True, lock=lock)
+
+
+def _claim(path):
+    """
+    Reserves `path` if it is free or holds a stale placeholder (empty, with
+    no live reservation). Returns the held lock, or None if the name is taken.
+    """
+    try:
+        if os.path.getsize(path) > 0:
+            return None
+    except OSError:
+        pass
+    lock = _lock(path)
+    if lock is None:
+        return None
+    if _create_exclusive(path):
+        return lock
+    try:
+        if os.path.getsize(path) == 0:
+            return lock  # Left by a reservation that died before finishing.
+    except OSError:
+        pass  # Removed in between by a reservation that gave up; try the next name.
+    _unlock(lock)
+    return None
+
+
+def _lock(path):
+    """
+    Opens and locks the lock file of the reservation of `path`, without
+    waiting. Returns the open file, or None if another reservation holds it.
+    """
+    directory, name = os.path.split(path)
+    lock_path = os.path.join(directory, f"{TEMP_PREFIX}{name}{LOCK_SUFFIX}")
+    while True:
+        f = open(lock_path, 'a+b')
+        try:
+            f.seek(0)
+            if sys.platform == 'win32':
+                import msvcrt
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+        try:
+            # The previous owner may have removed the file between our open and lock.
+            if os.stat(lock_path).st_ino == os.fstat(f.fileno()).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()
+
+
+def _unlock(lock):
+    # Removed while still locked, so nobody locks it between the close and the
+    # removal. Windows cannot remove an open file, so there it is closed first;
+    # the removal then fails, harmlessly, if another process has it open.
+    if sys.platform == 'win32':
+        lock.close()
+    try:
+        os.remove(lock.name)
+    except OSError:
+        pass
+    lock.close()  # Closing releases the lock.
+
+
+def _create_exclusive(path):
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
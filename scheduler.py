@@ -0,0 +1,183 @@
+"""
+Resource-aware admission of conversion jobs.
+
+The three kinds of job load a machine very differently:
+
+  image  Pillow runs one conversion on one core; memory grows with the
+         pixel count, and with the frame count for animated WebP output,
+         whose frames are all held until the encoder runs.
+  audio  one FFmpeg process streaming on about one core, in a few MB;
+         loudness normalization and silence trimming add NumPy analysis
+         buffers (about 100 MB).
+  video  FFmpeg encoders use every core they are given, and hold dozens
+         of frames for lookahead and reference.
+
+estimate_cost() turns a Job into a Cost (threads, bytes of memory), and a
+ResourceBudget admits jobs while the total stays within the core count and
+the memory budget. A job that would not fit even on an idle machine still
+runs, alone. Video jobs without an explicit 'threads' setting are given
+VIDEO_CORE_SHARE of the cores through FFmpeg's -threads, so an encode
+leaves room for image and audio jobs beside it instead of oversubscribing.
+
+Estimates come from file headers (Pillow for images, ffprobe for video)
+and are deliberately rough: they only need to keep, say, four large
+animated WebPs from being decoded at once.
+"""
+import os
+import sys
+import threading
+from collections import namedtuple
+
+Cost = namedtuple('Cost', ['threads', 'memory'])
+
+MB = 1024 ** 2
+DEFAULT_MEMORY_SHARE = 0.5       # of physical RAM, when no budget is given
+VIDEO_CORE_SHARE = 0.5           # of the cores, per video encode
+IMAGE_WORKING_COPIES = 3         # decoded source, resized copy, encoder buffers
+IMAGE_FALLBACK_MEMORY = 256 * MB
+AUDIO_STREAMING_MEMORY = 32 * MB
+AUDIO_ANALYSIS_MEMORY = 160 * MB
+VIDEO_BASE_MEMORY = 128 * MB
+VIDEO_FRAME_BUFFERS = 80         # frames held by lookahead, references and threads
+VIDEO_FALLBACK_SIZE = (1920, 1080)
+STREAM_COPY_MEMORY = 64 * MB
+
+
+def total_memory():
+    """Physical memory in bytes, or None if it cannot be determined."""
+    if sys.platform == 'win32':
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullTotalPhys
+        return None
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_memory_budget():
+    total = total_memory()
+    return int(total * DEFAULT_MEMORY_SHARE) if total else None
+
+
+def video_threads(cores):
+    return max(1, int(cores * VIDEO_CORE_SHARE))
+
+
+def estimate_cost(job, cores=None):
+    """The expected Cost of a Job; falls back to generous defaults for unreadable inputs."""
+    cores = cores or os.cpu_count() or 1
+    if job.media_type == 'image':
+        return Cost(1, _image_memory(job))
+    if job.media_type == 'audio':
+        heavy = job.settings.get('normalize') or job.settings.get('trim_silence')
+        return Cost(1, AUDIO_ANALYSIS_MEMORY if heavy else AUDIO_STREAMING_MEMORY)
+    return _video_cost(job, cores)
+
+
+def _image_memory(job):
+    try:
+        from PIL import Image
+        from converter import target_size
+        with Image.open(job.input_path) as img:
+            size = target_size(img.size, job.settings) or img.size
+            frame = img.width * img.height * 4
+            if job.to_format.lower() == 'webp' and getattr(img, 'is_animated', False):
+                # Every resized frame is kept until the WebP encoder runs.
+                return frame * 2 + img.n_frames * size[0] * size[1] * 4
+            return frame * IMAGE_WORKING_COPIES
+    except Exception:
+        return IMAGE_FALLBACK_MEMORY
+
+
+def _video_cost(job, cores):
+    settings = job.settings
+    try:
+        from video_profiles import resolve_profile
+        profile = resolve_profile(job.to_format.lower(), settings)
+    except Exception:
+        profile = {}
+    if profile.get('video_codec') == 'copy':
+        return Cost(1, STREAM_COPY_MEMORY)
+
+    if settings.get('segments'):
+        # encode_segmented spreads its pieces over every core itself.
+        threads = cores
+    elif settings.get('threads') not in (None, '', 0, '0'):
+        threads = min(cores, int(settings['threads']))
+    else:
+        threads = video_threads(cores)
+
+    width, height = VIDEO_FALLBACK_SIZE
+    try:
+        from ffmpeg_runner import probe
+        stream = next(s for s in probe(job.input_path)['streams'] if s.get('codec_type') == 'video')
+        width, height = int(stream['width']), int(stream['height'])
+    except Exception:
+        pass
+    # 4:2:0 frames are 1.5 bytes per pixel; each encoder thread adds its own frames in flight.
+    frames = VIDEO_FRAME_BUFFERS + 4 * threads
+    return Cost(threads, VIDEO_BASE_MEMORY + int(width * height * 1.5 * frames))
+
+
+def assign_threads(job, cost):
+    """
+    Returns `job` with the video thread count the budget planned for, unless
+    the settings already choose one (or segments, which manage their own).
+    """
+    settings = job.settings
+    if (job.media_type != 'video' or settings.get('segments')
+            or settings.get('threads') not in (None, '', 0, '0')):
+        return job
+    return job._replace(settings={**settings, 'threads': cost.threads})
+
+
+class ResourceBudget:
+    """
+    Threads and memory claimed by running jobs. Not a lock: callers check
+    fits() and claim() from their own dispatch loop, then release() when the
+    job ends.
+
+    :param threads: Thread budget; defaults to the number of CPUs.
+    :param memory: Memory budget in bytes; defaults to half of physical memory,
+        and None after that means no memory cap.
+    """
+
+    def __init__(self, threads=None, memory=None):
+        self.threads = threads or os.cpu_count() or 1
+        self.memory = memory if memory is not None else default_memory_budget()
+        self.used_threads = 0
+        self.used_memory = 0
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def fits(self, cost):
+        with self.lock:
+            if self.running == 0:
+                return True  # Whatever its size, a job can always run alone.
+            if self.used_threads + cost.threads > self.threads:
+                return False
+            return self.memory is None or self.used_memory + cost.memory <= self.memory
+
+    def claim(self, cost):
+        with self.lock:
+            self.used_threads += cost.threads
+            self.used_memory += cost.memory
+            self.running += 1
+
+    def release(self, cost):
+        with self.lock:
+            self.used_threads -= cost.threads
+            self.used_memory -= cost.memory
+            self.running -= 1
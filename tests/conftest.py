@@ -0,0 +1,95 @@
+import os
+import sys
+import threading
+import http.server
+
+import pytest
+
+# The modules live at the top of the repository, not in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ReleaseServer(http.server.ThreadingHTTPServer):
+    """
+    A local stand-in for the release host: serves `files` (URL path -> bytes)
+    with an ETag and, unless `ranges` is off, HTTP Range and If-Range support.
+
+    :ivar drops: URL path -> how many of its next responses are cut off a third of the way in.
+    :ivar send_length: Whether responses carry a Content-Length.
+    :ivar requests: (path, Range, If-Range, status) of every request, in order.
+    """
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _ReleaseHandler)
+        self.files = {}
+        self.etag = '"1"'
+        self.ranges = True
+        self.drops = {}
+        self.send_length = True
+        self.requests = []
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_port}{path}"
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _ReleaseHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        data = server.files.get(self.path)
+        requested, validator = self.headers.get('Range'), self.headers.get('If-Range')
+        start, end = 0, None
+        if data is None:
+            status = 404
+        elif requested and server.ranges and validator in (None, server.etag):
+            first, last = requested.split('=', 1)[1].split('-')
+            start = int(first)
+            end = min(int(last), len(data) - 1) if last else len(data) - 1
+            status = 416 if start >= len(data) else 206
+        else:
+            status = 200
+        server.requests.append((self.path, requested, validator, status))
+
+        self.send_response(status)
+        if status in (404, 416):
+            if status == 416:
+                self.send_header('Content-Range', f"bytes */{len(data)}")
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = data[start:None if end is None else end + 1]
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{start + len(body) - 1}/{len(data)}")
+        if server.send_length:
+            self.send_header('Content-Length', str(len(body)))
+        else:
+            self.close_connection = True  # The end of the body is the end of the connection.
+        self.send_header('ETag', server.etag)
+        self.end_headers()
+        if server.drops.get(self.path):
+            server.drops[self.path] -= 1
+            body = body[:len(body) // 3]
+            self.close_connection = True
+        try:
+            self.wfile.write(body)
+            self.wfile.flush()
+        except ConnectionError:
+            pass  # The client moved on, e.g. zipfile seeking elsewhere.
+
+
+@pytest.fixture
+def release_server():
+    server = ReleaseServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,133 @@
+"""Delta updates end to end, against fake releases served from a local HTTP server."""
+import os
+import json
+import shutil
+import hashlib
+import zipfile
+
+import pytest
+
+import updater
+import install_update
+from delta_update import MANIFEST_NAME, MANIFEST_SUFFIX, DeltaUnavailable, build_manifest, fetch_delta
+
+# Large and incompressible, and the same in both releases: a delta must not fetch it.
+UNCHANGED = os.urandom(2 * 1024 * 1024)
+
+RELEASE_1 = {
+    'UniversalConverter.exe': b'release 1 launcher',
+    '_internal/ffmpeg.exe': UNCHANGED,
+    '_internal/qt.dll': b'qt 1' * 1000,
+    'old.txt': b'removed in release 2',
+    'VERSION.txt': b'1.0.0',
+}
+RELEASE_2 = {
+    'UniversalConverter.exe': b'release 2 launcher',
+    '_internal/ffmpeg.exe': UNCHANGED,
+    '_internal/qt.dll': b'qt 2' * 1000,
+    'new/added.txt': b'added in release 2',
+    'VERSION.txt': b'2.0.0',
+}
+
+
+def _build_release(root, files, version):
+    """Writes an install tree with its manifest and zips it; returns (manifest, zip bytes)."""
+    for relative, data in files.items():
+        path = os.path.join(root, *relative.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    manifest = build_manifest(str(root), version)
+    with open(os.path.join(root, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    zip_path = f"{root}.zip"
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for relative in list(files) + [MANIFEST_NAME]:
+            archive.write(os.path.join(root, *relative.split('/')), relative)
+    with open(zip_path, 'rb') as f:
+        return manifest, f.read()
+
+
+def _tree(root):
+    """{relative path: content} of every file under `root`."""
+    contents = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, 'rb') as f:
+                contents[os.path.relpath(path, root).replace(os.sep, '/')] = f.read()
+    return contents
+
+
+@pytest.fixture
+def releases(tmp_path, release_server):
+    """Releases 1 and 2 on disk, release 2 served, and release 1 installed; returns their folders and URL."""
+    _build_release(tmp_path / 'release1', RELEASE_1, '1.0.0')
+    manifest, zip_data = _build_release(tmp_path / 'release2', RELEASE_2, '2.0.0')
+    release_server.files['/release2.zip'] = zip_data
+    release_server.files['/release2.zip' + MANIFEST_SUFFIX] = json.dumps(manifest).encode()
+    release_server.files['/release2.zip' + updater.CHECKSUM_SUFFIX] = (
+        f"{hashlib.sha256(zip_data).hexdigest()}  release2.zip\n".encode())
+    install = tmp_path / 'install'
+    shutil.copytree(tmp_path / 'release1', install)
+    return {
+        'release1': tmp_path / 'release1', 'release2': tmp_path / 'release2', 'install': install,
+        'staging': tmp_path / 'staging', 'url': release_server.url('/release2.zip'),
+    }
+
+
+def test_delta_update_installs_release_2(releases):
+    staging = fetch_delta(releases['url'], str(releases['install']), str(releases['staging']))
+    # Only the changed members were fetched, not the unchanged 2 MB one.
+    assert set(_tree(os.path.join(staging, 'files'))) == {
+        'UniversalConverter.exe', '_internal/qt.dll', 'new/added.txt', 'VERSION.txt', MANIFEST_NAME}
+    install_update.apply_delta(staging, str(releases['install']))
+
+    assert _tree(releases['install']) == _tree(releases['release2'])
+    assert not (releases['install'] / 'old.txt').exists()
+
+
+def test_corrupt_staged_file_leaves_release_1(releases):
+    staging = fetch_delta(releases['url'], str(releases['install']), str(releases['staging']))
+    with open(os.path.join(staging, 'files', 'VERSION.txt'), 'wb') as f:
+        f.write(b'tampered')
+
+    with pytest.raises(ValueError):
+        install_update.apply_delta(staging, str(releases['install']))
+    assert _tree(releases['install']) == _tree(releases['release1'])
+
+
+def test_failed_swap_rolls_back_to_release_1(releases, monkeypatch):
+    staging = fetch_delta(releases['url'], str(releases['install']), str(releases['staging']))
+    replace = os.replace
+    calls = []
+
+    def failing_replace(source, target):
+        calls.append(target)
+        if len(calls) == 4:  # Partway through replacing the changed files.
+            raise OSError("disk full")
+        return replace(source, target)
+
+    monkeypatch.setattr(install_update.os, 'replace', failing_replace)
+    with pytest.raises(OSError):
+        install_update.apply_delta(staging, str(releases['install']))
+    monkeypatch.undo()
+
+    assert len(calls) > 4  # The files already replaced were put back.
+    assert _tree(releases['install']) == _tree(releases['release1'])
+
+
+def test_server_without_ranges_falls_back_to_the_full_zip(releases, release_server, tmp_path):
+    release_server.ranges = False
+    with pytest.raises(DeltaUnavailable):
+        fetch_delta(releases['url'], str(releases['install']), str(releases['staging']))
+
+    download_dir = tmp_path / 'download'
+    assert updater.download_delta(releases['url'], None, str(releases['install']),
+                                  download_dir=str(download_dir)) is None
+    assert not (download_dir / 'release2.zip.delta').exists()
+
+    zip_path = updater.download_update(releases['url'], lambda percent: None, download_dir=str(download_dir))
+    assert zip_path is not None
+    install_update.extract_update(zip_path, str(tmp_path / 'extracted'))
+    assert _tree(tmp_path / 'extracted') == _tree(releases['release2'])
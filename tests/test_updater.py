@@ -0,0 +1,107 @@
+"""Resumable, verified update downloads against a local HTTP server."""
+import os
+import hashlib
+
+import pytest
+
+import updater
+
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+
+
+def _checksum(data):
+    return f"{hashlib.sha256(data).hexdigest()}  update.zip\n".encode()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(updater, 'BACKOFF_SECONDS', 0)
+
+
+@pytest.fixture
+def served(release_server, tmp_path):
+    """The update zip and its checksum served; returns (url, download dir, .part path)."""
+    release_server.files['/update.zip'] = DATA
+    release_server.files['/update.zip' + updater.CHECKSUM_SUFFIX] = _checksum(DATA)
+    download_dir = tmp_path / 'download'
+    return release_server.url('/update.zip'), str(download_dir), str(download_dir / 'update.zip.part')
+
+
+def _zip_requests(server):
+    return [request for request in server.requests if request[0] == '/update.zip']
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_resumes_after_a_dropped_connection(release_server, served):
+    url, download_dir, part_path = served
+    release_server.drops['/update.zip'] = 1
+    progress = []
+
+    path = updater.download_update(url, progress.append, download_dir=download_dir)
+
+    assert _read(path) == DATA
+    first, second = _zip_requests(release_server)
+    assert first[1:] == (None, None, 200)
+    offset = int(second[1].split('=')[1].rstrip('-'))
+    assert 0 < offset < len(DATA)
+    assert second[1:] == (f"bytes={offset}-", release_server.etag, 206)
+    assert progress[-1] == 100
+    assert not os.path.exists(part_path) and not os.path.exists(part_path + '.json')
+
+
+def test_changed_etag_restarts_from_zero(release_server, served, monkeypatch):
+    url, download_dir, part_path = served
+    release_server.drops['/update.zip'] = 1
+    monkeypatch.setattr(updater, 'RETRIES', 0)
+    assert updater.download_update(url, lambda percent: None, download_dir=download_dir) is None
+    assert 0 < os.path.getsize(part_path) < len(DATA)
+
+    new_data = DATA[::-1]
+    release_server.files['/update.zip'] = new_data
+    release_server.files['/update.zip' + updater.CHECKSUM_SUFFIX] = _checksum(new_data)
+    old_etag, release_server.etag = release_server.etag, '"2"'
+
+    path = updater.download_update(url, lambda percent: None, download_dir=download_dir)
+
+    assert _read(path) == new_data
+    # The resume was asked for, but the server sent the new file whole.
+    resumed = _zip_requests(release_server)[-1]
+    assert resumed[1].startswith('bytes=') and resumed[2:] == (old_etag, 200)
+
+
+def test_missing_content_length(release_server, served):
+    url, download_dir, _ = served
+    release_server.send_length = False
+    progress = []
+
+    path = updater.download_update(url, progress.append, download_dir=download_dir)
+
+    assert _read(path) == DATA
+    assert progress == []
+
+
+def test_complete_part_file_gets_416(release_server, served):
+    url, download_dir, part_path = served
+    os.makedirs(download_dir)
+    with open(part_path, 'wb') as f:
+        f.write(DATA)
+    updater._write_journal(part_path + '.json', {'url': url, 'total': len(DATA), 'validator': release_server.etag})
+
+    path = updater.download_update(url, lambda percent: None, download_dir=download_dir)
+
+    assert _read(path) == DATA
+    assert [request[3] for request in _zip_requests(release_server)] == [416]
+
+
+def test_checksum_mismatch_discards_the_download(release_server, served):
+    url, download_dir, part_path = served
+    release_server.files['/update.zip' + updater.CHECKSUM_SUFFIX] = _checksum(b'something else')
+
+    assert updater.download_update(url, lambda percent: None, download_dir=download_dir) is None
+    assert not os.path.exists(part_path)
+    assert not os.path.exists(part_path + '.json')
+    assert not os.path.exists(os.path.join(download_dir, 'update.zip'))
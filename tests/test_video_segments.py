@@ -0,0 +1,55 @@
+"""Segment-parallel encodes must match a single-pass encode of the same clip."""
+import shutil
+import subprocess
+
+import pytest
+
+from ffmpeg_runner import FFMPEG
+from video_converter import convert_video
+
+pytestmark = pytest.mark.skipif(not shutil.which(FFMPEG), reason="ffmpeg is not on PATH")
+
+RATE = 25
+SECONDS = 12
+
+
+@pytest.fixture(scope='module')
+def clip(tmp_path_factory):
+    path = tmp_path_factory.mktemp('source') / 'clip.mp4'
+    subprocess.run([FFMPEG, '-v', 'error', '-y',
+                    '-f', 'lavfi', '-i', f"testsrc=size=320x240:rate={RATE}:duration={SECONDS}",
+                    '-f', 'lavfi', '-i', f"sine=frequency=440:duration={SECONDS}",
+                    '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(RATE),
+                    '-c:a', 'aac', '-shortest', str(path)], check=True)
+    return path
+
+
+def _packets(path, stream):
+    """(packet count, seconds from the first packet's start to the last one's end) of one stream."""
+    output = subprocess.run([FFMPEG, '-v', 'error', '-i', str(path), '-map', f'0:{stream}:0', '-c', 'copy',
+                             '-f', 'framecrc', '-'], check=True, capture_output=True, text=True).stdout
+    numerator, denominator = next(line for line in output.splitlines()
+                                  if line.startswith('#tb')).split(':')[1].strip().split('/')
+    packets = [line.split(',') for line in output.splitlines() if not line.startswith('#')]
+    start = min(int(fields[2]) for fields in packets)
+    end = max(int(fields[2]) + int(fields[3]) for fields in packets)
+    return len(packets), (end - start) * int(numerator) / int(denominator)
+
+
+def _encode(clip, output_dir, segments):
+    result = convert_video(str(clip), str(output_dir), 'mp4',
+                           {'video_codec': 'libx264', 'preset': 'ultrafast', 'segments': segments})
+    assert result, result.error
+    assert result.params['segments'] == segments
+    return _packets(result.output_path, 'v'), _packets(result.output_path, 'a')
+
+
+@pytest.mark.parametrize('segments', [2, 3])
+def test_segmented_encode_matches_single_pass(clip, tmp_path, segments):
+    (single_frames, single_video), (_, single_audio) = _encode(clip, tmp_path / 'single', 1)
+    (split_frames, split_video), (_, split_audio) = _encode(clip, tmp_path / 'split', segments)
+
+    assert single_frames == RATE * SECONDS
+    assert split_frames == single_frames
+    assert split_video == pytest.approx(single_video, abs=1 / RATE)
+    assert split_audio == pytest.approx(single_audio, abs=1 / RATE)
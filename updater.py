@@ -1,13 +1,34 @@
 
 import os
 import sys
-import requests
-from packaging import version
+import json
+import time
+import shutil
+import tempfile
+from urllib.parse import urlsplit
+
+from delta_update import DeltaUnavailable, fetch_delta, file_sha256
+
+# requests and packaging are imported inside the functions that use them:
+# together they are the slowest part of the GUI's import, and the update
+# check only runs once the window is up.
 
 # The owner and repository name of your GitHub project.
 OWNER = "joaomagdaleno"
 REPO = "UniversalConverter"
 
+# Update downloads: the checksum asset published with each zip, where
+# partial downloads are kept between attempts, and how they are fetched.
+CHECKSUM_SUFFIX = ".sha256"
+DOWNLOAD_DIR = "UniversalConverter-update"
+CONNECT_TIMEOUT = 10     # seconds
+READ_TIMEOUT = 30        # seconds without data before the attempt is retried
+RETRIES = 5
+BACKOFF_SECONDS = 1      # doubled after every failed attempt
+MIN_CHUNK = 64 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+CHUNK_SECONDS = 0.25     # target time per chunk read
+
 def get_current_version():
     """Reads the version from the VERSION.txt file."""
     if getattr(sys, 'frozen', False):
@@ -35,6 +56,9 @@ def check_for_updates():
         latest_version_str (str): The latest version number, or None if an error occurred.
         download_url (str): The direct URL for the release asset, or None.
     """
+    import requests
+    from packaging import version
+
     current_v_str = get_current_version()
     url = f"https://api.github.com/repos/{OWNER}/{REPO}/releases/latest"
 
@@ -58,26 +82,193 @@ def check_for_updates():
 
     return False, None, None
 
-import tempfile
+def download_update(url, progress_callback, checksum_url=None, download_dir=None):
+    """
+    Downloads the update file, resuming an earlier partial download of the
+    same URL, and verifies it against the release's SHA-256 checksum.
+
+    The file is written to `<name>.part` next to a small journal
+    (`<name>.part.json`) recording the URL and the server's ETag or
+    Last-Modified. After a dropped connection, and on the next attempt if
+    the app was closed, the download continues from the end of the .part
+    file with an HTTP Range request; If-Range makes the server send the
+    whole file instead if it has changed. Failed attempts are retried
+    RETRIES times with exponential backoff. Chunks grow or shrink so that
+    each takes about CHUNK_SECONDS to arrive.
+
+    Args:
+        url (str): URL of the update zip.
+        progress_callback (callable): Called with the percentage done, when
+            the server reports the size.
+        checksum_url (str): URL of the checksum file, in `sha256sum` format;
+            defaults to `url` + CHECKSUM_SUFFIX, the asset the release
+            workflow publishes next to the zip.
+        download_dir (str): Where to keep the download; defaults to
+            DOWNLOAD_DIR in the system temporary directory.
+
+    Returns:
+        The path of the verified file, or None if the download failed or the
+        file does not match its checksum.
+    """
+    import requests
+    from urllib3.exceptions import HTTPError
+
+    download_dir = download_dir or os.path.join(tempfile.gettempdir(), DOWNLOAD_DIR)
+    os.makedirs(download_dir, exist_ok=True)
+    file_path = os.path.join(download_dir, os.path.basename(urlsplit(url).path) or 'update.zip')
+    part_path = file_path + '.part'
+    journal_path = part_path + '.json'
 
-def download_update(url, progress_callback):
-    """Downloads the update file and reports progress."""
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
+        expected = _fetch_checksum(checksum_url or url + CHECKSUM_SUFFIX)
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            time.sleep(BACKOFF_SECONDS * 2 ** (attempt - 1))
+        try:
+            if _download_part(url, part_path, journal_path, progress_callback):
+                break
+        except (requests.exceptions.RequestException, HTTPError, OSError):
+            continue
+    else:
+        return None
+
+    if file_sha256(part_path) != expected:
+        # A corrupt or tampered file must not be resumed from either.
+        _remove(part_path, journal_path)
+        return None
+    os.replace(part_path, file_path)
+    _remove(journal_path)
+    return file_path
+
+
+def download_delta(url, progress_callback, install_dir, download_dir=None):
+    """
+    Fetches only the files of the release zip at `url` that differ from the
+    install in `install_dir` (see delta_update).
+
+    Args:
+        url (str): URL of the update zip.
+        progress_callback (callable): Called with the percentage done.
+        install_dir (str): The folder of the running installation.
+        download_dir (str): Where to stage the files; defaults to
+            DOWNLOAD_DIR in the system temporary directory.
+
+    Returns:
+        The staging folder to pass to install_update.py, or None if a delta
+        update is not possible and the full zip should be downloaded instead.
+    """
+    import requests
+    from urllib3.exceptions import HTTPError
+
+    download_dir = download_dir or os.path.join(tempfile.gettempdir(), DOWNLOAD_DIR)
+    staging_dir = os.path.join(download_dir, (os.path.basename(urlsplit(url).path) or 'update.zip') + '.delta')
+    try:
+        return fetch_delta(url, install_dir, staging_dir, progress_callback,
+                           timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    except (DeltaUnavailable, requests.exceptions.RequestException, HTTPError, OSError, ValueError):
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return None
+
+
+def _fetch_checksum(checksum_url):
+    """The hex digest from a `sha256sum`-style file ("<digest>  <name>")."""
+    import requests
 
-        total_size = int(response.headers.get('content-length', 0))
-        temp_dir = tempfile.mkdtemp()
-        file_path = os.path.join(temp_dir, 'update.zip')
+    response = requests.get(checksum_url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    response.raise_for_status()
+    fields = response.text.split()
+    if not fields or len(fields[0]) != 64:
+        raise ValueError(f"Not a SHA-256 checksum file: {checksum_url}")
+    return fields[0].lower()
 
-        with open(file_path, 'wb') as f:
-            downloaded = 0
-            for chunk in response.iter_content(chunk_size=8192):
+
+def _download_part(url, part_path, journal_path, progress_callback):
+    """
+    Fetches what is missing from `part_path`. Returns True when the file is
+    complete, False if the connection ended early.
+    """
+    import requests
+
+    journal = _read_journal(journal_path)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {}
+    if offset and journal.get('url') == url and journal.get('validator'):
+        headers = {'Range': f'bytes={offset}-', 'If-Range': journal['validator']}
+
+    with requests.get(url, stream=True, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+        if response.status_code == 416:
+            if journal.get('total') == offset:
+                return True  # The previous attempt got everything.
+            _remove(part_path, journal_path)
+            return False
+        response.raise_for_status()
+        if response.status_code == 206:
+            start, total = _content_range(response.headers.get('content-range'))
+            if start != offset:
+                _remove(part_path, journal_path)
+                return False
+        else:
+            offset = 0  # No usable partial file, or the server ignored the Range.
+            length = response.headers.get('content-length')
+            total = int(length) if length and 'content-encoding' not in response.headers else None
+            _write_journal(journal_path, {
+                'url': url, 'total': total,
+                'validator': response.headers.get('etag') or response.headers.get('last-modified'),
+            })
+
+        downloaded = offset
+        chunk_size = MIN_CHUNK
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            while True:
+                started = time.monotonic()
+                chunk = response.raw.read(chunk_size, decode_content=True)
+                if not chunk:
+                    break
                 f.write(chunk)
                 downloaded += len(chunk)
-                progress = int(100 * downloaded / total_size)
-                progress_callback(progress)
+                if total:
+                    progress_callback(min(100, int(100 * downloaded / total)))
+                elapsed = time.monotonic() - started
+                if elapsed < CHUNK_SECONDS / 2:
+                    chunk_size = min(MAX_CHUNK, chunk_size * 2)
+                elif elapsed > CHUNK_SECONDS * 2:
+                    chunk_size = max(MIN_CHUNK, chunk_size // 2)
 
-        return file_path
-    except requests.exceptions.RequestException:
-        return None
+    if total is None:
+        _write_journal(journal_path, {**_read_journal(journal_path), 'total': downloaded})
+        return True
+    return downloaded >= total
+
+
+def _content_range(header):
+    """(first byte, total size or None) from a Content-Range header such as 'bytes 100-199/1000'."""
+    try:
+        _, spec = header.split(' ', 1)
+        span, total = spec.split('/')
+        return int(span.split('-')[0]), None if total == '*' else int(total)
+    except (AttributeError, ValueError):
+        return None, None
+
+
+def _read_journal(journal_path):
+    try:
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_journal(journal_path, journal):
+    with open(journal_path, 'w', encoding='utf-8') as f:
+        json.dump(journal, f)
+
+
+def _remove(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
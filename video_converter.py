@@ -1,61 +1,150 @@
 import os
-import subprocess
+import shutil
+import tempfile
 
-def convert_video(input_path, output_dir, to_format, settings=None):
+from ffmpeg_runner import run_ffmpeg, probe, scaled_progress, FFmpegError
+from video_segments import segment_count, encode_segmented
+from conversion_result import ConversionResult
+from output_writer import reserve
+from video_profiles import (
+    resolve_profile, plan_stream_copy, video_codec_args, rate_control_args, audio_codec_args, is_two_pass
+)
+
+# Target format -> FFmpeg muxer, for the first pass of a two-pass encode.
+MUXERS = {'mp4': 'mp4', 'mov': 'mov', 'mkv': 'matroska', 'webm': 'webm'}
+
+def convert_video(input_path, output_dir, to_format, settings=None, cache=None,
+                  progress_callback=None, cancel_event=None):
     """
     Converts a video file to a different format using FFmpeg.
 
     :param input_path: Path to the input video file.
     :param output_dir: Directory to save the converted file.
     :param to_format: The target video format (e.g., 'mp4', 'webm').
-    :param settings: A dictionary of conversion settings. Expected keys: 'resolution', 'quality'.
+    :param settings: A dictionary of conversion settings: 'resolution', plus a named 'profile'
+        and/or any of the encoding keys described in video_profiles, and 'segments'
+        (a count or 'auto') to encode long inputs as parallel pieces, and 'if_exists'
+        (see output_writer).
+    :param cache: Optional ConversionCache; a hit skips FFmpeg entirely.
+    :param progress_callback: Called while encoding with a dict holding 'percent', 'eta',
+        'frame', 'out_time', 'speed' and 'bitrate' (see ffmpeg_runner.build_progress).
+    :param cancel_event: A threading.Event; setting it stops FFmpeg and removes the partial output.
+    :return: A ConversionResult; truthy on success, with the resolved profile and FFmpeg arguments.
     """
     if settings is None:
         settings = {}
     to_format_lower = to_format.lower()
+    result = ConversionResult(input_path)
 
     try:
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        base_name = os.path.splitext(os.path.basename(input_path))[0]
-        output_path = os.path.join(output_dir, f"{base_name}.{to_format_lower}")
-
-        i = 1
-        while os.path.exists(output_path):
-            output_path = os.path.join(output_dir, f"{base_name}-{i}.{to_format_lower}")
-            i += 1
-
-        # Build the FFmpeg command
-        command = ['ffmpeg', '-i', input_path]
-
-        # --- Apply settings ---
-        resolution = settings.get('resolution')
-        if resolution and resolution != "Manter original":
-            height = resolution.replace('p', '')
-            command.extend(['-vf', f'scale=-2:{height}'])
-
-        quality = settings.get('quality')
-        if quality:
-            # CRF values: Lower is better quality, higher is smaller size.
-            # These are just example values, they can be tuned.
-            if quality == "Alta":
-                command.extend(['-crf', '18'])
-            elif quality == "Média":
-                command.extend(['-crf', '23'])
-            elif quality == "Baixa":
-                command.extend(['-crf', '28'])
-
-        command.append(output_path)
-
-        # Execute the command
-        subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        return True
-    except subprocess.CalledProcessError as e:
+        with reserve(input_path, output_dir, to_format_lower, settings.get('if_exists')) as output:
+            result.output_path = output.path
+            if output.existing:
+                result.skipped = True
+                return result.succeed()
+            # FFmpeg writes under a temporary name, renamed into place once it succeeds.
+            output_path = output.temp_path
+
+            profile = resolve_profile(to_format_lower, settings)
+
+            # Key on the resolved profile, so editing a saved profile invalidates its entries.
+            with result.stage('cache'):
+                cache_key = cache.key(input_path, to_format_lower, {**settings, **profile}) if cache else None
+                result.cached = bool(cache_key and cache.fetch(cache_key, to_format_lower, output_path))
+            if result.cached:
+                output.commit()
+                return result.succeed()
+
+            duration = None
+            has_audio = True
+            try:
+                with result.stage('probe'):
+                    info = probe(input_path)
+                has_audio = any(s.get('codec_type') == 'audio' for s in info.get('streams', []))
+                profile = plan_stream_copy(info.get('streams', []), to_format_lower, settings, profile)
+                duration = float(info.get('format', {}).get('duration', 'nan'))
+                duration = duration if duration == duration else None
+            except (OSError, FFmpegError, ValueError):
+                # No ffprobe or an unreadable header: re-encode everything and let
+                # FFmpeg report a broken input itself.
+                pass
+
+            # --- Apply settings ---
+            filters = []
+            resolution = settings.get('resolution')
+            if resolution and resolution != "Manter original":
+                if profile['video_codec'] == 'copy':
+                    raise ValueError("Changing the resolution requires re-encoding the video")
+                height = resolution.replace('p', '')
+                filters = ['-vf', f'scale=-2:{height}']
+
+            encode_args = filters + video_codec_args(profile) + rate_control_args(profile)
+
+            # Execute the command, streaming progress as FFmpeg encodes
+            segments = segment_count(settings, profile, duration)
+            result.codec = profile['video_codec']
+            result.params = {**profile, 'args': encode_args + audio_codec_args(profile), 'segments': segments}
+            with result.stage('encode'):
+                if segments > 1:
+                    completed = encode_segmented(input_path, output_path, segments, encode_args,
+                                                 audio_codec_args(profile), duration, has_audio,
+                                                 progress_callback, cancel_event)
+                elif is_two_pass(profile):
+                    completed = _encode_two_pass(input_path, output_path, to_format_lower, profile, encode_args,
+                                                 duration, progress_callback, cancel_event)
+                else:
+                    command = ['-i', input_path] + encode_args + audio_codec_args(profile) + [output_path]
+                    completed = run_ffmpeg(command, duration=duration, progress_callback=progress_callback,
+                                           cancel_event=cancel_event)
+
+            if not completed:
+                print(f"Conversion of {input_path} cancelled.")
+                return result.fail(cancelled=True)
+            output.commit()
+
+        if cache_key:
+            with result.stage('cache'):
+                cache.store(cache_key, to_format_lower, output.path)
+
+        return result.succeed()
+    except FFmpegError as e:
         print(f"Error converting {input_path} to {to_format}:")
-        print(f"FFmpeg stderr: {e.stderr.decode('utf-8')}")
-        return False
+        print(f"FFmpeg stderr: {e.stderr}")
+        return result.fail(e)
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-        return False
+        return result.fail(e)
+
+
+def _pass_args(profile, pass_number, log_prefix):
+    if profile['video_codec'] == 'libx265':
+        # libx265 ignores -pass; it takes its multi-pass options through x265-params.
+        return ['-x265-params', f"pass={pass_number}:stats={log_prefix}.log"]
+    return ['-pass', str(pass_number), '-passlogfile', log_prefix]
+
+
+def _encode_two_pass(input_path, output_path, to_format, profile, encode_args, duration,
+                     progress_callback, cancel_event):
+    """
+    Two-pass bitrate targeting: the first pass only writes encoder statistics,
+    the second uses them to distribute the bitrate budget across the file.
+
+    The first pass goes through the target muxer (into the null device), not
+    `-f null`: the muxer decides the frame timing, and libx264 refuses a
+    stats file written for a different frame count than the second pass sees.
+    """
+    log_dir = tempfile.mkdtemp(prefix='uc-2pass-')
+    log_prefix = os.path.join(log_dir, 'ffmpeg2pass')
+    try:
+        first = (['-y', '-i', input_path] + encode_args + _pass_args(profile, 1, log_prefix)
+                 + ['-an', '-f', MUXERS.get(to_format, 'matroska'), os.devnull])
+        if not run_ffmpeg(first, duration=duration, progress_callback=scaled_progress(progress_callback, 0, 50),
+                          cancel_event=cancel_event):
+            return False
+
+        second = (['-i', input_path] + encode_args + _pass_args(profile, 2, log_prefix)
+                  + audio_codec_args(profile) + [output_path])
+        return run_ffmpeg(second, duration=duration, progress_callback=scaled_progress(progress_callback, 50, 50),
+                          cancel_event=cancel_event)
+    finally:
+        shutil.rmtree(log_dir, ignore_errors=True)
@@ -0,0 +1,261 @@
+"""
+Named video encoding profiles and their translation into FFmpeg arguments.
+
+A profile is a plain dict using the same keys as the `settings` passed to
+convert_video, so a profile can be saved from the GUI, passed by name from
+the command line, or partially overridden by explicit settings:
+
+    video_codec   libx264, libx265, libvpx-vp9, libaom-av1 or copy
+    audio_codec   aac, libopus, libvorbis, libmp3lame or copy
+    preset        speed preset, from 'ultrafast' to 'veryslow'
+    tune          x264/x265 tuning (film, animation, grain, ...)
+    threads       encoder thread count, 0 lets FFmpeg decide
+    quality       CRF on the x264 scale (0-51), or 'Alta' / 'Média' / 'Baixa'
+    video_bitrate target bitrate in kbps; replaces CRF when set
+    two_pass      run a first analysis pass (only with video_bitrate)
+    audio_bitrate audio bitrate in kbps
+
+plus 'stream_copy', which controls the remux fast path (see plan_stream_copy).
+"""
+import os
+import json
+
+from app_paths import config_dir
+
+PROFILES_FILE = 'video_profiles.json'
+
+SPEED_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow']
+TUNES = ['film', 'animation', 'grain', 'stillimage', 'fastdecode', 'zerolatency']
+
+# Codecs each container can hold; the first entry is the default.
+VIDEO_CODECS = {
+    'mp4': ['libx264', 'libx265', 'libaom-av1', 'copy'],
+    'mov': ['libx264', 'libx265', 'copy'],
+    'mkv': ['libx264', 'libx265', 'libvpx-vp9', 'libaom-av1', 'copy'],
+    'webm': ['libvpx-vp9', 'libaom-av1', 'copy'],
+}
+AUDIO_CODECS = {
+    'mp4': ['aac', 'libmp3lame', 'copy'],
+    'mov': ['aac', 'copy'],
+    'mkv': ['aac', 'libopus', 'libvorbis', 'libmp3lame', 'copy'],
+    'webm': ['libopus', 'libvorbis', 'copy'],
+}
+
+# Codec names (as reported by ffprobe) that each container can hold as-is,
+# i.e. streams that can be remuxed with -c copy instead of re-encoded.
+# Matroska accepts practically anything, so it has no list.
+COPYABLE_CODECS = {
+    'mp4': {
+        'video': {'h264', 'hevc', 'av1', 'vp9', 'mpeg4'},
+        'audio': {'aac', 'mp3', 'ac3', 'eac3', 'opus', 'flac', 'alac'},
+    },
+    'mov': {
+        'video': {'h264', 'hevc', 'mpeg4', 'prores', 'mjpeg'},
+        'audio': {'aac', 'mp3', 'ac3', 'alac', 'pcm_s16le', 'pcm_s24le'},
+    },
+    'webm': {
+        'video': {'vp8', 'vp9', 'av1'},
+        'audio': {'opus', 'vorbis'},
+    },
+}
+
+# Settings that ask for a particular video or audio encode; when any is given
+# (and stream_copy is not forced on), the stream is re-encoded as requested.
+VIDEO_ENCODE_KEYS = ['profile', 'video_codec', 'preset', 'tune', 'quality', 'video_bitrate', 'two_pass']
+AUDIO_ENCODE_KEYS = ['profile', 'audio_codec', 'audio_bitrate']
+
+QUALITY_LABELS = {"Alta": 18, "Média": 23, "Baixa": 28}
+
+BUILTIN_PROFILES = {
+    "Rápido (H.264)": {'video_codec': 'libx264', 'preset': 'veryfast', 'quality': 23},
+    "Equilibrado (H.264)": {'video_codec': 'libx264', 'preset': 'medium', 'quality': 23},
+    "Arquivo (H.265)": {'video_codec': 'libx265', 'preset': 'slow', 'quality': 22},
+    "Web (VP9)": {'video_codec': 'libvpx-vp9', 'preset': 'fast', 'quality': 28},
+}
+
+PROFILE_KEYS = ['video_codec', 'audio_codec', 'preset', 'tune', 'threads',
+                'quality', 'video_bitrate', 'two_pass', 'audio_bitrate']
+
+
+def _profiles_path():
+    return os.path.join(config_dir(), PROFILES_FILE)
+
+
+def load_user_profiles():
+    try:
+        with open(_profiles_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def list_profiles():
+    """Names of all profiles, built-in ones first."""
+    return list(BUILTIN_PROFILES) + [name for name in load_user_profiles() if name not in BUILTIN_PROFILES]
+
+
+def load_profile(name):
+    profiles = {**BUILTIN_PROFILES, **load_user_profiles()}
+    if name not in profiles:
+        raise KeyError(f"Unknown video profile: {name}")
+    return dict(profiles[name])
+
+
+def save_profile(name, profile):
+    """Saves a user profile; only the known profile keys are kept."""
+    profiles = load_user_profiles()
+    profiles[name] = {key: profile[key] for key in PROFILE_KEYS if profile.get(key) not in (None, '')}
+    with open(_profiles_path(), 'w', encoding='utf-8') as f:
+        json.dump(profiles, f, indent=2, ensure_ascii=False)
+
+
+def delete_profile(name):
+    profiles = load_user_profiles()
+    if profiles.pop(name, None) is not None:
+        with open(_profiles_path(), 'w', encoding='utf-8') as f:
+            json.dump(profiles, f, indent=2, ensure_ascii=False)
+
+
+def resolve_profile(to_format, settings):
+    """
+    Merges the named profile (settings['profile']) with explicit settings and
+    fills in the container's default codecs.
+    """
+    profile = load_profile(settings['profile']) if settings.get('profile') else {}
+    for key in PROFILE_KEYS:
+        if settings.get(key) not in (None, ''):
+            profile[key] = settings[key]
+
+    container = to_format.lower()
+    video_codecs = VIDEO_CODECS.get(container, VIDEO_CODECS['mkv'])
+    audio_codecs = AUDIO_CODECS.get(container, AUDIO_CODECS['mkv'])
+    profile.setdefault('video_codec', video_codecs[0])
+    profile.setdefault('audio_codec', audio_codecs[0])
+    if profile['video_codec'] not in video_codecs:
+        raise ValueError(f"{profile['video_codec']} cannot be stored in a {container} file")
+    if profile['audio_codec'] not in audio_codecs:
+        raise ValueError(f"{profile['audio_codec']} cannot be stored in a {container} file")
+    return profile
+
+
+def can_copy(codec_name, stream_type, container):
+    allowed = COPYABLE_CODECS.get(container)
+    if allowed is None:
+        return container == 'mkv'
+    return codec_name in allowed[stream_type]
+
+
+def plan_stream_copy(streams, to_format, settings, profile):
+    """
+    Switches the profile to '-c copy' for every stream that can be remuxed.
+
+    settings['stream_copy'] decides when copying is allowed:
+      'auto' (default) - copy a stream only if no encoding setting for it was given;
+      True             - copy whenever the container allows it, ignoring quality/preset;
+      False            - always re-encode.
+    A resolution change always forces the video to be re-encoded. Streams that
+    cannot be copied keep the profile's encoder, e.g. copy H.264 video and
+    transcode PCM audio to AAC.
+
+    :param streams: ffprobe's 'streams' list for the input.
+    :return: The (possibly) modified profile.
+    """
+    mode = settings.get('stream_copy', 'auto')
+    if mode is False or mode in ('never', 'false'):
+        return profile
+    force = mode is True
+
+    container = to_format.lower()
+    video = [s['codec_name'] for s in streams if s.get('codec_type') == 'video' and s.get('codec_name')]
+    audio = [s['codec_name'] for s in streams if s.get('codec_type') == 'audio' and s.get('codec_name')]
+    resolution = settings.get('resolution')
+    resizing = bool(resolution) and resolution != "Manter original"
+
+    profile = dict(profile)
+    wants_video_encode = any(settings.get(key) not in (None, '', False) for key in VIDEO_ENCODE_KEYS)
+    if (video and not resizing and (force or not wants_video_encode)
+            and all(can_copy(codec, 'video', container) for codec in video)):
+        profile['video_codec'] = 'copy'
+        profile['copied_video'] = video[0]
+
+    wants_audio_encode = any(settings.get(key) not in (None, '', False) for key in AUDIO_ENCODE_KEYS)
+    if (audio and (force or not wants_audio_encode)
+            and all(can_copy(codec, 'audio', container) for codec in audio)):
+        profile['audio_codec'] = 'copy'
+    return profile
+
+
+def crf_value(quality):
+    """Returns the x264-scale CRF for a quality setting, or None."""
+    if quality in QUALITY_LABELS:
+        return QUALITY_LABELS[quality]
+    try:
+        return max(0, min(51, int(quality)))
+    except (TypeError, ValueError):
+        return None
+
+
+def _cpu_used(preset, fastest):
+    """Maps an x264 speed preset to libvpx/libaom's -cpu-used scale (0 = slowest)."""
+    index = SPEED_PRESETS.index(preset)
+    return round(fastest * (len(SPEED_PRESETS) - 1 - index) / (len(SPEED_PRESETS) - 1))
+
+
+def video_codec_args(profile):
+    """FFmpeg arguments selecting and tuning the video encoder (no rate control)."""
+    codec = profile['video_codec']
+    args = ['-c:v', codec]
+    if codec == 'copy':
+        if profile.get('copied_video') == 'hevc':
+            # Apple players only accept copied HEVC with the hvc1 sample entry.
+            args += ['-tag:v', 'hvc1']
+        return args
+
+    preset = profile.get('preset')
+    if preset and preset not in SPEED_PRESETS:
+        raise ValueError(f"Unknown speed preset: {preset}")
+
+    if codec in ('libx264', 'libx265'):
+        if preset:
+            args += ['-preset', preset]
+        if profile.get('tune'):
+            args += ['-tune', profile['tune']]
+    elif codec == 'libvpx-vp9':
+        # VP9 has no named presets; 'good' deadline with cpu-used 0-5 is the
+        # equivalent speed/quality dial. row-mt lets it actually use the threads.
+        args += ['-deadline', 'good', '-cpu-used', str(_cpu_used(preset or 'medium', 5)), '-row-mt', '1']
+    elif codec == 'libaom-av1':
+        args += ['-cpu-used', str(_cpu_used(preset or 'medium', 8)), '-row-mt', '1']
+
+    threads = profile.get('threads')
+    if threads not in (None, ''):
+        args += ['-threads', str(int(threads))]
+    return args
+
+
+def rate_control_args(profile):
+    """CRF or target-bitrate arguments for the video encoder."""
+    codec = profile['video_codec']
+    if codec == 'copy':
+        return []
+    if profile.get('video_bitrate'):
+        return ['-b:v', f"{int(profile['video_bitrate'])}k"]
+
+    crf = crf_value(profile.get('quality'))
+    if crf is None:
+        return []
+    if codec in ('libvpx-vp9', 'libaom-av1'):
+        # These use a 0-63 CRF scale and need -b:v 0 for constant quality mode.
+        return ['-crf', str(round(crf * 63 / 51)), '-b:v', '0']
+    return ['-crf', str(crf)]
+
+
+def audio_codec_args(profile):
+    args = ['-c:a', profile['audio_codec']]
+    if profile['audio_codec'] != 'copy' and profile.get('audio_bitrate'):
+        args += ['-b:a', f"{int(str(profile['audio_bitrate']).rstrip('kK'))}k"]
+    return args
+
+
+def is_two_pass(profile):
+    return bool(profile.get('two_pass')) and bool(profile.get('video_bitrate')) and profile['video_codec'] != 'copy'
@@ -0,0 +1,163 @@
+"""
+Segment-parallel video encoding for long inputs.
+
+One FFmpeg encode of a single long file rarely keeps every core busy. Here
+the video stream is cut at keyframes into N pieces (stream copy, so this is
+cheap), the pieces are encoded concurrently, and the results are joined with
+the concat demuxer. Audio is encoded once, from the whole input, alongside
+the video pieces and muxed back in at the end, so there are no audio gaps or
+drift at the joins.
+"""
+import os
+import time
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ffmpeg_runner import run_ffmpeg
+
+# Inputs shorter than this are not worth splitting in 'auto' mode.
+AUTO_MIN_DURATION = 120
+# Each segment should carry at least this many seconds in 'auto' mode.
+AUTO_MIN_SEGMENT = 30
+
+
+def segment_count(settings, profile, duration):
+    """
+    Number of segments to encode in parallel, or 1 for a normal encode.
+
+    settings['segments'] is an explicit count, or 'auto' to pick one from the
+    CPU count and the input duration. Stream copy, two-pass encoding and
+    inputs of unknown duration always use a single encode.
+    """
+    requested = settings.get('segments')
+    if not requested or profile['video_codec'] == 'copy' or profile.get('two_pass') or not duration:
+        return 1
+    cpus = os.cpu_count() or 1
+    if requested == 'auto':
+        if duration < AUTO_MIN_DURATION:
+            return 1
+        return max(1, min(cpus // 2, int(duration // AUTO_MIN_SEGMENT)))
+    return max(1, int(requested))
+
+
+def encode_segmented(input_path, output_path, segments, video_args, audio_args, duration,
+                     has_audio=True, progress_callback=None, cancel_event=None):
+    """
+    Encodes `input_path` into `output_path` as `segments` concurrent pieces.
+
+    :param video_args: Video filter/encoder/rate-control arguments (from video_profiles).
+    :param audio_args: Audio encoder arguments, e.g. ['-c:a', 'aac'].
+    :param duration: Input duration in seconds; used to size the segments.
+    :param has_audio: Whether the input has an audio stream to carry over.
+    :return: True on success, False if cancelled.
+    :raises FFmpegError: If any of the FFmpeg steps fails.
+    """
+    # Keep the pieces next to the output so the final mux does not cross filesystems.
+    work_dir = tempfile.mkdtemp(prefix='.segments-', dir=os.path.dirname(output_path) or '.')
+    stop = threading.Event()
+    bridge = _bridge_cancel(cancel_event, stop)
+    try:
+        # 1. Split the video stream at keyframes, without re-encoding.
+        split = ['-i', input_path, '-map', '0:v:0', '-c', 'copy', '-f', 'segment',
+                 '-segment_time', f"{duration / segments:.3f}", '-reset_timestamps', '1',
+                 os.path.join(work_dir, 'src_%04d.mkv')]
+        if not run_ffmpeg(split, cancel_event=stop):
+            return False
+        pieces = sorted(name for name in os.listdir(work_dir) if name.startswith('src_'))
+
+        # 2. Encode every piece, plus the full audio track, concurrently.
+        # Split the cores between pieces unless the profile fixed a thread count.
+        if '-threads' not in video_args:
+            video_args = video_args + ['-threads', str(max(1, (os.cpu_count() or 1) // len(pieces)))]
+
+        tracker = _SegmentProgress(duration, len(pieces), progress_callback)
+        tasks = []
+        for index, name in enumerate(pieces):
+            encoded = os.path.join(work_dir, name.replace('src_', 'enc_'))
+            tasks.append((['-i', os.path.join(work_dir, name), '-an'] + video_args + [encoded], index))
+        audio_path = os.path.join(work_dir, 'audio.mka')
+        if has_audio:
+            tasks.append((['-i', input_path, '-vn', '-sn'] + audio_args + [audio_path], len(pieces)))
+
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            futures = [executor.submit(_run_piece, args, index, tracker, stop) for args, index in tasks]
+            results = []
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception:
+                    stop.set()  # One piece failed: stop the others, then re-raise.
+                    raise
+        if not all(results):
+            return False
+
+        # 3. Join the encoded pieces and mux the audio back in.
+        list_path = os.path.join(work_dir, 'pieces.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for name in pieces:
+                f.write(f"file '{name.replace('src_', 'enc_')}'\n")
+
+        concat = ['-f', 'concat', '-safe', '0', '-i', list_path]
+        if has_audio:
+            concat += ['-i', audio_path, '-map', '0:v', '-map', '1:a']
+        concat += ['-c', 'copy', output_path]
+        return run_ffmpeg(concat, cancel_event=stop)
+    finally:
+        stop.set()
+        bridge.join()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _run_piece(args, index, tracker, stop):
+    return run_ffmpeg(args, progress_callback=tracker.callback(index), cancel_event=stop)
+
+
+def _bridge_cancel(cancel_event, stop):
+    """Forwards an external cancel request to the internal stop event until `stop` is set."""
+    def watch():
+        while not stop.is_set():
+            if cancel_event is not None and cancel_event.is_set():
+                stop.set()
+            stop.wait(0.2)
+    thread = threading.Thread(target=watch, daemon=True)
+    thread.start()
+    return thread
+
+
+class _SegmentProgress:
+    """
+    Sums the encoded time of all video pieces into one progress dict. The
+    audio task runs alongside but is not counted; it is much faster.
+    """
+
+    def __init__(self, duration, pieces, callback):
+        self.duration = duration
+        self.done = [0.0] * pieces
+        self.callback_fn = callback
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def callback(self, index):
+        if self.callback_fn is None or index >= len(self.done):
+            return None
+
+        def report(progress):
+            with self.lock:
+                if progress.get('out_time') is not None:
+                    self.done[index] = progress['out_time']
+                encoded = min(sum(self.done), self.duration)
+                elapsed = time.monotonic() - self.started
+                fraction = encoded / self.duration
+                eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+                self.callback_fn({
+                    'frame': None,
+                    'fps': None,
+                    'bitrate': None,
+                    'out_time': encoded,
+                    'speed': encoded / elapsed if elapsed > 0 else None,
+                    'percent': min(99, int(100 * fraction)),
+                    'eta': eta,
+                })
+        return report
@@ -0,0 +1,428 @@
+"""
+Watch-folder mode: converts files as they arrive in an inbox folder.
+
+    python -m watch --config rules.json
+    python -m watch ~/inbox -t mp3 -o ~/converted
+
+The rules file says what to do with each kind of file:
+
+    {
+      "inbox": "/srv/inbox",
+      "recursive": true,
+      "done_dir": "/srv/inbox-done",
+      "rules": [
+        {"pattern": "*.wav", "to": "mp3", "output_dir": "/srv/mp3", "settings": {"bitrate": "192"}},
+        {"media": "image", "to": "webp", "output_dir": "/srv/web", "settings": {"quality": 80}},
+        {"media": "video", "to": "mp4", "output_dir": "/srv/video"}
+      ]
+    }
+
+A file goes to the first rule whose `pattern` (matched against its path
+relative to the inbox, and against its name) and `media` (what discovery
+recognises from its content) both match, and whose converter can read it.
+Converted inputs are moved to `done_dir` if one is given.
+
+Changes are picked up from inotify/FSEvents/ReadDirectoryChangesW events
+when the optional `watchdog` package is installed, with a full rescan
+every RESCAN_SECONDS to catch missed events, and by rescanning every
+POLL_SECONDS otherwise. A file is converted once its size and modification
+time have not changed for SETTLE_SECONDS, so files still being copied in
+are left alone, and a burst of files is submitted together.
+
+Conversions run on a JobQueue with its own queue file, under the usual
+per-type limits and resource budget; at most MAX_BACKLOG jobs are waiting
+in it at a time, and further ready files are held until it drains. Which
+files were handled (and at which size and mtime) is kept in a state file
+in the config directory, so a restart neither converts them again nor
+loses jobs that had not finished.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import fnmatch
+import hashlib
+import argparse
+import tempfile
+import threading
+import queue as queue_module
+from collections import namedtuple
+
+from app_paths import config_dir
+from batch import Job, media_type_for_format, default_workers
+from discovery import ACCEPTED_SOURCES, detect, walk
+from job_queue import JobQueue
+from output_writer import TEMP_PREFIX
+from scheduler import ResourceBudget, MB
+
+POLL_SECONDS = 1.0
+RESCAN_SECONDS = 60.0
+SETTLE_SECONDS = 2.0
+TICK_SECONDS = 0.25
+MAX_BACKLOG = 32
+STATE_VERSION = 1
+
+Rule = namedtuple('Rule', ['pattern', 'media', 'to_format', 'output_dir', 'settings'])
+
+# How a file was handled. Files no rule matched are only remembered until
+# the watcher stops, so that they are looked at again if the rules change.
+CONVERTED, FAILED, EXISTING, IGNORED = 'converted', 'failed', 'existing', 'ignored'
+
+
+def load_rules(config):
+    """
+    The Rule list of a parsed config.
+
+    :raises ValueError: If a rule has no valid target format or output folder.
+    """
+    rules = []
+    for number, item in enumerate(config.get('rules', []), 1):
+        to_format = str(item.get('to', '')).lower()
+        if media_type_for_format(to_format) is None:
+            raise ValueError(f"Rule {number}: unsupported target format: {item.get('to')!r}")
+        if item.get('media') not in (None, 'image', 'audio', 'video'):
+            raise ValueError(f"Rule {number}: unknown media type: {item['media']!r}")
+        output_dir = item.get('output_dir') or config.get('output_dir')
+        if not output_dir:
+            raise ValueError(f"Rule {number}: no output_dir")
+        rules.append(Rule(item.get('pattern'), item.get('media'), to_format,
+                          os.path.abspath(output_dir), item.get('settings') or {}))
+    if not rules:
+        raise ValueError("No rules")
+    return rules
+
+
+def match_rule(rules, rel_path, found):
+    """The first rule for a file (a discovery.Found) at `rel_path` in the inbox, or None."""
+    for rule in rules:
+        if rule.pattern and not (fnmatch.fnmatch(rel_path, rule.pattern)
+                                 or fnmatch.fnmatch(os.path.basename(rel_path), rule.pattern)):
+            continue
+        if rule.media and rule.media != found.media_type:
+            continue
+        if found.media_type in ACCEPTED_SOURCES[media_type_for_format(rule.to_format)]:
+            return rule
+    return None
+
+
+def _signature(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class InboxWatcher:
+    """
+    Watches `inbox` and converts what arrives according to `rules`. Call
+    run() to watch until stop() is called (or Ctrl+C).
+
+    :param done_dir: Optional folder converted inputs are moved to.
+    :param job_queue: The JobQueue to run conversions on; by default one
+        with its own queue file next to the state file.
+    :param use_events: Use watchdog events if it is installed (default), or
+        always poll.
+    :param log: Callable taking one line per event; print by default.
+    """
+
+    def __init__(self, inbox, rules, recursive=True, done_dir=None, job_queue=None, budget=None,
+                 state_path=None, use_events=True, log=print):
+        self.inbox = os.path.abspath(inbox)
+        self.rules = rules
+        self.recursive = recursive
+        self.done_dir = os.path.abspath(done_dir) if done_dir else None
+        self.log = log
+        self.state_path = state_path or default_state_path(self.inbox)
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        self.state = self._load_state()
+        # Outputs and moved inputs must never be taken for new arrivals.
+        self.excluded = {rule.output_dir for rule in rules} | ({self.done_dir} if self.done_dir else set())
+
+        self.pending = {}      # path -> (signature, time it last changed)
+        self.ready = []        # settled paths waiting for room in the queue
+        self.in_flight = {}    # path -> signature when submitted
+        self.finished = queue_module.Queue()
+        self.changed = set()   # paths reported by watchdog
+        self.changed_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.observer = None
+        self.use_events = use_events
+
+        self.job_queue = job_queue or JobQueue(os.path.splitext(self.state_path)[0] + '-queue.json',
+                                               budget=budget, listener=self._on_entry)
+        if job_queue is not None:
+            job_queue.listener = self._on_entry
+        for entry in self.job_queue.entries:
+            if not entry.finished:
+                # Restored from the last run: it will be converted, so do not submit it again.
+                self.in_flight[entry.job.input_path] = self._signature_or_none(entry.job.input_path)
+
+    # --- Public API ---
+
+    def run(self):
+        os.makedirs(self.inbox, exist_ok=True)
+        self._start_observer()
+        self.job_queue.start()
+        mode = "events" if self.observer else f"polling every {POLL_SECONDS:g} s"
+        self.log(f"Watching {self.inbox} ({mode}).")
+        next_scan = 0.0
+        try:
+            while not self.stop_event.is_set():
+                now = time.monotonic()
+                if now >= next_scan:
+                    self._scan()
+                    next_scan = now + (RESCAN_SECONDS if self.observer else POLL_SECONDS)
+                self._take_events()
+                self._settle(time.monotonic())
+                self._submit()
+                self._collect()
+                self.stop_event.wait(TICK_SECONDS)
+        finally:
+            if self.observer:
+                self.observer.stop()
+                self.observer.join()
+            # Unfinished jobs stay in the queue file and run on the next start.
+            self.job_queue.shutdown()
+            self._collect()
+            self._save_state()
+
+    def stop(self):
+        self.stop_event.set()
+
+    # --- Finding arrivals ---
+
+    def _start_observer(self):
+        if not self.use_events:
+            return
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if not event.is_directory:
+                    with watcher.changed_lock:
+                        watcher.changed.add(getattr(event, 'dest_path', None) or event.src_path)
+
+        self.observer = Observer()
+        self.observer.schedule(Handler(), self.inbox, recursive=self.recursive)
+        self.observer.start()
+
+    def _wanted(self, path):
+        name = os.path.basename(path)
+        if name.startswith((TEMP_PREFIX, '.')):
+            return False
+        return not any(path == excluded or path.startswith(excluded + os.sep) for excluded in self.excluded)
+
+    def _scan(self):
+        for path in walk(self.inbox, self.recursive):
+            self._consider(path)
+
+    def _take_events(self):
+        with self.changed_lock:
+            paths, self.changed = self.changed, set()
+        for path in paths:
+            if os.path.isfile(path):
+                self._consider(path)
+
+    def _consider(self, path):
+        """Starts (or keeps) timing a file that is new or changed since it was handled."""
+        if not self._wanted(path) or path in self.in_flight or path in self.ready:
+            return
+        signature = self._signature_or_none(path)
+        if signature is None:
+            self.pending.pop(path, None)
+            return
+        recorded = self.state.get(self._relative(path))
+        if recorded and tuple(recorded['signature']) == signature:
+            return
+        previous = self.pending.get(path)
+        if previous is None or previous[0] != signature:
+            self.pending[path] = (signature, time.monotonic())
+
+    def _settle(self, now):
+        """Moves files whose size and mtime held still for SETTLE_SECONDS to `ready`."""
+        for path, (signature, since) in list(self.pending.items()):
+            current = self._signature_or_none(path)
+            if current is None:
+                del self.pending[path]
+            elif current != signature:
+                self.pending[path] = (current, now)
+            elif now - since >= SETTLE_SECONDS:
+                del self.pending[path]
+                self.ready.append(path)
+
+    # --- Converting ---
+
+    def _submit(self):
+        """Queues ready files, keeping at most MAX_BACKLOG jobs waiting."""
+        counts = self.job_queue.counts()
+        room = MAX_BACKLOG - counts.get('queued', 0)
+        jobs = []
+        while self.ready and room > 0:
+            path = self.ready.pop(0)
+            rel_path = self._relative(path)
+            signature = self._signature_or_none(path)
+            found = detect(path) if signature else None
+            rule = match_rule(self.rules, rel_path, found) if found else None
+            if rule is None:
+                if signature:
+                    self._record(rel_path, signature, IGNORED)
+                continue
+            jobs.append(Job(media_type_for_format(rule.to_format), path, rule.output_dir,
+                            rule.to_format, rule.settings))
+            self.in_flight[path] = signature
+            room -= 1
+        if jobs:
+            self.job_queue.submit(jobs)
+            self.log(f"Queued {len(jobs)} file(s).")
+
+    def _on_entry(self, entry):
+        # Called from the queue's threads.
+        if entry.finished:
+            self.finished.put(entry)
+
+    def _collect(self):
+        """Records the conversions that finished, and moves their inputs to done_dir."""
+        collected = False
+        while True:
+            try:
+                entry = self.finished.get_nowait()
+            except queue_module.Empty:
+                break
+            collected = True
+            path = entry.job.input_path
+            signature = self.in_flight.pop(path, None)
+            result = entry.result
+            rel_path = self._relative(path)
+            if result:
+                self.log(f"Converted {rel_path} -> {result.output_path} ({result.seconds:.1f} s)")
+                self._record(rel_path, signature, CONVERTED)
+                if self.done_dir:
+                    self._move_done(path, rel_path)
+            else:
+                error = result.error if result is not None else "cancelled"
+                self.log(f"Failed {rel_path}: {error}")
+                self._record(rel_path, signature, FAILED)
+        if collected:
+            self.job_queue.forget_finished()
+            self._save_state()
+
+    def _move_done(self, path, rel_path):
+        target = os.path.join(self.done_dir, rel_path)
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+            self.state.pop(rel_path, None)
+        except OSError as e:
+            self.log(f"Could not move {rel_path} to {self.done_dir}: {e}")
+
+    # --- State ---
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.inbox).replace(os.sep, '/')
+
+    def _signature_or_none(self, path):
+        try:
+            return _signature(path)
+        except OSError:
+            return None
+
+    def _record(self, rel_path, signature, status):
+        if signature is not None:
+            self.state[rel_path] = {'signature': list(signature), 'status': status}
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == STATE_VERSION and data.get('inbox') == self.inbox:
+                return data.get('files', {})
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def _save_state(self):
+        directory = os.path.dirname(self.state_path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.watch-', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            files = {path: item for path, item in self.state.items() if item['status'] != IGNORED}
+            json.dump({'version': STATE_VERSION, 'inbox': self.inbox, 'files': files}, f, indent=1)
+        os.replace(tmp_path, self.state_path)
+
+    def mark_existing(self):
+        """Records the files already in the inbox as handled, so that only new arrivals are converted."""
+        for path in walk(self.inbox, self.recursive):
+            signature = self._signature_or_none(path)
+            if self._wanted(path) and signature and path not in self.in_flight:
+                self.state.setdefault(self._relative(path), {'signature': list(signature), 'status': EXISTING})
+        self._save_state()
+
+
+def default_state_path(inbox):
+    """The state file of an inbox, in the config directory (the inbox itself may be shared)."""
+    key = hashlib.sha1(os.path.abspath(inbox).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(config_dir(), 'watch', f"{key}.json")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m watch",
+                                     description="Convert files as they arrive in a folder.")
+    parser.add_argument('inbox', nargs='?', help="Folder to watch (or 'inbox' in the config file).")
+    parser.add_argument('-c', '--config', help="JSON rules file; see the module documentation.")
+    parser.add_argument('-t', '--to', dest='to_format', help="Without --config: target format for every file.")
+    parser.add_argument('-o', '--output-dir', help="Without --config: where to write converted files.")
+    parser.add_argument('--pattern', help="Without --config: only files matching this glob, e.g. '*.wav'.")
+    parser.add_argument('--done-dir', help="Move converted inputs here.")
+    parser.add_argument('--no-recursive', dest='recursive', action='store_false', default=None,
+                        help="Ignore subfolders of the inbox.")
+    parser.add_argument('--ignore-existing', action='store_true',
+                        help="Do not convert the files already in the inbox, only new arrivals.")
+    parser.add_argument('--poll', action='store_true', help="Poll the folder even if watchdog is installed.")
+    parser.add_argument('-j', '--jobs', type=int, default=default_workers(),
+                        help="Threads the running conversions may use together (default: number of CPUs).")
+    parser.add_argument('--memory-budget', type=int, metavar='MB',
+                        help="Memory the running conversions may use together, by estimate "
+                             "(default: half of physical memory).")
+    args = parser.parse_args(argv)
+
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    elif args.to_format and args.output_dir:
+        config = {'rules': [{'pattern': args.pattern, 'to': args.to_format, 'output_dir': args.output_dir}]}
+    else:
+        parser.error("give --config, or -t and -o")
+    inbox = args.inbox or config.get('inbox')
+    if not inbox:
+        parser.error("no inbox folder given")
+    try:
+        rules = load_rules(config)
+    except ValueError as e:
+        parser.error(str(e))
+
+    recursive = config.get('recursive', True) if args.recursive is None else args.recursive
+    budget = ResourceBudget(threads=args.jobs, memory=args.memory_budget * MB if args.memory_budget else None)
+    watcher = InboxWatcher(inbox, rules, recursive, args.done_dir or config.get('done_dir'),
+                           budget=budget, use_events=not args.poll,
+                           log=lambda line: print(time.strftime('%H:%M:%S'), line, flush=True))
+    if args.ignore_existing:
+        watcher.mark_existing()
+    # A service manager stops the daemon with SIGTERM: save the queue and state as for Ctrl+C.
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    # Required for the conversion process pool when frozen, as in main_pyside.
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())